@@ -1,10 +1,43 @@
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
 import os
+import re
+import csv
+import json
+import queue
+import random
+import shutil
+import signal
+import hashlib
+import hmac
+import atexit
+import asyncio
+import logging
+import sqlite3
+import tempfile
+import threading
+import urllib.parse
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import Mapping
+from contextlib import aclosing, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
 import gradio as gr
-from groq import Groq
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from groq import Groq, AsyncGroq, APIConnectionError, DefaultAsyncHttpxClient
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.embeddings import Embeddings
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from embedding_server import EMBEDDING_SERVER, RemoteCrossEncoder, connect_embeddings
+
+# langchain_community (FAISS), langchain_huggingface (torch +
+# sentence-transformers) and the text splitter are imported lazily by the
+# functions that use them, so importing app.py and binding the UI stay fast.
 
 # ==============================
 # CONFIG
@@ -12,726 +45,4456 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 MODEL_NAME = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
 
-if not GROQ_API_KEY:
+# LLM backend (see LLM BACKENDS below): "groq", or "openai" for any
+# OpenAI-compatible server (llama.cpp, vLLM, Ollama, ...) at LLM_BASE_URL.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "http://localhost:8080/v1")
+LLM_API_KEY = os.getenv("LLM_API_KEY")
+LLM_MODEL = os.getenv("LLM_MODEL", MODEL_NAME)
+# Cheaper/faster model used while the primary is rate-limited or failing.
+# Empty disables failover.
+LLM_FALLBACK_MODEL = os.getenv(
+    "LLM_FALLBACK_MODEL", "llama-3.1-8b-instant" if LLM_BACKEND == "groq" else ""
+)
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "60"))
+LLM_READ_TIMEOUT_SECONDS = float(os.getenv("LLM_READ_TIMEOUT_SECONDS", "20"))  # first token / between tokens
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "4"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+if LLM_BACKEND == "groq" and not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY not found. Please add it in HuggingFace Space Secrets.")
 
-client = Groq(api_key=GROQ_API_KEY)
+# Retries are done by ResilientLLM (with failover), not inside the SDK.
+client = Groq(api_key=GROQ_API_KEY, max_retries=0) if LLM_BACKEND == "groq" else None
 INDEX_PATH = "faiss_index"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# "torch" (default), "onnx" (ONNX Runtime, fp32) or "onnx-int8" (dynamically
+# quantized ONNX). Run `python benchmark.py embeddings` to compare speed and
+# retrieval overlap before switching.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_ONNX_FILES = {
+    "onnx": os.getenv("EMBEDDING_ONNX_FILE", "onnx/model.onnx"),
+    "onnx-int8": os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx"),
+}
+EMBEDDING_EXPORT_DIR = os.getenv("EMBEDDING_EXPORT_DIR", "embedding_models")
+CHUNKER = os.getenv("CHUNKER", "structured")  # structured | recursive (see STRUCTURED CHUNKER)
+CHUNK_SIZE = 600
+CHUNK_OVERLAP = 80  # recursive only
+CHUNK_MIN_CHARS = 160  # structured only: shorter sections join the one before them
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.sqlite"
+LEGACY_DOCSTORE_FILE = "index.pkl"  # FAISS.save_local's pickle, converted on load
+LEGACY_LEXICAL_FILE = "lexical.json"
+# Partitions below INDEX_TRAIN_THRESHOLD chunks are searched exactly (flat);
+# once one crosses it, it is trained into INDEX_TYPE. Run
+# `python benchmark.py index` to compare recall, latency and memory.
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")  # flat | ivf-flat | ivf-pq | hnsw
+INDEX_TRAIN_THRESHOLD = int(os.getenv("INDEX_TRAIN_THRESHOLD", "10000"))
+INDEX_NLIST = int(os.getenv("INDEX_NLIST", "0"))  # IVF cells, 0 = sqrt(chunks)
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "16"))  # IVF cells searched per query
+INDEX_PQ_M = int(os.getenv("INDEX_PQ_M", "48"))  # PQ sub-quantizers, must divide the dimension (384)
+INDEX_PQ_BITS = 8
+INDEX_HNSW_M = int(os.getenv("INDEX_HNSW_M", "32"))
+INDEX_HNSW_EF_CONSTRUCTION = int(os.getenv("INDEX_HNSW_EF_CONSTRUCTION", "80"))
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))
+INDEX_MMAP = os.getenv("INDEX_MMAP", "1") == "1"  # memory-map partitions that load unchanged
+# Only load the index files another process wrote, never build or update
+# them: set for serve.py's workers, whose coordinator owns faiss_index/.
+INDEX_READ_ONLY = os.getenv("INDEX_READ_ONLY", "0") == "1"
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+RRF_K = 60  # standard reciprocal-rank-fusion damping constant
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "5"))
+RETRIEVAL_K_PER_UNIVERSITY = int(os.getenv("RETRIEVAL_K_PER_UNIVERSITY", "3"))
+
+# Async serving path (see achat below). One AsyncGroq client is shared by all
+# conversations so HTTP connections are pooled and kept alive between requests.
+USE_ASYNC_CHAT = os.getenv("USE_ASYNC_CHAT", "1") == "1"
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "200"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "50"))
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+GRADIO_CONCURRENCY = int(os.getenv("GRADIO_CONCURRENCY", "200"))
+GRADIO_MAX_QUEUE = int(os.getenv("GRADIO_MAX_QUEUE", "1000"))
+GRADIO_MAX_THREADS = int(os.getenv("GRADIO_MAX_THREADS", "40"))  # only matters for the sync path
+
+# Semantic answer cache (see SemanticCache below). Set SEMANTIC_CACHE_PATH to
+# keep cached answers across restarts.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 3600)))
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH")
+SEMANTIC_CACHE_SAVE_EVERY = int(os.getenv("SEMANTIC_CACHE_SAVE_EVERY", "25"))
+
+async_client = AsyncGroq(
+    api_key=GROQ_API_KEY,
+    max_retries=0,
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=GROQ_MAX_CONNECTIONS,
+            max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+        )
+    ),
+) if LLM_BACKEND == "groq" else None
+
+# Embedding + FAISS search are CPU-bound and blocking, so the async path
+# runs them here instead of on the event loop.
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval"
+)
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger("universe_pk")
 
 # ==============================
-# KNOWLEDGE BASE
-# 4 Universities: COMSATS, NUST, UET Lahore, QAU
-# ==============================
-KNOWLEDGE_BASE = [
-
-    # ─────────────────────────────
-    # COMSATS UNIVERSITY ISLAMABAD
-    # ─────────────────────────────
-    Document(page_content="""
-University: COMSATS University Islamabad (CUI)
-Type: Public Federal University
-Ministry: Ministry of Science & Technology
-Campuses: Islamabad, Lahore, Abbottabad, Wah, Attock, Vehari, Sahiwal
-Website: www.comsats.edu.pk
-Established: 2000
-HEC Ranking: Ranked #1 in IT, #2 in Research in Pakistan
-Total Students: 34,500+
-PhD Faculty: 1,109+
-""", metadata={"university": "COMSATS", "topic": "general"}),
-
-    Document(page_content="""
-University: COMSATS University Islamabad (CUI)
-Topic: Undergraduate Admissions
-
-Eligibility for BS Programs:
-- Minimum 50% marks in FSc / A-Levels / ICS / equivalent qualification
-- NTS or university entry test may be required for some programs
-- Admissions twice a year: Fall (June) and Spring (October/November)
-
-BS Programs offered:
-- BS Computer Science
-- BS Software Engineering
-- BS Artificial Intelligence
-- BS Data Science
-- BS Cyber Security
-- BS Electrical Engineering
-- BS Computer Engineering
-- BS Mathematics
-- BS Physics
-- BS Chemistry
-- BS Biosciences / Bioinformatics
-- BS Business Administration (BBA)
-- BS Economics
-- BS Finance & Accounting
-- BS Psychology
-- BS Media & Communication
-- BS International Relations
-- BS English
-- BFA Fine Arts
-- B.Arch Architecture
-- BS Interior Design
-- BS Remote Sensing & GIS
-
-How to Apply:
-- Apply online at: admissions.comsats.edu.pk
-- Submit application form before deadline
-- Upload transcripts, CNIC, passport photos
-- Pay application fee online
-""", metadata={"university": "COMSATS", "topic": "undergraduate admissions"}),
-
-    Document(page_content="""
-University: COMSATS University Islamabad (CUI)
-Topic: Graduate (MS) Admissions
-
-Eligibility for MS Programs:
-- BS/BE degree (4 years) in relevant field
-- Minimum 2.0 CGPA (on 4.0 scale) or 45% marks
-- GAT General test with minimum 50% marks OR GRE equivalent
-- NTS GAT is mandatory for most MS programs
-
-MS Programs offered:
-- MS Computer Science
-- MS Software Engineering
-- MS Artificial Intelligence
-- MS Data Science
-- MS Electrical Engineering
-- MS Mathematics
-- MS Physics
-- MS Chemistry
-- MS Environmental Sciences
-- MS Biotechnology
-- MS Business Administration (MBA)
-- MS Management Sciences
-- MS Economics
-- MS Psychology
-- MS Architecture
-- MS Fine Arts
-
-Admission Schedule:
-- Fall: Applications open June, classes start September
-- Spring: Applications open October/November, classes start February
-- Spring 2026 deadline was January 3, 2026
-""", metadata={"university": "COMSATS", "topic": "graduate ms admissions"}),
-
-    Document(page_content="""
-University: COMSATS University Islamabad (CUI)
-Topic: PhD Admissions
-
-Eligibility for PhD Programs:
-- MS/MPhil degree in relevant field
-- Minimum 3.0 CGPA (on 4.0 scale) or 60% marks
-- GAT Subject test with minimum 60% marks OR GRE Subject test
-- Research proposal may be required
-- Interview with departmental committee
-
-PhD Programs offered:
-- PhD Computer Science
-- PhD Electrical Engineering
-- PhD Mathematics
-- PhD Physics
-- PhD Chemistry
-- PhD Biosciences
-- PhD Environmental Sciences
-- PhD Management Sciences
-- PhD Economics
-
-PhD Duration: 3 to 5 years
-Funding: HEC Indigenous Scholarships available for PhD students
-""", metadata={"university": "COMSATS", "topic": "phd admissions"}),
-
-    Document(page_content="""
-University: COMSATS University Islamabad (CUI)
-Topic: Fee Structure
-
-BS Program Fees (per semester):
-- Engineering programs: PKR 55,000 – PKR 75,000
-- Computer Science / IT: PKR 55,000 – PKR 70,000
-- Natural Sciences: PKR 45,000 – PKR 60,000
-- Management Sciences: PKR 45,000 – PKR 60,000
-- Social Sciences / Humanities: PKR 35,000 – PKR 50,000
-
-MS Program Fees (per semester):
-- Engineering / CS: PKR 60,000 – PKR 90,000
-- Management / Sciences: PKR 55,000 – PKR 80,000
-
-PhD Program Fees (per semester):
-- All programs: PKR 65,000 – PKR 100,000
-
-Note: Fees vary by campus. Islamabad campus may be slightly higher.
-Scholarships: Need-based and merit-based scholarships available.
-HEC need-based scholarships also accepted.
-""", metadata={"university": "COMSATS", "topic": "fees"}),
-
-    # ─────────────────────────────
-    # NUST
-    # ─────────────────────────────
-    Document(page_content="""
-University: National University of Sciences and Technology (NUST)
-Type: Public Sector University (Federally Chartered)
-Location: H-12, Islamabad, Pakistan
-Website: www.nust.edu.pk
-Established: 1991
-HEC Ranking: Top 5 in Pakistan, ranked in QS World Rankings
-Total Students: 15,000+
-Constituent Colleges: SEECS, SCME, SNS, SMME, SADA, ASAB, S3H, NIPCONS, NBS, MCS, CAE, PNEC, CEME, NICE
-""", metadata={"university": "NUST", "topic": "general"}),
-
-    Document(page_content="""
-University: NUST
-Topic: Undergraduate Admissions
-
-Eligibility for BE/BS Programs:
-- Minimum 60% marks in FSc Pre-Engineering / Pre-Medical / A-Levels
-- Mandatory entry test: NET (NUST Entry Test) — conducted by NUST itself
-- NET score is the primary basis for merit
-- No NTS required; NUST conducts its own test
-
-Undergraduate Programs offered:
-- BE Electrical Engineering
-- BE Mechanical Engineering
-- BE Civil Engineering
-- BE Chemical Engineering
-- BE Computer Engineering
-- BE Software Engineering
-- BE Avionics Engineering
-- BE Aerospace Engineering
-- BS Computer Science
-- BS Artificial Intelligence
-- BS Data Science
-- BS Biosciences
-- BS Environmental Sciences
-- BS Mathematics
-- BS Physics
-- BS Chemistry
-- BS Economics
-- BBA (Business Administration)
-- BS Accounting & Finance
-- BS Media & Communication Studies
-- BS Architecture
-- BS Industrial Design
-
-Admission Process:
-- Register on nust.edu.pk for NET
-- NET conducted multiple times per year (NET-1, NET-2, NET-3)
-- Merit list based on NET score + FSc marks
-- Provincial seats quota applies
-- Admissions once a year (Fall semester only for most programs)
-""", metadata={"university": "NUST", "topic": "undergraduate admissions"}),
-
-    Document(page_content="""
-University: NUST
-Topic: Graduate (MS/MPhil) Admissions
-
-Eligibility for MS Programs:
-- 4-year BS/BE degree in relevant field
-- Minimum 2.5 CGPA (on 4.0 scale)
-- GAT General test with 50% marks OR GRE General (quantitative 145+)
-- Some programs require GRE Subject test
-
-MS Programs offered (selected):
-- MS Electrical Engineering
-- MS Mechanical Engineering
-- MS Civil Engineering
-- MS Computer Science
-- MS Software Engineering
-- MS Artificial Intelligence
-- MS Data Science
-- MS Biosciences
-- MS Environmental Engineering
-- MS Mathematics
-- MS Physics
-- MBA / MS Management Sciences
-- MS Economics
-
-Admissions: Spring (January) and Fall (August/September) semesters
-Application Portal: nust.edu.pk/admissions
-""", metadata={"university": "NUST", "topic": "graduate ms admissions"}),
-
-    Document(page_content="""
-University: NUST
-Topic: PhD Admissions
-
-Eligibility for PhD:
-- MS/MPhil degree in relevant field
-- Minimum 3.0 CGPA or 70% marks
-- GAT Subject test 60% marks OR GRE Subject test
-- Research proposal required
-- Interview with supervisor/committee mandatory
-
-PhD Programs: Available in all major engineering and science departments
-PhD Duration: 3–5 years minimum
-Funding: HEC Indigenous PhD Scholarships, NUST Research Assistantships available
-
-Note: PhD students often work as Teaching/Research Assistants and receive stipends.
-""", metadata={"university": "NUST", "topic": "phd admissions"}),
-
-    Document(page_content="""
-University: NUST
-Topic: Fee Structure
-
-BE/BS Program Fees (per semester):
-- Engineering programs: PKR 145,000 – PKR 185,000
-- Computer Science / IT: PKR 145,000 – PKR 175,000
-- Natural / Social Sciences: PKR 120,000 – PKR 150,000
-- Management / Business: PKR 130,000 – PKR 160,000
-
-MS Program Fees (per semester):
-- Engineering / CS: PKR 150,000 – PKR 190,000
-- Management Sciences: PKR 140,000 – PKR 170,000
-
-PhD Program Fees (per semester):
-- All programs: PKR 90,000 – PKR 130,000 (lower due to research nature)
-
-Hostel: Available on campus; separate hostel fees apply
-Scholarships:
-- NUST Merit Scholarship for top 10% students
-- Need-based financial aid
-- HEC scholarships accepted
-- NUST offers fee waivers for high NET scorers
-""", metadata={"university": "NUST", "topic": "fees"}),
-
-    # ─────────────────────────────
-    # UET LAHORE
-    # ─────────────────────────────
-    Document(page_content="""
-University: University of Engineering and Technology (UET) Lahore
-Type: Public Sector University (Provincial)
-Location: Grand Trunk Road, Lahore, Punjab
-Website: www.uet.edu.pk
-Established: 1921 (oldest engineering university in Pakistan)
-Campuses: Main campus Lahore, Narowal, Rachna, Kala Shah Kaku
-HEC Ranking: Top engineering university in Punjab
-""", metadata={"university": "UET Lahore", "topic": "general"}),
-
-    Document(page_content="""
-University: UET Lahore
-Topic: Undergraduate Admissions
-
-Eligibility for BE/BS Programs:
-- Minimum 60% marks in FSc Pre-Engineering (Mathematics, Physics, Chemistry)
-- Mandatory entry test: ECAT (Engineering College Admission Test) conducted by UET
-- ECAT score + FSc marks = final merit
-- Punjab domicile applicants get provincial seats
-
-Undergraduate Programs offered:
-- BE Civil Engineering
-- BE Mechanical Engineering
-- BE Electrical Engineering
-- BE Chemical Engineering
-- BE Computer Engineering
-- BE Software Engineering
-- BE Metallurgical & Materials Engineering
-- BE Industrial Engineering
-- BE Environmental Engineering
-- BE Petroleum & Gas Engineering
-- BS Architecture
-- BS City & Regional Planning
-- BS Computer Science
-- BS Mathematics
-- BS Physics
-- BS Chemistry
-- BS Food Engineering
-- BE Agricultural Engineering
-- BE Mechatronics Engineering
-
-Admission Schedule:
-- ECAT usually in August
-- Merit list displayed September
-- Classes start October/November
-- Admissions once a year (Fall only)
-
-Application: Apply online at www.uet.edu.pk
-""", metadata={"university": "UET Lahore", "topic": "undergraduate admissions"}),
-
-    Document(page_content="""
-University: UET Lahore
-Topic: Graduate (MS/MPhil) Admissions
-
-Eligibility for MS Programs:
-- 4-year BS/BE degree in relevant field
-- Minimum 2.5 CGPA (on 4.0 scale) or 60% marks
-- GAT General test with 50% marks OR GRE equivalent
-- Written test / interview by department
-
-MS Programs offered:
-- MS Civil Engineering
-- MS Structural Engineering
-- MS Geotechnical Engineering
-- MS Mechanical Engineering
-- MS Electrical Engineering
-- MS Power Engineering
-- MS Computer Science
-- MS Software Engineering
-- MS Chemical Engineering
-- MS Environmental Engineering
-- MS Materials Engineering
-- MS Industrial Engineering
-- MS Mathematics
-- MS Physics
-- MS Chemistry
-
-Admissions: Spring (February) and Fall (September) semesters
-""", metadata={"university": "UET Lahore", "topic": "graduate ms admissions"}),
-
-    Document(page_content="""
-University: UET Lahore
-Topic: PhD Admissions
-
-Eligibility for PhD:
-- MS/MPhil degree in relevant engineering or science field
-- Minimum 3.0 CGPA or 60% marks in MS
-- GAT Subject test with 60% marks OR GRE Subject test
-- Research proposal submission required
-- Departmental interview mandatory
-
-PhD Programs: Available in all engineering and applied science departments
-PhD Duration: 3–5 years
-Funding: HEC Indigenous Scholarships, departmental research grants
-
-Key strength: UET Lahore has strong industry connections in Lahore for research collaboration.
-""", metadata={"university": "UET Lahore", "topic": "phd admissions"}),
-
-    Document(page_content="""
-University: UET Lahore
-Topic: Fee Structure
-
-BE/BS Program Fees (per semester):
-- Engineering programs: PKR 45,000 – PKR 90,000
-- Computer Science: PKR 45,000 – PKR 80,000
-- Architecture / Planning: PKR 40,000 – PKR 70,000
-- Natural Sciences: PKR 35,000 – PKR 60,000
-
-Note: UET is a public university so fees are government-subsidized and lower than private universities.
-
-MS Program Fees (per semester):
-- Engineering / CS: PKR 55,000 – PKR 85,000
-
-PhD Program Fees (per semester):
-- All programs: PKR 50,000 – PKR 80,000
-
-Hostel: On-campus hostels available for boys and girls. Separate hostel fee.
-Scholarships:
-- Punjab government merit scholarships
-- HEC need-based scholarships
-- University gold medals and awards for top students
-""", metadata={"university": "UET Lahore", "topic": "fees"}),
-
-    # ─────────────────────────────
-    # QAU
-    # ─────────────────────────────
-    Document(page_content="""
-University: Quaid-i-Azam University (QAU)
-Type: Public Federal University
-Location: Islamabad, Pakistan
-Website: www.qau.edu.pk
-Established: 1967
-HEC Ranking: Ranked among Top 3 universities in Pakistan for research
-Notable for: Strong research in Natural Sciences, Social Sciences, and Biosciences
-""", metadata={"university": "QAU", "topic": "general"}),
-
-    Document(page_content="""
-University: QAU (Quaid-i-Azam University)
-Topic: Undergraduate Admissions
-
-Eligibility for BS Programs:
-- Minimum 45%–50% marks in FSc / A-Levels / equivalent
-- Entry test conducted by QAU or NTS
-- Merit-based admissions
-
-BS Programs offered:
-- BS Mathematics
-- BS Physics
-- BS Chemistry
-- BS Computer Science
-- BS Biosciences
-- BS Biochemistry
-- BS Microbiology
-- BS Biotechnology
-- BS Environmental Sciences
-- BS Statistics
-- BS Economics
-- BS Psychology
-- BS Sociology
-- BS Political Science
-- BS International Relations
-- BS History
-- BS English Literature
-- BS Gender Studies
-- BS Anthropology
-- BS Pakistan Studies
-- BS Pharmacy (PharmD)
-- BS Law (LLB)
-
-Duration: 4 years (8 semesters)
-Admissions: Once a year, Fall semester (August/September)
-Application: Online via qau.edu.pk
-""", metadata={"university": "QAU", "topic": "undergraduate admissions"}),
-
-    Document(page_content="""
-University: QAU (Quaid-i-Azam University)
-Topic: Graduate (MS/MPhil) Admissions
-
-Eligibility for MS/MPhil Programs:
-- 4-year BS degree (or 2-year BSc + 2-year MSc) in relevant field
-- Minimum 2.0 CGPA or 45% marks
-- GAT General test with minimum 50% marks (mandatory — HEC requirement)
-- Written departmental test and/or interview
-
-MS/MPhil Programs offered:
-- MS/MPhil Mathematics
-- MS/MPhil Physics
-- MS/MPhil Chemistry
-- MS/MPhil Computer Science
-- MS/MPhil Biosciences
-- MS/MPhil Biochemistry
-- MS/MPhil Microbiology
-- MS/MPhil Biotechnology
-- MS/MPhil Environmental Sciences
-- MS/MPhil Statistics
-- MS/MPhil Economics
-- MS/MPhil Psychology
-- MS/MPhil Sociology
-- MS/MPhil Political Science
-- MS/MPhil International Relations
-- MS/MPhil History
-- MS/MPhil Gender Studies
-
-Admissions: Fall (August) and Spring (January/February) semesters
-""", metadata={"university": "QAU", "topic": "graduate ms admissions"}),
-
-    Document(page_content="""
-University: QAU (Quaid-i-Azam University)
-Topic: PhD Admissions
-
-Eligibility for PhD:
-- MPhil/MS degree in relevant field
-- Minimum 3.0 CGPA or 60% marks
-- GAT Subject test with minimum 60% marks
-- Research proposal required
-- Interview with departmental board
-
-PhD Programs:
-- Available in all departments (Sciences, Social Sciences, Biosciences, Pharmacy, Law)
-- PhD Mathematics, Physics, Chemistry, Computer Science, Biosciences most popular
-
-PhD Duration: 3–5 years
-Funding:
-- HEC Indigenous PhD Scholarships (fully funded)
-- QAU Research Grants
-- International research collaborations available
-
-QAU is particularly strong in research — many faculty are HEC Distinguished Professors.
-""", metadata={"university": "QAU", "topic": "phd admissions"}),
-
-    Document(page_content="""
-University: QAU (Quaid-i-Azam University)
-Topic: Fee Structure
-
-BS Program Fees (per semester):
-- Natural Sciences (Physics, Chemistry, Math, Bio): PKR 15,000 – PKR 30,000
-- Computer Science: PKR 20,000 – PKR 35,000
-- Social Sciences / Humanities: PKR 12,000 – PKR 25,000
-- Pharmacy (PharmD): PKR 35,000 – PKR 55,000
-- Law (LLB): PKR 20,000 – PKR 35,000
-
-Note: QAU is a federal public university with heavily subsidized fees — among the lowest in Pakistan.
-
-MS/MPhil Fees (per semester):
-- All programs: PKR 20,000 – PKR 45,000
-
-PhD Fees (per semester):
-- All programs: PKR 25,000 – PKR 50,000
-
-Hostel: On-campus hostels available for boys and girls at low cost
-Scholarships:
-- HEC need-based scholarships
-- Federal government merit scholarships
-- Departmental assistantships for MS/PhD students
-""", metadata={"university": "QAU", "topic": "fees"}),
-
-    # ─────────────────────────────
-    # COMPARISON DOCS
-    # ─────────────────────────────
-    Document(page_content="""
-Topic: Comparison of 4 Pakistani Universities
-
-Fee Comparison (BS per semester, approximate):
-- QAU: PKR 12,000 – PKR 55,000 (cheapest, federal public university)
-- UET Lahore: PKR 35,000 – PKR 90,000 (affordable public university)
-- COMSATS: PKR 35,000 – PKR 75,000 (public but self-financed)
-- NUST: PKR 120,000 – PKR 185,000 (most expensive among the four)
-
-Entry Test Comparison:
-- COMSATS: NTS GAT or university test
-- NUST: NET (NUST's own test — most competitive)
-- UET Lahore: ECAT (UET's own test)
-- QAU: NTS or departmental test
-
-Minimum FSc Marks:
-- QAU: 45%–50%
-- COMSATS: 50%
-- UET Lahore: 60%
-- NUST: 60% (and high NET score required)
-
-Scholarship Availability: All four offer HEC need-based scholarships.
-
-Best for Engineering: NUST, UET Lahore
-Best for Sciences: QAU, COMSATS
-Best for IT/CS: NUST, COMSATS
-Best Affordable Option: QAU (lowest fees), UET Lahore (public engineering)
-""", metadata={"university": "All", "topic": "comparison"}),
-
-    Document(page_content="""
-Topic: PhD Eligibility Summary for All 4 Universities
-
-COMSATS PhD:
-- MS degree, 3.0 CGPA minimum
-- GAT Subject 60% or GRE Subject
-- Research proposal + interview
-
-NUST PhD:
-- MS degree, 3.0 CGPA minimum, 70% marks preferred
-- GAT Subject 60% or GRE Subject
-- Research proposal + supervisor interview
-
-UET Lahore PhD:
-- MS/MPhil in engineering or science
-- 3.0 CGPA or 60% marks
-- GAT Subject 60%
-- Research proposal + departmental interview
-
-QAU PhD:
-- MPhil/MS degree, 3.0 CGPA or 60% marks
-- GAT Subject 60%
-- Research proposal + board interview
-
-Common requirement for all: HEC GAT Subject test is mandatory for PhD admissions in Pakistan.
-HEC Indigenous PhD Scholarship is available at all four universities for deserving candidates.
-""", metadata={"university": "All", "topic": "phd comparison"}),
-
-    Document(page_content="""
-Topic: Scholarships at Pakistani Universities
-
-HEC Need-Based Scholarship:
-- Available at all public universities including COMSATS, NUST, UET, QAU
-- Covers tuition fee partially or fully
-- Based on family income (below PKR 45,000/month household income)
-- Apply via HEC portal: hec.gov.pk
-
-HEC Indigenous PhD Scholarship:
-- Fully funded for Pakistani PhD students
-- Covers tuition + monthly stipend
-- Available at all 4 universities
-
-NUST Merit Scholarship:
-- For top 10% students based on CGPA
-- Partial to full tuition waiver
-
-UET Punjab Government Scholarship:
-- For Punjab domicile students with financial need
-
-COMSATS Need-Based Aid:
-- Internal university scholarship
-- Apply at time of admission
-
-QAU Federal Scholarship:
-- For students from underprivileged areas
-- Hostel accommodation included
-""", metadata={"university": "All", "topic": "scholarships"}),
-]
+# KNOWLEDGE BASE FILES
+# The built-in universities (COMSATS, NUST, UET Lahore, QAU and the
+# cross-university summaries) ship as files under BUILTIN_KB_DIR; more are
+# added as files under KB_DIR, without a code change. Both use one layout:
+#   *.md / *.markdown  one document per file, metadata in a front-matter
+#                      block (---\nuniversity: ...\ntopic: ...\n---)
+#   *.jsonl            one document per line: {"text": ..., "university": ...,
+#                      "topic": ...} or {"page_content": ..., "metadata": {...}}
+# Each document is validated on its own; a bad one is logged and skipped
+# instead of failing the whole load. See reload_knowledge_base for hot reload.
+# ==============================
+KB_DIR = os.getenv("KB_DIR", "knowledge_base")
+KB_INCLUDE_BUILTIN = os.getenv("KB_INCLUDE_BUILTIN", "1") == "1"
+BUILTIN_KB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "builtin_kb")
+BUILTIN_SOURCE_PREFIX = "builtin/"  # keeps built-in sources apart from KB_DIR ones
+KB_MAX_DOCUMENT_CHARS = int(os.getenv("KB_MAX_DOCUMENT_CHARS", "100000"))
+KB_EXTENSIONS = (".md", ".markdown", ".jsonl")
+KB_REQUIRED_FIELDS = ("university", "topic")
+HEADER_LINE = re.compile(r"^(University|Topic):\s*(.+)$")  # first lines of every document
+FRONT_MATTER_PATTERN = re.compile(r"\A---[ \t]*\r?\n(.*?)\r?\n---[ \t]*(?:\r?\n|\Z)", re.DOTALL)
+
+
+class InvalidDocument(ValueError):
+    pass
+
+
+def parse_front_matter(text):
+    # A small subset of YAML: "key: value" lines, with [a, b] for lists.
+    match = FRONT_MATTER_PATTERN.match(text)
+    if match is None:
+        raise InvalidDocument("missing front matter (--- ... ---)")
+    metadata = {}
+    for line in match.group(1).splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        key, sep, value = line.partition(":")
+        if not sep or not key.strip():
+            raise InvalidDocument(f"bad front matter line {line!r}")
+        value = value.strip()
+        if value.startswith("[") and value.endswith("]"):
+            value = [item.strip().strip("'\"") for item in value[1:-1].split(",") if item.strip()]
+        else:
+            value = value.strip("'\"")
+        metadata[key.strip()] = value
+    return metadata, text[match.end():]
+
+
+def validate_document(text, metadata, source):
+    if not isinstance(metadata, dict):
+        raise InvalidDocument("metadata must be an object")
+    for field in KB_REQUIRED_FIELDS:
+        value = metadata.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise InvalidDocument(f"missing {field!r}")
+    if not isinstance(text, str) or not text.strip():
+        raise InvalidDocument("empty document")
+    if len(text) > KB_MAX_DOCUMENT_CHARS:
+        raise InvalidDocument(f"longer than KB_MAX_DOCUMENT_CHARS ({len(text)} > {KB_MAX_DOCUMENT_CHARS})")
+
+    # FAISS metadata filters and the manifest hash want flat, JSON-able values.
+    clean = {}
+    for key, value in metadata.items():
+        if isinstance(value, (list, tuple)):
+            if not all(isinstance(item, str) for item in value):
+                raise InvalidDocument(f"{key!r} must be a list of strings")
+            value = ", ".join(item.strip() for item in value)
+        elif value is not None and not isinstance(value, (str, int, float, bool)):
+            raise InvalidDocument(f"unsupported value for {key!r}")
+        if value is not None:
+            clean[key] = value.strip() if isinstance(value, str) else value
+    clean["source"] = source
+
+    # Same layout as the built-in documents, so chunks and the context packer
+    # always see which university and topic a passage is about.
+    text = text.strip()
+    if not HEADER_LINE.match(text.splitlines()[0]):
+        text = f"University: {clean.get('name', clean['university'])}\nTopic: {clean['topic']}\n\n{text}"
+    return Document(page_content=text, metadata=clean)
+
+
+def read_markdown_document(path, source):
+    with open(path, encoding="utf-8") as f:
+        metadata, text = parse_front_matter(f.read())
+    return validate_document(text, metadata, source)
+
+
+def read_jsonl_documents(path, source, errors):
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            where = f"{source}:{number}"
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise InvalidDocument("not a JSON object")
+                metadata = record.get("metadata")
+                if metadata is None:
+                    metadata = {k: v for k, v in record.items() if k not in ("id", "text", "page_content")}
+                # An "id" keeps a record's identity stable when lines are
+                # inserted above it, so it is not re-embedded needlessly.
+                record_source = f"{source}#{record['id']}" if "id" in record else where
+                yield validate_document(record.get("page_content", record.get("text")), metadata, record_source)
+            except ValueError as e:  # json.JSONDecodeError and InvalidDocument
+                errors.append(f"{where}: {e}")
+
+
+def kb_files(kb_dir=None):
+    kb_dir = KB_DIR if kb_dir is None else kb_dir
+    if not kb_dir or not os.path.isdir(kb_dir):
+        return []
+    found = []
+    for root, dirs, files in os.walk(kb_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if name.lower().endswith(KB_EXTENSIONS) and not name.startswith("."):
+                found.append(os.path.join(root, name))
+    return found
+
+
+def kb_fingerprint(kb_dir=None):
+    # Cheap change detection for the file watcher: no file is read.
+    fingerprint = []
+    paths = kb_files(BUILTIN_KB_DIR) if KB_INCLUDE_BUILTIN else []
+    for path in paths + kb_files(kb_dir):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+
+def iter_kb_documents(kb_dir=None, errors=None, prefix=""):
+    """Yield the valid documents under kb_dir one at a time.
+
+    Problems are appended to `errors` as "source: reason" strings.
+    """
+    kb_dir = KB_DIR if kb_dir is None else kb_dir
+    errors = [] if errors is None else errors
+    seen = set()
+    for path in kb_files(kb_dir):
+        source = prefix + os.path.relpath(path, kb_dir).replace(os.sep, "/")
+        try:
+            if path.lower().endswith(".jsonl"):
+                documents = read_jsonl_documents(path, source, errors)
+            else:
+                documents = [read_markdown_document(path, source)]
+            for doc in documents:
+                # The source is the document's identity in the index manifest.
+                if doc.metadata["source"] in seen:
+                    errors.append(f"{doc.metadata['source']}: duplicate id")
+                    continue
+                seen.add(doc.metadata["source"])
+                yield doc
+        except (OSError, UnicodeDecodeError, InvalidDocument) as e:
+            errors.append(f"{source}: {e}")
+
+
+def builtin_documents(errors=None):
+    """The BUILTIN_KB_DIR documents, or none with KB_INCLUDE_BUILTIN=0."""
+    if not KB_INCLUDE_BUILTIN:
+        return []
+    return list(iter_kb_documents(BUILTIN_KB_DIR, errors, BUILTIN_SOURCE_PREFIX))
+
+
+def load_corpus(kb_dir=None, errors=None):
+    """The built-in documents plus the valid KB_DIR documents.
+
+    Only document texts are held here (a few KB per university); chunks and
+    vectors are built and written one partition at a time by build_partitions.
+    """
+    errors = [] if errors is None else errors
+    documents = builtin_documents(errors)
+    documents.extend(iter_kb_documents(kb_dir, errors))
+    for error in errors:
+        logger.warning("Skipping knowledge base document %s", error)
+    return documents
 
 
 # ==============================
 # BUILD VECTORSTORE
 # ==============================
-def build_vectorstore():
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2"
-    )
+def load_embeddings(backend=None):
+    from langchain_huggingface import HuggingFaceEmbeddings
 
-    if os.path.exists(INDEX_PATH):
-        return FAISS.load_local(
-            INDEX_PATH,
-            embeddings,
-            allow_dangerous_deserialization=True
+    backend = backend or EMBEDDING_BACKEND
+    if backend not in ("torch", *EMBEDDING_ONNX_FILES):
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}; use torch, onnx or onnx-int8")
+
+    # batch_size applies to embed_documents, i.e. index builds and bulk
+    # question batches; chat queries are encoded one at a time.
+    encode_kwargs = {"batch_size": EMBEDDING_BATCH_SIZE}
+    if backend == "torch":
+        return HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL,
+            model_kwargs={"device": "cpu"},
+            encode_kwargs=encode_kwargs,
         )
 
-    splitter = RecursiveCharacterTextSplitter(chunk_size=600, chunk_overlap=80)
-    split_docs = splitter.split_documents(KNOWLEDGE_BASE)
+    model_name = EMBEDDING_MODEL
+    file_name = EMBEDDING_ONNX_FILES[backend]
+    if backend == "onnx-int8":
+        model_name, file_name = quantized_model_path(file_name)
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={"device": "cpu", "backend": "onnx", "model_kwargs": {"file_name": file_name}},
+        encode_kwargs=encode_kwargs,
+    )
+
+
+def quantized_model_path(file_name):
+    """Return (model, file) for the int8 ONNX model.
+
+    The hub ships pre-quantized files for all-MiniLM-L6-v2; if the configured
+    one is missing (e.g. another EMBEDDING_MODEL), quantize the fp32 export
+    once into EMBEDDING_EXPORT_DIR and reuse it on later starts.
+    """
+    from huggingface_hub import file_exists
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    local_dir = os.path.join(EMBEDDING_EXPORT_DIR, EMBEDDING_MODEL.replace("/", "--"))
+    local_file = "onnx/model_quint8_avx2.onnx"
+    if os.path.exists(os.path.join(local_dir, local_file)):
+        return local_dir, local_file
+    try:
+        if file_exists(EMBEDDING_MODEL, file_name):
+            return EMBEDDING_MODEL, file_name
+    except Exception as e:  # offline: fall through to a local export
+        logger.warning("Could not check %s for %s: %s", EMBEDDING_MODEL, file_name, e)
+
+    print(f"Quantizing {EMBEDDING_MODEL} to int8 ONNX in {local_dir} ...")
+    model = SentenceTransformer(EMBEDDING_MODEL, backend="onnx", device="cpu")
+    model.save(local_dir)
+    export_dynamic_quantized_onnx_model(model, "avx2", local_dir, file_suffix="quint8_avx2")
+    return local_dir, local_file
+
+
+# The manifest next to the index records which version of every document is
+# embedded, plus the settings the chunks were produced with. On startup only
+# documents whose content hash changed are re-split and re-embedded; if the
+# settings changed the index is rebuilt from scratch.
+def index_settings():
+    settings = {
+        "embedding_model": EMBEDDING_MODEL,
+        "embedding_backend": EMBEDDING_BACKEND,
+        "splitter": "RecursiveCharacterTextSplitter",
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+    }
+    if CHUNKER != "recursive":
+        settings.update(splitter="StructuredSplitter", chunk_overlap=0, chunk_min_chars=CHUNK_MIN_CHARS)
+    if INDEX_TYPE != "flat":
+        # Only when set, so existing flat indexes keep their manifest.
+        settings["index"] = {
+            "type": INDEX_TYPE,
+            "train_threshold": INDEX_TRAIN_THRESHOLD,
+            "nlist": INDEX_NLIST,
+            "pq_m": INDEX_PQ_M,
+            "hnsw_m": INDEX_HNSW_M,
+            "hnsw_ef_construction": INDEX_HNSW_EF_CONSTRUCTION,
+        }
+    return settings
+
+
+def document_hash(doc):
+    payload = json.dumps(
+        {"page_content": doc.page_content, "metadata": doc.metadata},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def keyed_documents(documents):
+    # Documents are identified by their university/topic metadata (or, for
+    # KB_DIR documents, the file they came from) so that editing the text of
+    # a document replaces its old chunks.
+    keyed = {}
+    for doc in documents:
+        base_key = doc.metadata.get("source") or f"{doc.metadata.get('university', '')}::{doc.metadata.get('topic', '')}"
+        key, n = base_key, 1
+        while key in keyed:
+            n += 1
+            key = f"{base_key}#{n}"
+        keyed[key] = doc
+    return keyed
+
+
+def split_document(splitter, doc, doc_hash):
+    chunks = splitter.split_documents([doc])
+    ids = [f"{doc_hash[:16]}-{i}" for i in range(len(chunks))]
+    return chunks, ids
+
+
+def read_manifest(index_path):
+    try:
+        with open(os.path.join(index_path, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(index_path, manifest):
+    path = os.path.join(index_path, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
 
-    vectorstore = FAISS.from_documents(split_docs, embeddings)
-    vectorstore.save_local(INDEX_PATH)
+
+def invalidate_manifest(index_path):
+    # Dropped before the index files are rewritten, so a crash halfway
+    # through forces a clean rebuild instead of trusting a stale manifest.
+    try:
+        os.remove(os.path.join(index_path, MANIFEST_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def make_splitter(chunker=None):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    chunker = chunker or CHUNKER
+    if chunker == "structured":
+        return StructuredSplitter(CHUNK_SIZE, CHUNK_MIN_CHARS)
+    if chunker != "recursive":
+        raise ValueError(f"Unknown CHUNKER {chunker!r}; use structured or recursive")
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+# ==============================
+# STRUCTURED CHUNKER
+# Splits documents along their own sections instead of every CHUNK_SIZE
+# characters. A section starts at a blank line, at a "Label:" line that
+# opens a list ("Eligibility for BS Programs:", "BS Programs offered:",
+# "MS Program Fees (per semester):") or at a Markdown heading. Sections
+# under CHUNK_MIN_CHARS join the one before them; sections over
+# CHUNK_SIZE are cut between lines, with their label repeated. Each chunk
+# starts with a one-line "[University | Topic]" title instead of relying
+# on the document's header lines, so no chunk needs its neighbours (or an
+# overlap) to say what it is about.
+# ==============================
+LABEL_LINE = re.compile(r"^(?:#{1,6}\s+\S.*|[^-*•\s].{0,100}:)$")
+TITLE_LINE = re.compile(r"^\[(.+)\]$")
+
+
+def section_title(header, metadata):
+    # "University | Topic" from a document's header lines, else its metadata.
+    university = header.get("University") or metadata.get("university", "")
+    topic = header.get("Topic") or metadata.get("topic", "")
+    return " | ".join(p for p in (university, topic) if p and p != ALL_PARTITION)
+
+
+class StructuredSplitter:
+    """Section-aware replacement for RecursiveCharacterTextSplitter.split_documents."""
+
+    def __init__(self, chunk_size=CHUNK_SIZE, min_chars=CHUNK_MIN_CHARS):
+        self.chunk_size = chunk_size
+        self.min_chars = min_chars
+
+    @staticmethod
+    def sections(text):
+        sections, current = [], []
+        for line in text.splitlines():
+            line = line.rstrip()
+            if not line.strip():
+                if current:
+                    sections.append(current)
+                current = []
+                continue
+            if current and LABEL_LINE.match(line.strip()):
+                sections.append(current)
+                current = []
+            current.append(line)
+        if current:
+            sections.append(current)
+        return ["\n".join(lines) for lines in sections]
+
+    @staticmethod
+    def pieces(section, size):
+        # Cut an oversized section between lines; a single line that is still
+        # too long (a paragraph in a KB_DIR file) is cut between sentences.
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        lines = section.splitlines()
+        label = lines[0].strip() if LABEL_LINE.match(lines[0].strip()) else None
+        continued = f"{label.rstrip(':').lstrip('# ')} (continued):" if label else None
+        room = size - len(continued or label or "") - 1
+        long_line = RecursiveCharacterTextSplitter(chunk_size=room, chunk_overlap=0)
+        pieces, current = [], []
+        for line in lines:
+            parts = long_line.split_text(line) if len(line) > room else [line]
+            for part in parts:
+                if current and len("\n".join(current + [part])) > size:
+                    pieces.append("\n".join(current))
+                    current = [continued] if continued else []
+                current.append(part)
+        if current:
+            pieces.append("\n".join(current))
+        return pieces
+
+    def split_text(self, text, size=None):
+        size = size or self.chunk_size
+        merged = []
+        for section in self.sections(text):
+            if merged and (len(section) < self.min_chars or len(merged[-1]) < self.min_chars) \
+                    and len(merged[-1]) + len(section) + 2 <= size:
+                merged[-1] += "\n\n" + section
+            else:
+                merged.append(section)
+        return [piece for section in merged for piece in self.pieces(section, size)]
+
+    def split_documents(self, documents):
+        chunks = []
+        for doc in documents:
+            header, body = split_header(doc.page_content)
+            title = section_title(header, doc.metadata)
+            # The title line counts towards chunk_size.
+            size = max(self.chunk_size - len(title) - 3, self.min_chars)
+            for text in self.split_text(body, size):
+                content = f"[{title}]\n{text}" if title else text
+                chunks.append(Document(page_content=content, metadata=dict(doc.metadata)))
+        return chunks
+
+
+INDEX_TYPES = ("flat", "ivf-flat", "ivf-pq", "hnsw")
+
+
+def index_kind(index):
+    import faiss
+
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf-pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf-flat"
+    return "flat"
+
+
+def index_vectors(index):
+    """All vectors of an index in position order, or None if it only keeps PQ codes."""
+    import faiss
+
+    if index_kind(index) == "ivf-pq":
+        return None
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def tune_index(index):
+    # Search-time knobs are not stored in the file; set them on every load.
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = INDEX_NPROBE
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = INDEX_EF_SEARCH
+    return index
+
+
+def make_ann_index(vectors, index_type=None):
+    import faiss
+
+    index_type = index_type or INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown INDEX_TYPE {index_type!r}; use one of {', '.join(INDEX_TYPES)}")
+    n, dimension = vectors.shape
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, INDEX_HNSW_M)
+        index.hnsw.efConstruction = INDEX_HNSW_EF_CONSTRUCTION
+    else:
+        # sqrt(n) cells keeps ~40+ training points per centroid.
+        nlist = INDEX_NLIST or max(1, int(np.sqrt(n)))
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf-pq":
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, INDEX_PQ_M, INDEX_PQ_BITS)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        index.train(vectors)
+    index.add(vectors)
+    return tune_index(index)
+
+
+def fit_index(vectorstore, index_path, trained_on=None):
+    """Train the partition into INDEX_TYPE once it is big enough.
+
+    A trained index is retrained when the partition has doubled since, as
+    IVF centroids stop describing the data well. Returns the "index" entry
+    for the manifest.
+    """
+    index = vectorstore.index
+    kind, n = index_kind(index), index.ntotal
+    if INDEX_TYPE == "flat" or n < INDEX_TRAIN_THRESHOLD:
+        return {"type": kind, "trained_on": trained_on}
+    if kind != "flat" and trained_on and n < 2 * trained_on:
+        return {"type": kind, "trained_on": trained_on}
+    vectors = index_vectors(index)
+    if vectors is None:
+        return {"type": kind, "trained_on": trained_on}  # PQ codes only; retrained on the next full rebuild
+    started = time.perf_counter()
+    vectorstore.index = make_ann_index(vectors)
+    print(f"Trained {index_path} as {INDEX_TYPE} on {n} chunks in {time.perf_counter() - started:.1f}s.")
+    return {"type": INDEX_TYPE, "trained_on": n}
+
+
+def load_vectorstore(index_path, embeddings, mmap=False, writable=False):
+    # The index can be memory-mapped: its pages are then shared with other
+    # processes and the OS page cache instead of being this process's own
+    # memory. A mapped index and a ChunkStore are read-only, so updates
+    # (writable=True) get an in-memory copy of both.
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    chunks_path = os.path.join(index_path, CHUNKS_FILE)
+    if not os.path.exists(chunks_path) and os.path.exists(os.path.join(index_path, LEGACY_DOCSTORE_FILE)):
+        print(f"Converting {index_path} to {CHUNKS_FILE} (convert_index.py does this ahead of time).")
+        convert_pickled_docstore(index_path)
+
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) if mmap and not writable else 0
+    index = tune_index(faiss.read_index(os.path.join(index_path, INDEX_FILE), flags))
+    store = ChunkStore(chunks_path)
+    if not writable:
+        return FAISS(embeddings, index, store, store.positions)
+    documents = store.documents()
+    return FAISS(
+        embeddings,
+        index,
+        InMemoryDocstore(dict(documents)),
+        {position: doc_id for position, (doc_id, _) in enumerate(documents)},
+    )
+
+
+def save_vectorstore(vectorstore, index_path):
+    # Each file is written aside and renamed over the old one, so a snapshot
+    # still serving the old files (mapped index, open ChunkStore) keeps
+    # reading them. The caller invalidates the manifest around this.
+    import faiss
+
+    os.makedirs(index_path, exist_ok=True)
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+    docs = [vectorstore.docstore.search(doc_id) for doc_id in ids]
+    write_chunk_store(os.path.join(index_path, CHUNKS_FILE), ids, docs)
+    index_file = os.path.join(index_path, INDEX_FILE)
+    faiss.write_index(vectorstore.index, f"{index_file}.tmp")
+    os.replace(f"{index_file}.tmp", index_file)
+    remove_legacy_files(index_path)
+
+
+class StaleIndex(RuntimeError):
+    """A read-only index on disk does not match the documents it should hold."""
+
+
+def load_built_vectorstore(embeddings, current, index_path):
+    # INDEX_READ_ONLY: load the partition as written, after checking it holds
+    # exactly these documents. The manifest is read again afterwards so
+    # files replaced by a rebuild in the middle of the load are not mixed.
+    manifest = read_manifest(index_path)
+    expected = {key: doc_hash for key, (_, doc_hash) in current.items()}
+    if (
+        manifest is None
+        or manifest.get("settings") != index_settings()
+        or {key: entry["hash"] for key, entry in manifest["documents"].items()} != expected
+    ):
+        raise StaleIndex(f"{index_path} is not built for the current documents")
+    vectorstore = load_vectorstore(index_path, embeddings, mmap=True)
+    if read_manifest(index_path) != manifest:
+        raise StaleIndex(f"{index_path} was rewritten while loading")
     return vectorstore
 
 
-print("Loading knowledge base...")
-vectorstore = build_vectorstore()
-print("Knowledge base ready.")
+def build_vectorstore(embeddings, documents, index_path):
+    from langchain_community.vectorstores import FAISS
+
+    splitter = make_splitter()
+    settings = index_settings()
+    current = {key: (doc, document_hash(doc)) for key, doc in keyed_documents(documents).items()}
+    if INDEX_READ_ONLY:
+        return load_built_vectorstore(embeddings, current, index_path)
+
+    manifest = read_manifest(index_path) if os.path.exists(index_path) else None
+    if manifest is None or manifest.get("settings") != settings:
+        if os.path.exists(index_path):
+            reason = "no manifest" if manifest is None else "index settings changed"
+            print(f"Rebuilding {index_path} from scratch ({reason}).")
+        split_docs, split_ids = [], []
+        entries = {}
+        for key, (doc, doc_hash) in current.items():
+            chunks, ids = split_document(splitter, doc, doc_hash)
+            split_docs.extend(chunks)
+            split_ids.extend(ids)
+            entries[key] = {"hash": doc_hash, "chunk_ids": ids}
+
+        vectorstore = FAISS.from_documents(split_docs, embeddings, ids=split_ids)
+        index_info = fit_index(vectorstore, index_path)
+        invalidate_manifest(index_path)
+        save_vectorstore(vectorstore, index_path)
+        write_manifest(index_path, {"settings": settings, "documents": entries, "index": index_info})
+        return load_vectorstore(index_path, embeddings, mmap=INDEX_MMAP)
+
+    entries = manifest["documents"]
+    stale_ids = []
+    new_docs, new_ids = [], []
+    added = changed = 0
+    for key, (doc, doc_hash) in current.items():
+        entry = entries.get(key)
+        if entry and entry["hash"] == doc_hash:
+            continue
+        if entry:
+            stale_ids.extend(entry["chunk_ids"])
+            changed += 1
+        else:
+            added += 1
+        chunks, ids = split_document(splitter, doc, doc_hash)
+        new_docs.extend(chunks)
+        new_ids.extend(ids)
+        entries[key] = {"hash": doc_hash, "chunk_ids": ids}
+
+    removed = [key for key in entries if key not in current]
+    for key in removed:
+        stale_ids.extend(entries.pop(key)["chunk_ids"])
+
+    if not (stale_ids or new_docs):
+        return load_vectorstore(index_path, embeddings, mmap=INDEX_MMAP)
+
+    vectorstore = load_vectorstore(index_path, embeddings, writable=True)
+    index_info = manifest.get("index") or {}
+    if stale_ids and index_kind(vectorstore.index) != "flat":
+        # Deleting by position only works on a flat index: go back to one
+        # (the vectors are kept exactly) and let fit_index retrain it.
+        vectors = index_vectors(vectorstore.index)
+        if vectors is None:
+            print(f"Rebuilding {index_path} from scratch (documents removed from an ivf-pq index).")
+            invalidate_manifest(index_path)
+            return build_vectorstore(embeddings, documents, index_path)
+        vectorstore.index = make_ann_index(vectors, "flat")
+        index_info = {}
+
+    print(f"Updating {index_path}: {added} new, {changed} changed, {len(removed)} removed documents.")
+    if stale_ids:
+        vectorstore.delete(stale_ids)
+    if new_docs:
+        vectorstore.add_documents(new_docs, ids=new_ids)
+    index_info = fit_index(vectorstore, index_path, index_info.get("trained_on"))
+    invalidate_manifest(index_path)
+    save_vectorstore(vectorstore, index_path)
+    write_manifest(index_path, {"settings": settings, "documents": entries, "index": index_info})
+    return load_vectorstore(index_path, embeddings, mmap=INDEX_MMAP)
 
 
 # ==============================
-# CHAT FUNCTION
-# gr.ChatInterface passes history as a list of dicts automatically
+# LEXICAL INDEX
+# MiniLM embeddings blur exact tokens such as "NET", "GAT Subject" or "PKR".
+# Each partition also gets a small BM25 inverted index over the same chunks.
+# IDF and length normalisation are folded into the posting weights at build
+# time, so a query is just a few posting lookups and additions.
 # ==============================
-def chat(user_message, history):
+BM25_K1 = 1.5
+BM25_B = 0.75
+STOPWORDS = frozenset(
+    "a an and are at be by can do does for from how i in is it me my of on or "
+    "the to what when where which who will with".split()
+)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class LexicalIndex:
+    def __init__(self, postings):
+        self.postings = postings  # term -> (positions, bm25 weights)
+
+    @classmethod
+    def build(cls, texts):
+        term_freqs = []
+        doc_freq = {}
+        for text in texts:
+            freqs = {}
+            for token in tokenize(text):
+                freqs[token] = freqs.get(token, 0) + 1
+            term_freqs.append(freqs)
+            for token in freqs:
+                doc_freq[token] = doc_freq.get(token, 0) + 1
+
+        n_docs = len(texts)
+        lengths = [sum(freqs.values()) for freqs in term_freqs]
+        avg_length = (sum(lengths) / n_docs) if n_docs else 1.0
+        idf = {
+            term: float(np.log(1 + (n_docs - df + 0.5) / (df + 0.5)))
+            for term, df in doc_freq.items()
+        }
+        postings = {}
+        for position, freqs in enumerate(term_freqs):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[position] / avg_length)
+            for term, tf in freqs.items():
+                weight = idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+                positions, weights = postings.setdefault(term, ([], []))
+                positions.append(position)
+                weights.append(round(weight, 4))
+        return cls(postings)
+
+    def ranked(self, query, limit=None):
+        """(position, BM25 score) of the chunks sharing a term with `query`, best first.
+
+        Returns the best `limit` of them, or all if limit is None.
+        """
+        terms = set(tokenize(query))
+        if isinstance(self.postings, ChunkPostings):
+            postings = self.postings.get_many(terms)  # one read for all terms
+        else:
+            postings = {term: self.postings[term] for term in terms if term in self.postings}
+        if not postings:
+            return []
+        positions, inverse = np.unique(
+            np.concatenate([positions for positions, _ in postings.values()]), return_inverse=True
+        )
+        scores = np.bincount(inverse, weights=np.concatenate([weights for _, weights in postings.values()]))
+        order = np.argsort(-scores, kind="stable")[:limit]
+        return [(int(positions[i]), float(scores[i])) for i in order]
+
+
+def build_lexical_index(vectorstore):
+    # Persisted chunk stores carry their postings (see write_chunk_store) and
+    # are searched in place; an in-memory store gets a fresh index.
+    docstore = vectorstore.docstore
+    if isinstance(docstore, ChunkStore):
+        return LexicalIndex(docstore.postings)
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+    return LexicalIndex.build([docstore.search(doc_id).page_content for doc_id in ids])
+
+
+# ==============================
+# CHUNK STORE
+# The chunks of a partition (text, metadata, FAISS position) and its BM25
+# postings live in one SQLite file instead of a pickled docstore. Nothing
+# is read at load time: a query reads only the rows of its hits, so start
+# time and memory do not grow with the corpus, and loading runs no pickle.
+# Files are only ever replaced whole (written aside, then renamed), which
+# lets readers open them immutable, without locking.
+# ==============================
+CHUNK_SCHEMA = """
+CREATE TABLE chunks (
+    position INTEGER PRIMARY KEY,  -- row in index.faiss
+    id TEXT NOT NULL UNIQUE,
+    page_content TEXT NOT NULL,
+    metadata TEXT NOT NULL         -- JSON object
+);
+CREATE TABLE postings (
+    term TEXT PRIMARY KEY,
+    positions BLOB NOT NULL,       -- int32 array
+    weights BLOB NOT NULL          -- float32 BM25 weights
+) WITHOUT ROWID;
+"""
+
+
+def write_chunk_store(path, ids, docs):
+    lexical = LexicalIndex.build([doc.page_content for doc in docs])
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
     try:
-        docs = vectorstore.similarity_search(user_message, k=5)
-        context = "\n\n".join([doc.page_content for doc in docs])
+        with connection:
+            connection.executescript(CHUNK_SCHEMA)
+            connection.executemany(
+                "INSERT INTO chunks VALUES (?, ?, ?, ?)",
+                (
+                    (position, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                    for position, (doc_id, doc) in enumerate(zip(ids, docs))
+                ),
+            )
+            connection.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?)",
+                (
+                    (
+                        term,
+                        np.asarray(positions, dtype="int32").tobytes(),
+                        np.asarray(weights, dtype="float32").tobytes(),
+                    )
+                    for term, (positions, weights) in lexical.postings.items()
+                ),
+            )
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
 
-        prompt = f"""You are a helpful university admissions assistant for Pakistani students.
-You have detailed knowledge about these 4 universities:
-1. COMSATS University Islamabad (CUI)
-2. NUST - National University of Sciences and Technology
-3. UET Lahore - University of Engineering and Technology Lahore
-4. QAU - Quaid-i-Azam University Islamabad
 
-Use the context below to answer the student's question clearly and accurately.
-Use bullet points for lists. Be specific with numbers, percentages, and requirements.
-If the question is about a university not in your knowledge base, politely say you only cover these 4 universities.
-If specific information is not in the context, say so honestly and suggest checking the official website.
+SQL_BATCH = 500  # bound parameters per IN (...) query
 
-Context:
-{context}
 
-Student Question: {user_message}
+class ChunkStore:
+    """Read-only docstore over a partition's chunks.sqlite.
 
-Answer:"""
+    Implements the part of langchain's Docstore interface that FAISS search
+    uses, plus at() to read all of a search's hits in one query. Each thread
+    reads through its own connection, so searches never wait for each
+    other. A store keeps reading the file it was opened on after a reload
+    has renamed a new one over it: a thread whose own connection would see
+    the new file uses the connection opened up front instead, behind a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._uri = f"file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro&immutable=1"
+        self._connection = self._open()
+        self._file_id = self._current_file_id()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.positions = ChunkPositions(self)
+        self.postings = ChunkPostings(self)
+
+    def _open(self):
+        connection = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        connection.execute("SELECT 1 FROM chunks LIMIT 1")  # opens the file now
+        return connection
+
+    def _current_file_id(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _thread_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            try:
+                connection = self._open()
+                if self._current_file_id() != self._file_id:
+                    connection.close()
+                    connection = False  # the file was replaced; share the original
+            except sqlite3.OperationalError:
+                connection = False  # or removed
+            self._local.connection = connection
+        return connection
+
+    def query(self, sql, params=()):
+        connection = self._thread_connection()
+        if connection:
+            return connection.execute(sql, params).fetchall()
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def search(self, search):
+        rows = self.query("SELECT page_content, metadata FROM chunks WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."  # the Docstore convention
+        return Document(id=search, page_content=rows[0][0], metadata=json.loads(rows[0][1]))
+
+    def at(self, positions):
+        """The Documents at these FAISS positions, in order (None for -1)."""
+        positions = [int(p) for p in positions]
+        wanted = sorted({p for p in positions if p >= 0})
+        found = {}
+        for start in range(0, len(wanted), SQL_BATCH):
+            batch = wanted[start:start + SQL_BATCH]
+            rows = self.query(
+                "SELECT position, id, page_content, metadata FROM chunks "
+                f"WHERE position IN ({', '.join('?' * len(batch))})",
+                batch,
+            )
+            for position, doc_id, text, metadata in rows:
+                found[position] = Document(id=doc_id, page_content=text, metadata=json.loads(metadata))
+        return [found.get(p) for p in positions]
+
+    def documents(self):
+        """(id, Document) pairs in FAISS position order; reads the whole file."""
+        rows = self.query("SELECT id, page_content, metadata FROM chunks ORDER BY position")
+        return [
+            (doc_id, Document(id=doc_id, page_content=text, metadata=json.loads(metadata)))
+            for doc_id, text, metadata in rows
+        ]
+
+
+class ChunkPositions(Mapping):
+    # FAISS position -> chunk id, in place of FAISS's index_to_docstore_id dict.
+    def __init__(self, store):
+        self._store = store
+        self._len = store.query("SELECT COUNT(*) FROM chunks")[0][0]
+
+    def __getitem__(self, position):
+        rows = self._store.query("SELECT id FROM chunks WHERE position = ?", (int(position),))
+        if not rows:
+            raise KeyError(position)
+        return rows[0][0]
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return iter(range(self._len))
+
+
+class ChunkPostings:
+    # term -> (positions, weights), in place of LexicalIndex's postings dict.
+    def __init__(self, store):
+        self._store = store
+
+    def get(self, term, default=None):
+        return self.get_many([term]).get(term, default)
+
+    def get_many(self, terms):
+        terms = sorted(terms)
+        postings = {}
+        for start in range(0, len(terms), SQL_BATCH):
+            batch = terms[start:start + SQL_BATCH]
+            rows = self._store.query(
+                f"SELECT term, positions, weights FROM postings WHERE term IN ({', '.join('?' * len(batch))})",
+                batch,
+            )
+            for term, positions, weights in rows:
+                postings[term] = (
+                    np.frombuffer(positions, dtype="int32").tolist(),
+                    np.frombuffer(weights, dtype="float32").tolist(),
+                )
+        return postings
+
+
+def convert_pickled_docstore(index_path):
+    """Rewrite a FAISS.save_local docstore (index.pkl) as chunks.sqlite.
+
+    Unpickles the file, so only run it on indexes this app wrote.
+    """
+    import pickle
+
+    with open(os.path.join(index_path, LEGACY_DOCSTORE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    ids = [index_to_docstore_id[i] for i in range(len(index_to_docstore_id))]
+    write_chunk_store(os.path.join(index_path, CHUNKS_FILE), ids, [docstore.search(doc_id) for doc_id in ids])
+    remove_legacy_files(index_path)
+    return len(ids)
+
+
+def remove_legacy_files(index_path):
+    for name in (LEGACY_DOCSTORE_FILE, LEGACY_LEXICAL_FILE):
+        try:
+            os.remove(os.path.join(index_path, name))
+        except FileNotFoundError:
+            pass
+
+
+# ==============================
+# PARTITIONS
+# One FAISS index per university (faiss_index/<university>/), plus an "All"
+# partition for the cross-university comparison and scholarship documents.
+# A question about NUST only searches the NUST partition, so search cost and
+# prompt size do not grow as more universities are added.
+# ==============================
+ALL_PARTITION = "All"
+
+
+def partition_name(doc):
+    return doc.metadata.get("university") or ALL_PARTITION
+
+
+def partition_dir(name):
+    return os.path.join(INDEX_PATH, re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-"))
+
+
+# The partitions and lexical indexes being served, swapped as one object (see
+# install_index) so a request never mixes two versions of the knowledge base.
+# `hashes` fingerprints each partition's documents, letting a reload reuse
+# the partitions it did not touch.
+IndexSnapshot = namedtuple("IndexSnapshot", ["partitions", "lexical_indexes", "hashes"])
+
+
+def partition_hash(docs):
+    payload = json.dumps(
+        {"settings": index_settings(), "documents": sorted(
+            (key, document_hash(doc)) for key, doc in keyed_documents(docs).items()
+        )},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EmptyKnowledgeBase(RuntimeError):
+    """There are no documents to index."""
+
+
+def build_partitions(embeddings, documents=None, previous=None):
+    documents = load_corpus() if documents is None else documents
+    if not documents:
+        # Also keeps a reload of an emptied KB_DIR from removing every partition.
+        raise EmptyKnowledgeBase("the knowledge base is empty: no KB_DIR documents and KB_INCLUDE_BUILTIN=0")
+    groups = {}
+    for doc in documents:
+        groups.setdefault(partition_name(doc), []).append(doc)
+
+    previous = previous or IndexSnapshot({}, {}, {})
+    partitions, lexical_indexes, hashes = {}, {}, {}
+    for name, docs in groups.items():
+        hashes[name] = partition_hash(docs)
+        if previous.hashes.get(name) == hashes[name] and name in previous.partitions:
+            partitions[name] = previous.partitions[name]
+            lexical_indexes[name] = previous.lexical_indexes.get(name)
+            continue
+        partitions[name] = build_vectorstore(embeddings, docs, partition_dir(name))
+        lexical_indexes[name] = build_lexical_index(partitions[name])
+
+    if INDEX_READ_ONLY:
+        return IndexSnapshot(partitions, lexical_indexes, hashes)
+    # Drop partitions of universities that are no longer in the corpus, and
+    # the files of the old single, unpartitioned index.
+    keep = {os.path.basename(partition_dir(name)) for name in partitions}
+    os.makedirs(INDEX_PATH, exist_ok=True)
+    for entry in os.scandir(INDEX_PATH):
+        if entry.is_dir() and entry.name not in keep:
+            print(f"Removing stale partition {entry.path}")
+            shutil.rmtree(entry.path)
+        elif entry.is_file():
+            os.remove(entry.path)
+    return IndexSnapshot(partitions, lexical_indexes, hashes)
+
+
+# Filled in by the background startup thread (see STARTUP below).
+embeddings = None
+live_index = IndexSnapshot({}, {}, {})
+
+
+def install_index(snapshot):
+    # A single reference assignment: requests that already read live_index
+    # finish on the old snapshot, new ones see the new one.
+    global live_index
+    live_index = snapshot
+
+
+# ==============================
+# LATENCY TRACKING
+# Keeps the last few hundred requests in memory so perceived latency
+# (time-to-first-token) can be inspected under load.
+# ==============================
+LATENCY_LOG = deque(maxlen=int(os.getenv("LATENCY_LOG_SIZE", "500")))
+
+
+def latency_entry(started, first_token_at, status, prompt_tokens=None, completion_tokens=None):
+    finished = time.perf_counter()
+    return {
+        "ttft_ms": round((first_token_at - started) * 1000, 1) if first_token_at else None,
+        "total_ms": round((finished - started) * 1000, 1),
+        "status": status,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+    }
+
+
+def record_latency(started, first_token_at, status, prompt_tokens=None, completion_tokens=None):
+    entry = latency_entry(started, first_token_at, status, prompt_tokens, completion_tokens)
+    LATENCY_LOG.append(entry)
+    logger.info("chat ttft_ms=%s total_ms=%s status=%s prompt_tokens=%s completion_tokens=%s",
+                entry["ttft_ms"], entry["total_ms"], entry["status"], prompt_tokens, completion_tokens)
+    return entry
+
+
+# ==============================
+# METRICS
+# Per-stage timers and counters for every chat request, served in the
+# Prometheus text format at METRICS_PATH, plus an optional sampled JSON-lines
+# query log. Durations are exported in seconds (the Prometheus convention);
+# the query log and LATENCY_LOG use milliseconds.
+# ==============================
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH")  # unset = no query log
+QUERY_LOG_SAMPLE_RATE = float(os.getenv("QUERY_LOG_SAMPLE_RATE", "0.1"))
+QUERY_LOG_MAX_PENDING = int(os.getenv("QUERY_LOG_MAX_PENDING", "1000"))
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+class Metrics:
+    """Thread-safe counters, gauges and histograms rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}    # name -> (type, help, buckets)
+        self._values = {}  # (name, labels) -> value, or [bucket counts, sum, count]
+
+    def define(self, name, kind, help_text, buckets=None):
+        self._meta[name] = (kind, help_text, buckets)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1.0, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[self._key(name, labels)] = float(value)
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._values.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escape = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        with self._lock:
+            values = {key: (v if not isinstance(v, list) else [list(v[0]), v[1], v[2]])
+                      for key, v in self._values.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(values.items()):
+                if metric != name:
+                    continue
+                if kind != "histogram":
+                    lines.append(f"{name}{self._labels(labels)} {value:g}")
+                    continue
+                counts, total, count = value
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', f'{bound:g}')])} {bucket_count}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total:g}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.define("universe_pk_requests_total", "counter", "Chat requests by serving path and final status.")
+metrics.define("universe_pk_request_errors_total", "counter", "Failed chat requests by stage and exception class.")
+metrics.define("universe_pk_requests_in_flight", "gauge", "Chat requests currently being answered.")
+metrics.define("universe_pk_bulk_jobs_in_flight", "gauge", "Bulk questions prepared and not yet answered.")
+metrics.define("universe_pk_request_ttft_seconds", "histogram", "Time to the first streamed token.", SECONDS_BUCKETS)
+metrics.define("universe_pk_request_duration_seconds", "histogram", "Total chat request time.", SECONDS_BUCKETS)
+metrics.define("universe_pk_stage_duration_seconds", "histogram",
+               "Time spent per pipeline stage (route, rewrite, analyze, embed, route_centroid, cache, search, rerank, context, queue, llm, llm_ttft).",
+               SECONDS_BUCKETS)
+metrics.define("universe_pk_context_tokens", "histogram", "Retrieved context tokens per prompt.", TOKEN_BUCKETS)
+metrics.define("universe_pk_prompt_tokens", "histogram", "Prompt tokens sent to the LLM.", TOKEN_BUCKETS)
+metrics.define("universe_pk_completion_tokens", "histogram", "Completion tokens streamed by the LLM.", TOKEN_BUCKETS)
+metrics.define("universe_pk_context_tokens_total", "counter", "Retrieved context tokens sent, by serving path.")
+metrics.define("universe_pk_prompt_tokens_total", "counter", "Prompt tokens sent to the LLM, by serving path.")
+metrics.define("universe_pk_completion_tokens_total", "counter", "Completion tokens streamed by the LLM, by serving path.")
+metrics.define("universe_pk_cached_prompt_tokens_total", "counter", "Prompt tokens the LLM provider reported as served from its prefix cache.")
+metrics.define("universe_pk_prompt_clipped_total", "counter",
+               "Prompts cut to fit PROMPT_MAX_TOKENS, by part (context, memory, question).")
+metrics.define("universe_pk_query_log_dropped_total", "counter", "Query log records dropped because the writer fell behind.")
+metrics.define("universe_pk_semantic_cache_entries", "gauge", "Answers held in the semantic cache.")
+metrics.define("universe_pk_semantic_cache_lookups_total", "counter", "Semantic cache lookups by result.")
+metrics.define("universe_pk_knowledge_base_ready", "gauge", "1 once the embedding model and index are loaded.")
+metrics.define("universe_pk_llm_attempts_total", "counter", "LLM calls per backend by outcome (ok, rate_limited, retryable, error).")
+metrics.define("universe_pk_llm_failovers_total", "counter", "Requests that failed over to a later LLM backend.")
+metrics.define("universe_pk_coalesce_requests_total", "counter",
+               "LLM requests by coalescing role: leader (sent upstream) or follower (shared a leader's stream).")
+metrics.define("universe_pk_coalesce_saved_tokens_total", "counter", "Prompt/completion tokens not requested upstream thanks to coalescing.")
+metrics.define("universe_pk_coalesce_abandoned_total", "counter", "Shared completions stopped because every waiting request left.")
+metrics.define("universe_pk_coalesce_flights", "gauge", "Distinct upstream completions currently shared.")
+metrics.define("universe_pk_kb_documents", "gauge", "Documents in the served knowledge base (built-in plus KB_DIR).")
+metrics.define("universe_pk_kb_invalid_documents", "gauge", "KB_DIR documents skipped by validation in the last load.")
+metrics.define("universe_pk_kb_reloads_total", "counter", "Knowledge base reloads by trigger and result (ok, unchanged, error).")
+metrics.define("universe_pk_kb_last_reload_timestamp_seconds", "gauge", "Unix time of the last successful knowledge base reload.")
+metrics.define("universe_pk_rerank_pairs_total", "counter", "(question, chunk) pairs reranked, by result (scored, cached).")
+metrics.define("universe_pk_rerank_saved_tokens_total", "counter", "Context tokens not sent to the LLM thanks to reranking.")
+metrics.define("universe_pk_bulk_rate_limit_pauses_total", "counter", "Bulk runs paused because the LLM API answered 429.")
+metrics.define("universe_pk_intent_routes_total", "counter",
+               "Routing decisions by intent (greeting, thanks, off_topic, out_of_scope, admissions) and method (keyword, centroid, none).")
+metrics.define("universe_pk_llm_circuit_open", "gauge", "1 while an LLM backend's circuit breaker is open or half-open.")
+
+
+class QueryLog:
+    """Sampled JSON-lines log of finished requests, written by a background thread.
+
+    Requests only enqueue a dict; when the writer falls behind, records are
+    dropped (and counted) rather than slowing chat down. Errors are always logged.
+    """
+
+    def __init__(self, path, sample_rate, max_pending=1000):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="query-log", daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        if record["status"] != "error" and random.random() >= self.sample_rate:
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("universe_pk_query_log_dropped_total")
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if self._queue.empty():
+                    f.flush()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+query_log = None
+if QUERY_LOG_PATH:
+    query_log = QueryLog(QUERY_LOG_PATH, QUERY_LOG_SAMPLE_RATE, QUERY_LOG_MAX_PENDING)
+    atexit.register(query_log.close)
+
+
+class RequestTrace:
+    """Stage timings and token counts of one chat request, reported by finish()."""
 
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-            max_tokens=1024,
+    in_flight_metric = "universe_pk_requests_in_flight"
+
+    def __init__(self, path, user_message):
+        self.path = path
+        self.user_message = user_message
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.stage = "start"
+        self.stage_started = self.started
+        self.stages_ms = {}
+        self.fields = {}
+        self.error = None
+        metrics.inc(self.in_flight_metric, 1)
+
+    @contextmanager
+    def timed(self, stage):
+        self.stage = stage
+        self.stage_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages_ms[stage] = round((time.perf_counter() - self.stage_started) * 1000, 2)
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            if self.stage == "llm":
+                self.stages_ms["llm_ttft"] = round((self.first_token_at - self.stage_started) * 1000, 2)
+
+    def llm_event(self, event):
+        self.fields["llm_backend"] = event.backend
+        if event.usage:
+            self.fields["prompt_tokens"] = event.usage["prompt_tokens"]
+            self.fields["completion_tokens"] = event.usage["completion_tokens"]
+            if event.usage["cached_tokens"] is not None:
+                self.fields["cached_prompt_tokens"] = event.usage["cached_tokens"]
+
+    def finish(self, status, answer=""):
+        metrics.inc(self.in_flight_metric, -1)
+        if "llm" in self.stages_ms:
+            self.fields.setdefault("completion_tokens", count_tokens(answer))
+        entry = self.latency(status)
+
+        metrics.inc("universe_pk_requests_total", path=self.path, status=status)
+        metrics.observe("universe_pk_request_duration_seconds", entry["total_ms"] / 1000, path=self.path)
+        if entry["ttft_ms"] is not None:
+            metrics.observe("universe_pk_request_ttft_seconds", entry["ttft_ms"] / 1000, path=self.path)
+        for stage, ms in self.stages_ms.items():
+            metrics.observe("universe_pk_stage_duration_seconds", ms / 1000, stage=stage)
+        for field in ("context_tokens", "prompt_tokens", "completion_tokens"):
+            if field in self.fields:
+                metrics.observe(f"universe_pk_{field}", self.fields[field])
+                metrics.inc(f"universe_pk_{field}_total", self.fields[field], path=self.path)
+        if "cached_prompt_tokens" in self.fields:
+            metrics.inc("universe_pk_cached_prompt_tokens_total", self.fields["cached_prompt_tokens"], path=self.path)
+        error_class = type(self.error).__name__ if self.error is not None else None
+        if error_class:
+            metrics.inc("universe_pk_request_errors_total", stage=self.stage, error=error_class)
+
+        if query_log is not None:
+            query_log.submit({
+                "ts": round(time.time(), 3),
+                "path": self.path,
+                "status": status,
+                "error": error_class,
+                "error_stage": self.stage if error_class else None,
+                "question": self.user_message,
+                "ttft_ms": entry["ttft_ms"],
+                "total_ms": entry["total_ms"],
+                "stages_ms": self.stages_ms,
+                **self.fields,
+            })
+        return entry
+
+    def latency(self, status):
+        return record_latency(
+            self.started, self.first_token_at, status,
+            self.fields.get("prompt_tokens", 0), self.fields.get("completion_tokens", 0),
         )
 
-        return completion.choices[0].message.content.strip()
 
-    except Exception as e:
-        return f"Sorry, an error occurred: {str(e)}"
+class BulkTrace(RequestTrace):
+    """RequestTrace of one bulk question.
+
+    Counted in its own in-flight gauge and kept out of LATENCY_LOG, which
+    is chat latency. Time spent waiting for an LLM slot (waited) is a
+    stage of its own and left out of TTFT and duration.
+    """
+
+    in_flight_metric = "universe_pk_bulk_jobs_in_flight"
+
+    def __init__(self, question):
+        super().__init__("bulk", question)
+
+    def waited(self, stage, since):
+        waited = time.perf_counter() - since
+        self.stages_ms[stage] = round(waited * 1000, 2)
+        self.started += waited
+
+    def latency(self, status):
+        return latency_entry(
+            self.started, self.first_token_at, status,
+            self.fields.get("prompt_tokens", 0), self.fields.get("completion_tokens", 0),
+        )
+
+
+def render_metrics():
+    if answer_cache is not None:
+        stats = answer_cache.stats()
+        metrics.set("universe_pk_semantic_cache_entries", stats["entries"])
+        metrics.set("universe_pk_semantic_cache_lookups_total", stats["hits"], result="hit")
+        metrics.set("universe_pk_semantic_cache_lookups_total", stats["misses"], result="miss")
+    metrics.set("universe_pk_knowledge_base_ready", startup_ready.is_set() and startup_error is None)
+    if coalescer is not None:
+        metrics.set("universe_pk_coalesce_flights", coalescer.in_flight())
+    for backend in llm.backends:
+        metrics.set("universe_pk_llm_circuit_open", backend.breaker.state() != "closed", backend=backend.name)
+    return metrics.render()
+
+
+def metrics_endpoint(request):
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 
 # ==============================
-# GRADIO UI — using ChatInterface
-# Works on ALL Gradio versions (no type= argument needed)
+# SEMANTIC ANSWER CACHE
+# Near-duplicate questions ("NUST BS CS fee", "fee for BS CS at NUST?") map
+# to almost the same query embedding. If a previous question is within
+# SEMANTIC_CACHE_THRESHOLD cosine similarity, its answer is reused and the
+# Groq call is skipped entirely.
 # ==============================
-demo = gr.ChatInterface(
-    fn=chat,
-    title="🎓 Pakistan University Assistant",
-    description=(
-        "### Your guide to admissions, fees, programs & scholarships\n"
-        "**Covered Universities:** COMSATS · NUST · UET Lahore · QAU\n\n"
-        "*Always verify details on official university websites before applying.*"
-    ),
-    examples=[
-        "What is the eligibility criteria for PhD Mathematics at QAU?",
-        "Compare fees of NUST and UET Lahore for BS Computer Science",
-        "What entry test is required for COMSATS undergraduate admissions?",
-        "What scholarships are available for MS students in Pakistan?",
-        "What programs does QAU offer in Social Sciences?",
-        "What is the fee structure for BS Electrical Engineering at UET Lahore?",
-        "When does NUST take admissions for BS programs?",
-        "What is the minimum CGPA required for PhD at COMSATS?",
-    ],
-)
+class SemanticCache:
+    def __init__(self, threshold, max_entries, ttl_seconds, path=None, save_every=25):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.save_every = save_every
+        self._unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> {"vector", "scope", "query", "answer", "created"}
+        self._next_key = 0
+        self._matrix = None  # stacked vectors, rebuilt lazily after writes
+        self._keys = []
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now):
+        expired = [k for k, e in self._entries.items() if now - e["created"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+            self.evictions += 1
+        if expired:
+            self._matrix = None
+
+    # scope is the tuple of universities the question names; "NUST fee" and
+    # "UET fee" embed very closely, so answers are never shared across scopes.
+    def lookup(self, vector, scope=()):
+        query_vector = self._normalize(vector)
+        scope = list(scope)
+        with self._lock:
+            self._expire(time.time())
+            if self._entries:
+                if self._matrix is None:
+                    self._keys = list(self._entries)
+                    self._matrix = np.stack([self._entries[k]["vector"] for k in self._keys])
+                scores = self._matrix @ query_vector
+                for best in np.argsort(-scores):
+                    if scores[best] < self.threshold:
+                        break
+                    key = self._keys[best]
+                    if self._entries[key]["scope"] != scope:
+                        continue
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key]["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, vector, query, answer, scope=()):
+        with self._lock:
+            self._entries[self._next_key] = {
+                "vector": self._normalize(vector),
+                "scope": list(scope),
+                "query": query,
+                "answer": answer,
+                "created": time.time(),
+            }
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)  # least recently used
+                self.evictions += 1
+            self._matrix = None
+            self._unsaved += 1
+            flush = bool(self.path) and self._unsaved >= self.save_every
+            if flush:
+                self._unsaved = 0
+        if flush:
+            # Spaces may be stopped without running atexit, so persist
+            # periodically, off the request thread.
+            threading.Thread(target=self.save, daemon=True).start()
+
+    def invalidate(self, universities):
+        """Drop answers that may have used the given partitions' documents.
+
+        Unscoped answers searched every partition, so they always go; a
+        change to the "All" partition drops everything.
+        """
+        universities = set(universities)
+        with self._lock:
+            stale = [
+                key for key, e in self._entries.items()
+                if ALL_PARTITION in universities or not e["scope"] or universities & set(e["scope"])
+            ]
+            for key in stale:
+                del self._entries[key]
+                self.evictions += 1
+            if stale:
+                self._matrix = None
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            payload = [
+                {
+                    "vector": e["vector"].tolist(),
+                    "scope": e["scope"],
+                    "query": e["query"],
+                    "answer": e["answer"],
+                    "created": e["created"],
+                }
+                for e in self._entries.values()
+            ]
+        with self._save_lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, self.path)  # atomic, a crash never leaves half a file
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable semantic cache %s: %s", self.path, e)
+            return
+        now = time.time()
+        with self._lock:
+            for e in payload[-self.max_entries:]:
+                if now - e["created"] > self.ttl_seconds:
+                    continue
+                self._entries[self._next_key] = {
+                    "vector": self._normalize(e["vector"]),
+                    "scope": e.get("scope", []),
+                    "query": e["query"],
+                    "answer": e["answer"],
+                    "created": e["created"],
+                }
+                self._next_key += 1
+            self._matrix = None
+        logger.info("Loaded %d cached answers from %s", len(self._entries), self.path)
+
+
+answer_cache = None
+if SEMANTIC_CACHE_ENABLED:
+    answer_cache = SemanticCache(
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl_seconds=SEMANTIC_CACHE_TTL,
+        path=SEMANTIC_CACHE_PATH,
+        save_every=SEMANTIC_CACHE_SAVE_EVERY,
+    )
+    atexit.register(answer_cache.save)
+
+
+# ==============================
+# QUERY ANALYZER
+# Cheap regex pass that finds which universities and topics a question is
+# about, so retrieval can be restricted to the matching partitions.
+# Acronyms that are also English words (NET, BE) only match in upper case.
+# ==============================
+UNIVERSITY_ALIASES = {
+    "COMSATS": [r"comsats", r"cui", r"ciit", r"comsats institute"],
+    "NUST": [r"nust", r"national university of sciences(?: (?:and|&) technology)?"],
+    "UET Lahore": [r"uet", r"university of engineering (?:and|&) technology", r"ecat"],
+    "QAU": [r"qau", r"quaid[- ]?[ie]?[- ]?azam(?: university)?"],
+}
+UNIVERSITY_ACRONYMS = {
+    "NUST": [r"NET(?:-\d)?"],
+}
+TOPIC_KEYWORDS = {
+    "fees": r"fees?|tuition|cost|costs|pkr|rupees|expensive|cheap(?:est)?|afford\w*|hostel",
+    "phd admissions": r"ph\.?d|doctora\w*",
+    "graduate ms admissions": r"ms|mphil|m\.phil|masters?|graduate|postgraduate|mba|gat general|gre",
+    "undergraduate admissions": r"bs|(?-i:BE)|bba|bachelors?|undergrad\w*|fsc|a-levels?|intermediate|ecat|entry test|programs? offered",
+    "scholarships": r"scholarships?|financial aid|need[- ]based|waivers?|stipends?",
+    "general": r"campus(?:es)?|rankings?|ranked|established|location|located|website|faculty",
+}
+# Scholarship details for each university live in its fee and PhD documents.
+RELATED_TOPICS = {
+    "scholarships": ("fees", "phd admissions"),
+}
+# "best" alone ("best university for PhD") asks for a recommendation, not a
+# comparison; it only counts in "which ... best" or next to a second university.
+COMPARISON_PATTERN = re.compile(
+    r"\b(?:compare|comparison|vs\.?|versus|difference|differ|better|cheapest|"
+    r"most expensive|which (?:one|university|is)|which\b[^.?!]*\bbest|all (?:four|4|the) universities)\b",
+    re.IGNORECASE,
+)
+UNIVERSITY_PATTERNS = {
+    name: re.compile(
+        r"\b(?:" + "|".join(aliases) + r")\b"
+        + "".join(r"|\b(?-i:" + acronym + r")\b" for acronym in UNIVERSITY_ACRONYMS.get(name, [])),
+        re.IGNORECASE,
+    )
+    for name, aliases in UNIVERSITY_ALIASES.items()
+}
+TOPIC_PATTERNS = {
+    topic: re.compile(r"\b(?:" + pattern + r")\b", re.IGNORECASE)
+    for topic, pattern in TOPIC_KEYWORDS.items()
+}
+
+QueryAnalysis = namedtuple("QueryAnalysis", ["universities", "topics", "comparison"])
+
+
+def analyze_query(user_message):
+    universities = [name for name, pattern in UNIVERSITY_PATTERNS.items() if pattern.search(user_message)]
+    topics = [topic for topic, pattern in TOPIC_PATTERNS.items() if pattern.search(user_message)]
+    comparison = len(universities) > 1 or bool(COMPARISON_PATTERN.search(user_message))
+    return QueryAnalysis(tuple(universities), tuple(topics), comparison)
+
+
+BUILTIN_UNIVERSITY_PATTERNS = UNIVERSITY_PATTERNS
+
+
+def register_universities(documents):
+    """Make universities that only exist in KB_DIR files recognizable.
+
+    Each is matched by its metadata name and the comma-separated "aliases"
+    of its documents. The pattern dict is replaced, never mutated, so
+    concurrent analyze_query calls are unaffected.
+    """
+    global UNIVERSITY_PATTERNS
+    aliases = {}
+    for doc in documents:
+        name = doc.metadata.get("university")
+        if not name or name == ALL_PARTITION or name in BUILTIN_UNIVERSITY_PATTERNS:
+            continue
+        names = aliases.setdefault(name, {name})
+        names.update(a.strip() for a in str(doc.metadata.get("aliases", "")).split(",") if a.strip())
+    patterns = dict(BUILTIN_UNIVERSITY_PATTERNS)
+    for name, names in aliases.items():
+        alternatives = "|".join(re.escape(a) for a in sorted(names, key=len, reverse=True))
+        patterns[name] = re.compile(r"\b(?:" + alternatives + r")\b", re.IGNORECASE)
+    UNIVERSITY_PATTERNS = patterns
+
+
+# ==============================
+# FACT TABLE
+# Fees, minimum marks/CGPA and entry tests are parsed out of the documents
+# into a small columnar table at startup. Narrow questions such as
+# "Compare fees of NUST and UET for BS CS" or "minimum CGPA for PhD at
+# COMSATS" are answered straight from the table in well under a millisecond;
+# anything else falls back to the RAG path.
+# ==============================
+FACT_FAST_PATH = os.getenv("FACT_FAST_PATH", "1") == "1"
+
+FACT_COLUMNS = {
+    "kind": object,          # "fee" or "eligibility"
+    "university": object,
+    "level": object,         # "BS", "MS" or "PhD"
+    "program_group": object,
+    "fee_min": np.float64,   # PKR per semester
+    "fee_max": np.float64,
+    "min_marks": np.float64,  # percent
+    "min_cgpa": np.float64,
+    "test": object,
+    "note": object,          # source line(s), quoted in answers
+}
+LEVEL_LABELS = {"BS": "BS/BE", "MS": "MS/MPhil", "PhD": "PhD"}
+TOPIC_LEVELS = {
+    "undergraduate admissions": "BS",
+    "graduate ms admissions": "MS",
+    "phd admissions": "PhD",
+}
+LEVEL_PATTERNS = {
+    "PhD": re.compile(r"\bph\.?d\b|\bdoctora\w*", re.IGNORECASE),
+    "MS": re.compile(r"\bms\b|\bmphil\b|\bm\.phil\b|\bmasters?\b|\bgraduate\b|\bpostgrad\w*|\bmba\b", re.IGNORECASE),
+    "BS": re.compile(r"\bbs\b|\b(?-i:BE)\b|\bbsc\b|\bbachelors?\b|\bundergrad\w*|\bbba\b", re.IGNORECASE),
+}
+PROGRAM_FIELDS = {
+    "cs": r"computer science|\bcs\b|\bit\b|software|artificial intelligence|\bai\b|data science|cyber|computing",
+    "engineering": r"engineering",
+    "natural sciences": r"natural|physics|chemistry|\bmath\w*|\bbio\w*|statistics|environmental"
+                        r"|(?<!social )(?<!computer )(?<!management )\bsciences?\b",
+    "social sciences": r"social|humanities|economics|psychology|english|sociology|political"
+                       r"|international relations|history|media|gender|anthropology",
+    "management": r"management|business|\bbba\b|\bmba\b|finance|accounting|commerce",
+    "architecture": r"architecture|planning|design",
+    "pharmacy": r"pharm\w*",
+    "law": r"\blaw\b|\bllb\b",
+}
+PROGRAM_FIELD_PATTERNS = {
+    field: re.compile(pattern, re.IGNORECASE) for field, pattern in PROGRAM_FIELDS.items()
+}
+# The word after a degree or "fee of/for" names a program ("BS Physics",
+# "fee of MBBS") unless it is one of these.
+PROGRAM_MENTION = re.compile(
+    r"\b(?:bs|(?-i:BE)|bsc|bachelors?|ms|mphil|masters?|ph\.?d|fees?\s+(?:of|for))"
+    r"\s+(?:in\s+|of\s+)?(?:the\s+|a\s+|an\s+)?([a-z][\w&./+-]*)",
+    re.IGNORECASE,
+)
+NOT_PROGRAMS = frozenset(
+    "a an and are at do does degree degrees each fee fees for from how in is level of or per program "
+    "programme programs programmes semester student students the to tuition cost costs vs with year".split()
+)
+KNOWN_TESTS = [
+    ("NET", re.compile(r"\bNET\b")),
+    ("ECAT", re.compile(r"\bECAT\b")),
+    ("NTS", re.compile(r"\bNTS\b")),
+    ("GAT General", re.compile(r"\bGAT General\b")),
+    ("GAT Subject", re.compile(r"\bGAT Subject\b")),
+    ("GRE", re.compile(r"\bGRE\b")),
+]
+
+FEE_HEADER = re.compile(r"^(?:BS|BE/BS|MS|MS/MPhil|PhD)\b.*\bFees?\b", re.IGNORECASE)
+FEE_LINE = re.compile(r"^- (.+?):\s*PKR\s*([\d,]+)\s*[–-]\s*PKR\s*([\d,]+)")
+CGPA_VALUE = re.compile(r"(\d\.\d+)\s*CGPA")
+MARKS_VALUE = re.compile(r"(\d+)%(?:\s*[–-]\s*\d+%)?\s*marks")
+
+FEE_QUESTION = re.compile(
+    r"\b(?:fees?|tuition|costs?|how much|cheap\w*|expensive|afford\w*)\b", re.IGNORECASE
+)
+ELIGIBILITY_QUESTION = re.compile(
+    r"\b(?:minimum|min\.?|required|requirement|need|needed)\b.*\b(?:cgpa|gpa|marks|percentage)\b"
+    r"|\b(?:cgpa|gpa|marks|percentage)\b.*\b(?:required|needed|minimum)\b",
+    re.IGNORECASE,
+)
+TEST_QUESTION = re.compile(r"\b(?:entry|admission|which|what)\s+tests?\b", re.IGNORECASE)
+# Anything the table cannot answer sends the question to the LLM instead.
+FACT_BLOCKERS = re.compile(
+    r"\b(?:scholarships?|hostels?|deadlines?|when|how to|apply|process|merit|campus\w*|rank\w*|"
+    r"why|explain|aid|waivers?|stipends?|programs? offered|duration|interview|proposal|and also)\b",
+    re.IGNORECASE,
+)
+FACT_MAX_WORDS = 25
+
+
+def program_fields(text):
+    return {field for field, pattern in PROGRAM_FIELD_PATTERNS.items() if pattern.search(text)}
+
+
+def names_program(text):
+    for match in PROGRAM_MENTION.finditer(text):
+        word = match.group(1)
+        if word.lower() in NOT_PROGRAMS or any(p.fullmatch(word) for p in LEVEL_PATTERNS.values()):
+            continue
+        if any(p.fullmatch(word) for p in UNIVERSITY_PATTERNS.values()):
+            continue
+        return True
+    return False
+
+
+def parse_level(header):
+    if "PhD" in header:
+        return "PhD"
+    if re.search(r"\bMS\b", header):
+        return "MS"
+    return "BS"
+
+
+class FactTable:
+    def __init__(self, rows):
+        self.size = len(rows)
+        self.columns = {}
+        for name, dtype in FACT_COLUMNS.items():
+            values = [row.get(name) for row in rows]
+            if dtype is object:
+                self.columns[name] = np.array(values, dtype=object)
+            else:
+                self.columns[name] = np.array(
+                    [np.nan if v is None else v for v in values], dtype=dtype
+                )
+        # Program fields per row, used to match "BS CS" to "Computer Science / IT".
+        self.fields = [
+            None if (g or "").lower().startswith("all programs") else program_fields(g or "")
+            for g in self.columns["program_group"]
+        ]
+
+    def select(self, **criteria):
+        mask = np.ones(self.size, dtype=bool)
+        for name, value in criteria.items():
+            column = self.columns[name]
+            if isinstance(value, (list, tuple, set)):
+                mask &= np.isin(column, list(value))
+            else:
+                mask &= column == value
+        return np.flatnonzero(mask)
+
+    def row(self, i):
+        return {name: column[i] for name, column in self.columns.items()}
+
+
+def build_fact_table(documents):
+    rows = []
+    for doc in documents:
+        university = doc.metadata.get("university")
+        topic = doc.metadata.get("topic")
+        if not university or university == ALL_PARTITION:
+            continue  # summaries repeat the per-university numbers
+        lines = [line.strip() for line in doc.page_content.splitlines()]
+
+        if topic == "fees":
+            level = None
+            for line in lines:
+                if FEE_HEADER.match(line):
+                    level = parse_level(line)
+                    continue
+                match = FEE_LINE.match(line)
+                if level and match:
+                    rows.append({
+                        "kind": "fee",
+                        "university": university,
+                        "level": level,
+                        "program_group": match.group(1).strip(),
+                        "fee_min": float(match.group(2).replace(",", "")),
+                        "fee_max": float(match.group(3).replace(",", "")),
+                        "note": line,
+                    })
+                elif not line:
+                    level = None
+
+        elif topic in TOPIC_LEVELS:
+            eligibility, in_section = [], False
+            for line in lines:
+                if line.lower().startswith("eligibility"):
+                    in_section = True
+                elif in_section and not line:
+                    break
+                elif in_section:
+                    eligibility.append(line.lstrip("- "))
+            if not eligibility:
+                continue
+            row = {
+                "kind": "eligibility",
+                "university": university,
+                "level": TOPIC_LEVELS[topic],
+                "program_group": "All programs",
+            }
+            notes, tests = [], []
+            for line in eligibility:
+                cgpa = CGPA_VALUE.search(line)
+                marks = MARKS_VALUE.search(line)
+                if line.lower().startswith("minimum"):
+                    if cgpa and "min_cgpa" not in row:
+                        row["min_cgpa"] = float(cgpa.group(1))
+                    if marks and "min_marks" not in row:
+                        row["min_marks"] = float(marks.group(1))
+                    notes.append(line)
+                if "test" not in line.lower() or line.lower().startswith("no "):
+                    continue
+                found = [name for name, pattern in KNOWN_TESTS if pattern.search(line)]
+                if found:
+                    tests.extend(found)
+                    notes.append(line)
+            row["test"] = " / ".join(dict.fromkeys(tests)) or None
+            row["note"] = "\n".join(dict.fromkeys(notes))
+            rows.append(row)
+    return FactTable(rows)
+
+
+def format_pkr(value):
+    return f"PKR {value:,.0f}"
+
+
+def fee_answer(table, universities, level, fields):
+    lines, ranges = [], []
+    for university in universities:
+        matches = []
+        for i in table.select(kind="fee", university=university, level=level):
+            group_fields = table.fields[i]
+            if not fields or group_fields is None or group_fields & fields:
+                matches.append(table.row(i))
+        if not matches:
+            return None  # the table does not know this program here; let RAG try
+        if lines:
+            lines.append("")
+        lines.append(f"**{university}**")
+        for row in matches:
+            lines.append(
+                f"- {row['program_group']}: {format_pkr(row['fee_min'])} – {format_pkr(row['fee_max'])}"
+            )
+        ranges.append((min(r["fee_min"] for r in matches), max(r["fee_max"] for r in matches), university))
+
+    title = f"{LEVEL_LABELS[level]} fees per semester"
+    if len(universities) > 1:
+        title = f"{LEVEL_LABELS[level]} fee comparison (per semester)"
+        ranges.sort()
+        lines.append("")
+        lines.append(f"Most affordable: **{ranges[0][2]}** · Most expensive: **{ranges[-1][2]}**")
+    return f"### {title}\n\n" + "\n".join(lines)
+
+
+def eligibility_answer(table, universities, levels):
+    lines = []
+    for university in universities:
+        indices = table.select(kind="eligibility", university=university, level=levels)
+        if len(indices) == 0:
+            return None
+        for i in indices:
+            row = table.row(i)
+            facts = []
+            if not np.isnan(row["min_marks"]):
+                facts.append(f"minimum {row['min_marks']:.0f}% marks")
+            if not np.isnan(row["min_cgpa"]):
+                facts.append(f"minimum {row['min_cgpa']:.1f} CGPA")
+            if row["test"]:
+                facts.append(f"test: {row['test']}")
+            lines.append(f"**{university} — {LEVEL_LABELS[row['level']]}:** " + ", ".join(facts))
+            lines.extend(f"- {note}" for note in row["note"].splitlines())
+    return "\n".join(lines)
+
+
+def answer_from_facts(user_message, analysis):
+    table = fact_table  # read once: a knowledge base reload may replace it
+    if table is None or len(user_message.split()) > FACT_MAX_WORDS:
+        return None
+    if FACT_BLOCKERS.search(user_message):
+        return None
+
+    levels = [level for level, pattern in LEVEL_PATTERNS.items() if pattern.search(user_message)]
+    universities = list(analysis.universities) or list(dict.fromkeys(table.columns["university"]))
+    asks_fee = bool(FEE_QUESTION.search(user_message))
+    asks_eligibility = bool(ELIGIBILITY_QUESTION.search(user_message) or TEST_QUESTION.search(user_message))
+
+    if asks_fee == asks_eligibility:
+        return None  # neither, or a mixed question
+    if not analysis.universities and not (asks_fee and analysis.comparison):
+        # No university we serve is named ("... at Riphah?"): only an
+        # explicit comparison ("which university is cheapest ...") gets
+        # every university's fees.
+        return None
+    if asks_fee:
+        if len(levels) > 1:
+            return None
+        fields = program_fields(user_message)
+        if not fields and names_program(user_message):
+            return None  # a program the table has no group for (MBBS, ...)
+        body = fee_answer(table, universities, levels[0] if levels else "BS", fields)
+    else:
+        body = eligibility_answer(table, universities, levels or list(LEVEL_LABELS))
+    if body is None:
+        return None
+    return (
+        f"{body}\n\n"
+        "*From our curated admissions data. Always verify the latest figures on the official university website.*"
+    )
+
+
+# Built-in documents only until warm_start has read KB_DIR (see adopt_corpus).
+fact_table = build_fact_table(builtin_documents()) if FACT_FAST_PATH else None
+
+
+# ==============================
+# INTENT ROUTER
+# Greetings, thanks and questions outside the knowledge base get a
+# templated reply instead of retrieval and a 70B completion. Keyword rules
+# run first, before anything else in a request (and before the knowledge
+# base has loaded). Short messages the rules do not recognise are then
+# matched against per-intent centroids of INTENT_EXAMPLES, using the query
+# vector the request computes anyway for the cache and search, so the
+# centroid check costs one small matrix product. A question that names a
+# covered university or an admissions topic always goes to retrieval.
+# ==============================
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "1") == "1"
+INTENT_MAX_WORDS = int(os.getenv("INTENT_MAX_WORDS", "8"))  # longer messages skip the centroid check
+INTENT_CENTROID_THRESHOLD = float(os.getenv("INTENT_CENTROID_THRESHOLD", "0.55"))  # cosine similarity
+GREETING_PATTERN = re.compile(
+    r"^\W*(?:hi+|hello|hey+|hiya|greetings|salam|salaam|as?salam\w*(?: ?o? ?alaikum)?|aoa|"
+    r"good (?:morning|afternoon|evening))"
+    r"(?:\W+(?:there|all|everyone|again|bot|sir|madam|ma'?am))*\W*$",
+    re.IGNORECASE,
+)
+THANKS_PATTERN = re.compile(
+    r"^\W*(?:(?:ok(?:ay)?|great|perfect|nice|cool|got it)\W+)*"
+    r"(?:thanks?|thank you|thx|ty|shukriya|jazak\w*(?: allah\w*)?|bye|goodbye|allah hafiz|khuda hafiz)"
+    r"(?:\W+(?:a lot|so much|very much|again|bro|sir|madam|ma'?am|for (?:the|your) help))*\W*$",
+    re.IGNORECASE,
+)
+# Universities students ask about that this knowledge base does not cover
+# (unless KB_DIR adds them, in which case analyze_query finds them first).
+OTHER_UNIVERSITIES = {
+    "LUMS": r"lums|lahore university of management sciences",
+    "FAST": r"(?-i:FAST)|nuces|fast[- ]nu(?:ces)?",
+    "GIKI": r"giki?|ghulam ishaq khan(?: institute)?",
+    "IBA": r"iba|institute of business administration",
+    "PIEAS": r"pieas",
+    "Punjab University": r"punjab university|university of (?:the )?punjab",
+    "Aga Khan University": r"aga khan(?: university)?|aku",
+    "NED": r"ned(?: university)?",
+    "Bahria University": r"bahria(?: university)?",
+    "Air University": r"air university",
+    "Habib University": r"habib university",
+}
+OTHER_UNIVERSITY_PATTERNS = {
+    name: re.compile(r"\b(?:" + pattern + r")\b", re.IGNORECASE) for name, pattern in OTHER_UNIVERSITIES.items()
+}
+# Example messages per intent; "admissions" is the class that goes to retrieval.
+INTENT_EXAMPLES = {
+    "greeting": [
+        "hi", "hello there", "hey, how are you?", "good morning", "assalam o alaikum",
+        "hello, who are you?", "hi, what can you do?", "is anyone there?",
+    ],
+    "thanks": [
+        "thanks", "thank you so much", "that was helpful, thanks", "great, that helps",
+        "ok bye", "thanks for your help", "appreciate it", "got it, thank you",
+    ],
+    "off_topic": [
+        "tell me a joke", "what is the weather today", "write a poem", "who won the cricket match",
+        "what is the capital of France", "help me with my python code", "what is your favourite movie",
+        "recommend a good restaurant",
+    ],
+    "admissions": [
+        "what are the fees", "eligibility for engineering", "when is the entry test",
+        "which programs are offered", "how do I apply", "is there any scholarship",
+        "minimum marks required for BS", "admission deadline", "hostel facilities", "merit calculation",
+    ],
+}
+INTENT_REPLIES = {
+    "greeting": (
+        "Hi! I can help with admissions to {universities}: programs, eligibility, entry tests, fees "
+        "and scholarships. What would you like to know?"
+    ),
+    "thanks": "You're welcome! Ask me anytime about admissions to {universities}.",
+    "off_topic": (
+        "I can only help with university admissions in Pakistan, for {universities}. "
+        "Try asking about programs, eligibility, entry tests, fees or scholarships."
+    ),
+    "out_of_scope": (
+        "Sorry, I don't have information about {other}. I only cover {universities}. "
+        "Please check {other}'s official website, or ask me about one of these universities."
+    ),
+}
+
+
+def join_list(names):
+    names = list(names)
+    return ", ".join(names[:-1]) + f" and {names[-1]}" if len(names) > 1 else "".join(names)
+
+
+class IntentRouter:
+    """Keyword rules plus nearest-centroid matching over INTENT_EXAMPLES.
+
+    classify() returns (intent, method); intent is "admissions" for anything
+    that should be answered from the knowledge base.
+    """
+
+    def __init__(self, universities):
+        self.universities = list(universities)
+        self.intents = []
+        self.centroids = None
+
+    def fit(self, embeddings):
+        intents = list(INTENT_EXAMPLES)
+        centroids = []
+        for intent in intents:
+            vectors = normalized(embeddings.embed_documents(INTENT_EXAMPLES[intent]))
+            centroids.append(vectors.mean(axis=0))
+        self.centroids = normalized(centroids)
+        self.intents = intents
+        return self
+
+    def keyword_intent(self, user_message, analysis):
+        if analysis.universities:
+            return None
+        if GREETING_PATTERN.match(user_message):
+            return "greeting"
+        if THANKS_PATTERN.match(user_message):
+            return "thanks"
+        if any(pattern.search(user_message) for pattern in OTHER_UNIVERSITY_PATTERNS.values()):
+            return "out_of_scope"
+        return None
+
+    def centroid_intent(self, user_message, analysis, query_vector):
+        centroids = self.centroids  # read once: fit() may replace it
+        if centroids is None or analysis.universities or analysis.topics:
+            return None
+        if len(user_message.split()) > INTENT_MAX_WORDS:
+            return None
+        similarities = centroids @ normalized([query_vector])[0]
+        best = int(np.argmax(similarities))
+        if self.intents[best] == "admissions" or similarities[best] < INTENT_CENTROID_THRESHOLD:
+            return None
+        return self.intents[best]
+
+    def classify(self, user_message, analysis, query_vector=None):
+        intent = self.keyword_intent(user_message, analysis)
+        if intent is not None:
+            return intent, "keyword"
+        if query_vector is not None:
+            intent = self.centroid_intent(user_message, analysis, query_vector)
+            if intent is not None:
+                return intent, "centroid"
+        return "admissions", "none"
+
+    def reply(self, intent, user_message):
+        other = next((name for name, pattern in OTHER_UNIVERSITY_PATTERNS.items() if pattern.search(user_message)), "")
+        return INTENT_REPLIES[intent].format(universities=join_list(self.universities), other=other)
+
+
+def normalized(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def served_universities(documents):
+    return list(dict.fromkeys(
+        doc.metadata["university"] for doc in documents if doc.metadata.get("university", ALL_PARTITION) != ALL_PARTITION
+    ))
+
+
+def route_intent(user_message, trace, query_vector=None):
+    """Templated reply for small talk and uncovered universities, or None.
+
+    Called without a vector (keyword rules only) at the start of a request,
+    then with the query vector once it exists; the routing decision is
+    counted on the call that makes it.
+    """
+    router = intent_router  # read once: a knowledge base reload may replace it
+    if router is None:
+        return None
+    analysis = analyze_query(user_message)
+    intent, method = router.classify(user_message, analysis, query_vector)
+    if intent == "admissions" and query_vector is None:
+        return None
+    metrics.inc("universe_pk_intent_routes_total", intent=intent, method=method)
+    trace.fields.update(intent=intent, intent_method=method)
+    if intent == "admissions":
+        return None
+    return router.reply(intent, user_message)
+
+
+# Built-in universities only until warm_start has read KB_DIR and loaded the
+# embedding model (see adopt_corpus and warm_start).
+intent_router = IntentRouter(served_universities(builtin_documents())) if INTENT_ROUTER_ENABLED else None
+
+
+# ==============================
+# RAG STAGES
+# Shared by the sync and async chat paths. The query is embedded once and
+# the vector is reused for both the answer cache and the FAISS search.
+# ==============================
+def embed_query(user_message):
+    return embeddings.embed_query(user_message)
+
+
+def expand_topics(topics):
+    wanted = set(topics)
+    for topic in topics:
+        wanted.update(RELATED_TOPICS.get(topic, ()))
+    return sorted(wanted)
+
+
+def chunks_at(store, positions):
+    """The Documents at FAISS `positions` of a partition, in order (None for -1)."""
+    docstore = store.docstore
+    if isinstance(docstore, ChunkStore):
+        return docstore.at(positions)  # one read for all of them
+    return [None if p < 0 else docstore.search(store.index_to_docstore_id[int(p)]) for p in positions]
+
+
+def dense_search(store, query_vector, k, topics=(), hits=None):
+    """(doc, L2 distance) for the k nearest chunks, only those of `topics` if given.
+
+    Reads 4 * k candidates when filtering on topics (as
+    similarity_search_with_score_by_vector does with fetch_k), k otherwise.
+    `hits` are this query's (distances, positions) rows from a batched
+    index.search at least that deep (see retrieve_batch).
+    """
+    depth = 4 * k if topics else k
+    if hits is None:
+        distances, positions = store.index.search(np.asarray([query_vector], dtype="float32"), depth)
+        hits = distances[0], positions[0]
+    distances, positions = hits[0][:depth], hits[1][:depth]
+    dense = []
+    for distance, doc in zip(distances, chunks_at(store, positions)):
+        if doc is None:
+            continue  # fewer chunks than requested
+        if topics and doc.metadata.get("topic") not in topics:
+            continue
+        dense.append((doc, float(distance)))
+        if len(dense) == k:
+            break
+    return dense
+
+
+def search_partition(snapshot, name, query_vector, query_text, k, topics, hits=None):
+    """Return (dense, lexical) ranked hit lists for one partition of snapshot.
+
+    Dense hits are (doc, L2 distance), lexical hits (doc, BM25 score).
+    """
+    store = snapshot.partitions.get(name)
+    if store is None:
+        return [], []
+    topics = expand_topics(topics) if name != ALL_PARTITION else []
+
+    dense = []
+    if topics:
+        dense = dense_search(store, query_vector, k, topics, hits)
+    if not dense:
+        topics = []
+        dense = dense_search(store, query_vector, k, hits=hits)
+
+    lexical = []
+    lexical_index = snapshot.lexical_indexes.get(name)
+    if HYBRID_SEARCH and lexical_index is not None:
+        ranked = lexical_index.ranked(query_text, 4 * k if topics else k)
+        for (_, score), doc in zip(ranked, chunks_at(store, [position for position, _ in ranked])):
+            if doc is None or (topics and doc.metadata.get("topic") not in topics):
+                continue
+            lexical.append((doc, score))
+            if len(lexical) == k:
+                break
+    return dense, lexical
+
+
+def fuse(dense, lexical, k):
+    # Reciprocal-rank fusion: only ranks matter, so L2 distances and BM25
+    # scores never have to be put on the same scale.
+    scores = {}
+    docs = {}
+    for ranked in (dense, lexical):
+        for rank, (doc, _) in enumerate(ranked):
+            scores[doc.id] = scores.get(doc.id, 0.0) + 1.0 / (RRF_K + rank + 1)
+            docs[doc.id] = doc
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[doc_id] for doc_id in best]
+
+
+def search_plan(snapshot, analysis):
+    # The partitions search() reads for this question.
+    if not analysis.universities:
+        return list(snapshot.partitions)
+    if not analysis.comparison:
+        return analysis.universities[:1]
+    return [*analysis.universities, ALL_PARTITION]
+
+
+def search(query_vector, analysis, query_text="", snapshot=None, hits=None, trace=None):
+    return rerank(query_text, retrieve(query_vector, analysis, query_text, snapshot, hits), trace)
+
+
+def retrieve(query_vector, analysis, query_text="", snapshot=None, hits=None):
+    """search() up to the reranker: its groups of (candidates, k).
+
+    k chunks of each group are sent to the LLM, or the reranker's pick of a
+    wider candidate set (see rerank). Callers that time the two stages
+    apart call this, then rerank(). hits: partition -> precomputed dense
+    rows, when called from retrieve_batch.
+    """
+    if snapshot is None:
+        snapshot = live_index  # read once: a reload may swap it mid-request
+    hits = hits or {}
+    if not analysis.universities:
+        # Nothing to narrow on: fan out to every partition and keep the best.
+        k = candidate_count(RETRIEVAL_K)
+        dense, lexical = [], []
+        for name in snapshot.partitions:
+            d, l = search_partition(snapshot, name, query_vector, query_text, k, analysis.topics, hits.get(name))
+            dense.extend(d)
+            lexical.extend(l)
+        dense.sort(key=lambda hit: hit[1])                    # L2 distance, lower is closer
+        lexical.sort(key=lambda hit: hit[1], reverse=True)    # BM25, higher is better
+        return [(fuse(dense, lexical, k), RETRIEVAL_K)]
+
+    if not analysis.comparison:
+        name = analysis.universities[0]
+        k = candidate_count(RETRIEVAL_K)
+        dense, lexical = search_partition(
+            snapshot, name, query_vector, query_text, k, analysis.topics, hits.get(name)
+        )
+        return [(fuse(dense, lexical, k), RETRIEVAL_K)]
+
+    # Comparisons: every named university gets its own share of the context,
+    # plus the best cross-university summaries.
+    groups = []
+    for name in analysis.universities:
+        k = candidate_count(RETRIEVAL_K_PER_UNIVERSITY)
+        dense, lexical = search_partition(
+            snapshot, name, query_vector, query_text, k, analysis.topics, hits.get(name)
+        )
+        groups.append((fuse(dense, lexical, k), RETRIEVAL_K_PER_UNIVERSITY))
+    k = candidate_count(RETRIEVAL_K_PER_UNIVERSITY - 1)
+    dense, lexical = search_partition(
+        snapshot, ALL_PARTITION, query_vector, query_text, k, (), hits.get(ALL_PARTITION)
+    )
+    groups.append((fuse(dense, lexical, k), RETRIEVAL_K_PER_UNIVERSITY - 1))
+    return groups
+
+
+def retrieve_batch(query_vectors, analyses, query_texts):
+    """retrieve() for many questions at once, with one FAISS search per
+    partition for all the questions that read it instead of one per question."""
+    snapshot = live_index
+    matrix = np.asarray(query_vectors, dtype="float32")
+    rows = {}
+    for row, analysis in enumerate(analyses):
+        for name in search_plan(snapshot, analysis):
+            rows.setdefault(name, []).append(row)
+
+    depth = 4 * candidate_count(max(RETRIEVAL_K, RETRIEVAL_K_PER_UNIVERSITY))  # deep enough for topic filtering
+    hits = [{} for _ in analyses]
+    for name, partition_rows in rows.items():
+        store = snapshot.partitions.get(name)
+        if store is None:
+            continue
+        distances, positions = store.index.search(matrix[partition_rows], depth)
+        for i, row in enumerate(partition_rows):
+            hits[row][name] = (distances[i], positions[i])
+    return [
+        retrieve(vector, analysis, text, snapshot, row_hits)
+        for vector, analysis, text, row_hits in zip(matrix, analyses, query_texts, hits)
+    ]
+
+
+# ==============================
+# RERANKER
+# Optional second stage: search fetches RERANK_CANDIDATE_FACTOR times as
+# many chunks as it would send, a small CPU cross-encoder scores them all in
+# one batch, and only the best RERANK_TOP_K of every RETRIEVAL_K reach the
+# LLM. Scores are cached per (question, chunk), so repeated and coalesced
+# questions skip the model.
+# ==============================
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATE_FACTOR = int(os.getenv("RERANK_CANDIDATE_FACTOR", "3"))
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "3"))  # chunks kept per RETRIEVAL_K retrieved
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))  # (question, chunk) scores
+
+
+class Reranker:
+    """Cross-encoder relevance scores for (question, chunk) pairs, with an LRU cache."""
+
+    def __init__(self, model, cache_size=RERANK_CACHE_SIZE):
+        self.model = model
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query_key, doc):
+        # The content hash keeps a score from outliving an edit to its chunk.
+        return query_key, doc.id, hash(doc.page_content)
+
+    def scores(self, query, docs):
+        query_key = normalize_query(query)
+        keys = [self._key(query_key, doc) for doc in docs]
+        with self._lock:
+            scores = [self._cache.get(key) for key in keys]
+            for key, score in zip(keys, scores):
+                if score is not None:
+                    self._cache.move_to_end(key)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        metrics.inc("universe_pk_rerank_pairs_total", len(docs) - len(missing), result="cached")
+        metrics.inc("universe_pk_rerank_pairs_total", len(missing), result="scored")
+        if not missing:
+            return scores
+
+        values = self.model.predict(
+            [(query, docs[i].page_content) for i in missing], batch_size=len(missing), show_progress_bar=False
+        )
+        with self._lock:
+            for i, value in zip(missing, values):
+                scores[i] = float(value)
+                self._cache[keys[i]] = scores[i]
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return scores
+
+
+def load_reranker():
+    if EMBEDDING_SERVER:
+        return Reranker(RemoteCrossEncoder(EMBEDDING_SERVER))
+    from sentence_transformers import CrossEncoder
+
+    return Reranker(CrossEncoder(RERANK_MODEL, device="cpu"))
+
+
+# Loaded by warm_start when RERANK_ENABLED.
+reranker = None
+
+
+def candidate_count(k):
+    return k * RERANK_CANDIDATE_FACTOR if reranker is not None else k
+
+
+def rerank(query_text, groups, trace=None):
+    """Chunks to send for search's groups of (candidates, k), in group order.
+
+    Without a reranker each group's candidates are its k hits, sent as they
+    are. With one, all candidates are scored in a single batch and each
+    group keeps its best k * RERANK_TOP_K / RETRIEVAL_K (at least one). The
+    rerank time and the tokens saved against sending the first k of every
+    group are recorded on `trace` (and in the metrics).
+    """
+    keeps = [max(1, round(k * RERANK_TOP_K / RETRIEVAL_K)) for _, k in groups]
+    if reranker is None or not query_text or all(len(c) <= keep for (c, _), keep in zip(groups, keeps)):
+        # Nothing to choose between (small partitions): skip the model.
+        return [doc for candidates, k in groups for doc in candidates[:k]]
+
+    started = time.perf_counter()
+    scores = reranker.scores(query_text, [doc for candidates, _ in groups for doc in candidates])
+    docs, baseline, offset = [], [], 0
+    for (candidates, k), keep in zip(groups, keeps):
+        group_scores = scores[offset:offset + len(candidates)]
+        offset += len(candidates)
+        best = sorted(range(len(candidates)), key=lambda i: group_scores[i], reverse=True)[:keep]
+        docs.extend(candidates[i] for i in best)
+        baseline.extend(candidates[:k])
+    rerank_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    saved = count_tokens("\n\n".join(doc.page_content for doc in baseline)) - count_tokens(
+        "\n\n".join(doc.page_content for doc in docs)
+    )
+    metrics.inc("universe_pk_rerank_saved_tokens_total", max(saved, 0))
+    if trace is not None:
+        trace.stages_ms["rerank"] = rerank_ms
+        trace.fields.update(rerank_candidates=offset, rerank_kept=len(docs), rerank_saved_tokens=saved)
+    return docs
+
+
+# ==============================
+# CONTEXT PACKER
+# Turns the ranked chunks into the prompt context under a token budget:
+# adjacent chunks of the same source document are merged and their
+# chunk_overlap text removed, the repeated "University:/Topic:" lines (or
+# the structured chunker's "[title]" lines) become one compact header per
+# document, and sections are emitted in relevance order (optionally
+# re-ordered with MMR for diversity).
+# ==============================
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_MMR = os.getenv("CONTEXT_MMR", "0") == "1"
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+
+
+def count_tokens(text):
+    # Llama-style BPE averages roughly 4 characters per token on this
+    # English/number-heavy text; good enough for budgeting.
+    return (len(text) + 3) // 4
+
+
+def chunk_position(doc):
+    # Chunk ids are "<document hash>-<chunk number>" (see split_document).
+    source, _, number = (doc.id or "").rpartition("-")
+    if source and number.isdigit():
+        return source, int(number)
+    return doc.id or doc.page_content, 0
+
+
+def strip_overlap(previous, following, max_overlap=CHUNK_OVERLAP * 2):
+    """Return `following` without the text it repeats from the end of `previous`."""
+    for size in range(min(len(previous), len(following), max_overlap), 9, -1):
+        if previous.endswith(following[:size]):
+            return following[size:]
+    # No shared text: the splitter cut at a paragraph break.
+    return "\n\n" + following
+
+
+def split_header(text):
+    """Split leading "University:/Topic:" lines, or a "[title]" line, off a chunk."""
+    header = {}
+    lines = text.strip().splitlines()
+    if lines and TITLE_LINE.match(lines[0].strip()):
+        header["Title"] = TITLE_LINE.match(lines.pop(0).strip()).group(1)
+    while lines:
+        match = HEADER_LINE.match(lines[0].strip())
+        if not match:
+            break
+        header[match.group(1)] = match.group(2).strip()
+        lines.pop(0)
+    return header, "\n".join(lines).strip()
+
+
+def build_sections(docs):
+    """Group ranked chunks by source document, in order of best rank."""
+    sources = {}
+    for rank, doc in enumerate(docs):
+        source, number = chunk_position(doc)
+        entry = sources.setdefault(source, {"rank": rank, "chunks": {}, "metadata": doc.metadata})
+        entry["chunks"].setdefault(number, doc.page_content)
+
+    sections = []
+    for entry in sources.values():
+        chunks = entry["chunks"]
+        header, parts, bodies, previous = {}, [], {}, None
+        for number in sorted(chunks):
+            # Structured chunks all carry a title line; only the section gets it.
+            chunk_header, bodies[number] = split_header(chunks[number])
+            for key, value in chunk_header.items():
+                header.setdefault(key, value)
+            if previous is not None and number == previous + 1:
+                parts.append(strip_overlap(bodies[previous], bodies[number]))
+            else:
+                parts.append(("\n…\n" if parts else "") + bodies[number])
+            previous = number
+
+        title = header.get("Title") or section_title(header, entry["metadata"])
+        sections.append({"rank": entry["rank"], "title": title, "body": "".join(parts).strip()})
+    sections.sort(key=lambda s: s["rank"])
+    return sections
+
+
+def mmr_order(sections, lambda_=CONTEXT_MMR_LAMBDA):
+    # Relevance comes from retrieval rank, redundancy from token overlap
+    # with the sections already picked.
+    token_sets = [set(tokenize(s["body"])) for s in sections]
+    remaining = list(range(len(sections)))
+    chosen = []
+    while remaining:
+        def score(i):
+            relevance = 1.0 / (1 + sections[i]["rank"])
+            redundancy = max(
+                (len(token_sets[i] & token_sets[j]) / (len(token_sets[i] | token_sets[j]) or 1) for j in chosen),
+                default=0.0,
+            )
+            return lambda_ * relevance - (1 - lambda_) * redundancy
+        best = max(remaining, key=score)
+        chosen.append(best)
+        remaining.remove(best)
+    return [sections[i] for i in chosen]
+
+
+def assemble_context(docs, budget=None, mmr=None):
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    mmr = CONTEXT_MMR if mmr is None else mmr
+    sections = build_sections(docs)
+    if mmr:
+        sections = mmr_order(sections)
+
+    blocks, used, truncated = [], 0, False
+    for section in sections:
+        block = f"[{section['title']}]\n{section['body']}" if section["title"] else section["body"]
+        tokens = count_tokens(block) + 1
+        if used + tokens > budget:
+            # Keep whole lines of the section that still fit, if that is
+            # enough to be useful; otherwise stop here.
+            kept = []
+            for line in block.splitlines():
+                if used + count_tokens("\n".join(kept + [line])) + 1 > budget:
+                    break
+                kept.append(line)
+            if len(kept) > 1:
+                blocks.append("\n".join(kept))
+                truncated = True
+            break
+        blocks.append(block)
+        used += tokens
+
+    context = "\n\n".join(blocks)
+    stats = {
+        "chunks": len(docs),
+        "sections": len(blocks),
+        "dropped_sections": len(sections) - len(blocks),
+        "truncated": truncated,
+        "raw_tokens": count_tokens("\n\n".join(doc.page_content for doc in docs)),
+        "context_tokens": count_tokens(context),
+    }
+    logger.info(
+        "context chunks=%d sections=%d dropped=%d truncated=%s raw_tokens=%d context_tokens=%d",
+        stats["chunks"], stats["sections"], stats["dropped_sections"], stats["truncated"],
+        stats["raw_tokens"], stats["context_tokens"],
+    )
+    return context, stats
+
+
+# ==============================
+# PROMPT
+# The instructions and the list of served universities go in a system
+# message that only changes when the knowledge base does, so it is
+# byte-identical across requests and providers can cache it as a prefix.
+# Only the user message (conversation, context, question) varies. Every
+# prompt is kept under PROMPT_MAX_TOKENS: the context gets what the other
+# parts leave of it, then the conversation is dropped, then the question
+# clipped, so a larger k or chunk size cannot grow prompts unnoticed.
+# ==============================
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "2400"))
+SYSTEM_PROMPT_TEMPLATE = """You are a helpful university admissions assistant for Pakistani students.
+You have detailed knowledge about these {count} universities:
+{universities}
+
+Use the context in the student's message to answer their question clearly and accurately.
+Use bullet points for lists. Be specific with numbers, percentages, and requirements.
+If the question is about a university not in your knowledge base, politely say you only cover these {count} universities.
+If specific information is not in the context, say so honestly and suggest checking the official website."""
+MIN_QUESTION_TOKENS = 64  # clipped questions keep at least this much
+
+
+class PromptTooLong(ValueError):
+    pass
+
+
+class Prompt(namedtuple("Prompt", ["system", "user", "context", "memory"])):
+    """A compiled prompt; context and memory are the parts of `user` they name."""
+
+    __slots__ = ()
+
+    @property
+    def tokens(self):
+        return count_tokens(self.system) + count_tokens(self.user)
+
+    def messages(self):
+        return [{"role": "system", "content": self.system}, {"role": "user", "content": self.user}]
+
+
+def university_names(documents):
+    # Display name per served university: the "name" metadata of KB_DIR
+    # documents, else the "University:" line its first document starts with.
+    names = {}
+    for doc in documents:
+        university = doc.metadata.get("university", ALL_PARTITION)
+        if university == ALL_PARTITION or university in names:
+            continue
+        header = HEADER_LINE.match(doc.page_content.strip().split("\n", 1)[0])
+        names[university] = doc.metadata.get("name") or (header.group(2) if header and header.group(1) == "University" else university)
+    return list(names.values())
+
+
+def compile_system_prompt(documents):
+    names = university_names(documents)
+    return SYSTEM_PROMPT_TEMPLATE.format(
+        count=len(names), universities="\n".join(f"{i}. {name}" for i, name in enumerate(names, 1))
+    )
+
+
+def user_prompt(user_message, context, memory="", query=None):
+    conversation = f"Conversation so far:\n{memory}\n\n" if memory else ""
+    interpreted = f"\n(Interpreted as: {query})" if query and query != user_message else ""
+    return f"""{conversation}Context:
+{context}
+
+Student Question: {user_message}{interpreted}
+
+Answer:"""
+
+
+def compile_prompt(user_message, docs, memory="", query=None, max_tokens=None):
+    """Return (Prompt, stats) for the ranked chunks, within max_tokens."""
+    max_tokens = PROMPT_MAX_TOKENS if max_tokens is None else max_tokens
+    system = system_prompt  # read once: a knowledge base reload may replace it
+    clipped = []
+
+    def fixed_tokens():
+        return count_tokens(system) + count_tokens(user_prompt(user_message, "", memory, query))
+
+    if memory and max_tokens - fixed_tokens() <= 0:
+        memory = ""
+        clipped.append("memory")
+    if max_tokens - fixed_tokens() <= 0:
+        # Leaves room for the "(Interpreted as: ...)" line and the clip marks.
+        room = max_tokens - count_tokens(system) - count_tokens(user_prompt("", "", "", None)) - 8
+        if room < MIN_QUESTION_TOKENS:
+            raise PromptTooLong(f"the system prompt alone is {count_tokens(system)} of PROMPT_MAX_TOKENS={max_tokens} tokens")
+        share = room // 2 if query and query != user_message else room
+        query = clip_tokens(query, share) if query and query != user_message else None
+        user_message = clip_tokens(user_message, share)
+        clipped.append("question")
+
+    budget = min(CONTEXT_TOKEN_BUDGET, max(0, max_tokens - fixed_tokens() - 1))
+    if budget < CONTEXT_TOKEN_BUDGET:
+        clipped.append("context")
+    context, stats = assemble_context(docs, budget=budget)
+    prompt = Prompt(system, user_prompt(user_message, context, memory, query), context, memory)
+    for part in clipped:
+        metrics.inc("universe_pk_prompt_clipped_total", part=part)
+    stats.update(
+        system_tokens=count_tokens(system),
+        memory_tokens=count_tokens(memory),
+        prompt_tokens=prompt.tokens,
+        clipped=clipped,
+    )
+    return prompt, stats
+
+
+# Built-in universities only until warm_start has read KB_DIR (see adopt_corpus).
+system_prompt = compile_system_prompt(builtin_documents())
+covered_universities = served_universities(builtin_documents())
+
+
+def completion_kwargs(prompt, **options):
+    # A Prompt from compile_prompt, or a plain string sent as one user message.
+    messages = prompt.messages() if isinstance(prompt, Prompt) else [{"role": "user", "content": prompt}]
+    return dict(
+        messages=messages,
+        temperature=0.3,
+        max_tokens=1024,
+        stream=True,
+    ) | options
+
+
+def interrupted_reply(answer, error):
+    if answer:
+        # Keep what the student has already read instead of replacing it.
+        return f"{answer.strip()}\n\n⚠️ The response was interrupted: {str(error)}"
+    return f"Sorry, an error occurred: {str(error)}"
+
+
+EMPTY_REPLY = "Sorry, no answer was generated. Please try rephrasing your question."
+
+
+# ==============================
+# LLM BACKENDS
+# chat() streams from `llm`, a ResilientLLM over one or more backends
+# (primary model first, then the fallback model). Each backend yields
+# StreamEvents from a Groq or OpenAI-compatible streaming completion.
+# ResilientLLM adds an overall deadline per call, jittered retries on
+# 429/5xx/timeouts, a circuit breaker per backend and failover to the next
+# backend. Retries only happen before the first token reaches the student;
+# once text has been streamed, an error is surfaced instead of repeating it.
+# ==============================
+StreamEvent = namedtuple("StreamEvent", "text usage backend")
+
+
+class LLMTimeout(Exception):
+    pass
+
+
+class LLMUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; then lets one trial call through per cooldown."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            # A trial that never reports back (the student cancelled) does
+            # not block the next one.
+            if now - max(self.opened_at, self.trial_at or 0) >= self.cooldown:
+                self.trial_at = now
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half_open" if self.trial_at and self.trial_at > self.opened_at else "open"
+
+
+def llm_error_kind(error):
+    """"rate_limited", "retryable", or None for errors a retry will not fix."""
+    if isinstance(error, (LLMTimeout, httpx.TransportError, APIConnectionError)):
+        return "retryable"
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return "rate_limited"
+    if status in (408, 409) or (status is not None and status >= 500):
+        return "retryable"
+    return None
+
+
+def retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def usage_dict(usage):
+    if usage is None:
+        return None
+    if not isinstance(usage, dict):
+        details = getattr(usage, "prompt_tokens_details", None)
+        usage = {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": getattr(details, "cached_tokens", None)},
+        }
+    # Prompt tokens the provider served from its prefix cache, when reported.
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "prompt_tokens": usage["prompt_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+        "cached_tokens": details.get("cached_tokens"),
+    }
+
+
+class GroqBackend:
+    def __init__(self, model, sync_client, async_client):
+        self.model = model
+        self.name = f"groq:{model}"
+        self.client = sync_client
+        self.async_client = async_client
+        self.breaker = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN_SECONDS)
+
+    def _event(self, chunk):
+        text = chunk.choices[0].delta.content if chunk.choices else None
+        # Groq reports token usage on the last chunk of a stream, under x_groq.
+        usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+        return StreamEvent(text, usage_dict(usage), self.name)
+
+    def stream(self, prompt, timeout, options):
+        stream = self.client.chat.completions.create(
+            model=self.model, timeout=timeout, **completion_kwargs(prompt, **options)
+        )
+        with stream:
+            for chunk in stream:
+                yield self._event(chunk)
+
+    async def astream(self, prompt, timeout, options):
+        stream = await self.async_client.chat.completions.create(
+            model=self.model, timeout=timeout, **completion_kwargs(prompt, **options)
+        )
+        async with stream:
+            async for chunk in stream:
+                yield self._event(chunk)
+
+
+class OpenAICompatibleBackend:
+    """Streams /chat/completions (server-sent events) from an OpenAI-compatible server."""
+
+    def __init__(self, base_url, model, api_key=None):
+        self.model = model
+        self.name = f"openai:{model}"
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        limits = httpx.Limits(max_connections=GROQ_MAX_CONNECTIONS, max_keepalive_connections=GROQ_MAX_KEEPALIVE)
+        self.http = httpx.Client(base_url=base_url, headers=headers, limits=limits)
+        self.async_http = httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits)
+        self.breaker = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN_SECONDS)
+
+    def _body(self, prompt, options):
+        return {"model": self.model, "stream_options": {"include_usage": True}, **completion_kwargs(prompt, **options)}
+
+    def _event(self, line):
+        if not line.startswith("data:"):
+            return None
+        data = line[len("data:"):].strip()
+        if not data or data == "[DONE]":
+            return None
+        payload = json.loads(data)
+        choices = payload.get("choices") or []
+        text = (choices[0].get("delta") or {}).get("content") if choices else None
+        return StreamEvent(text, usage_dict(payload.get("usage")), self.name)
+
+    def stream(self, prompt, timeout, options):
+        with self.http.stream("POST", "/chat/completions", json=self._body(prompt, options), timeout=timeout) as response:
+            if response.is_error:
+                response.read()
+                response.raise_for_status()
+            for line in response.iter_lines():
+                event = self._event(line)
+                if event is not None:
+                    yield event
+
+    async def astream(self, prompt, timeout, options):
+        async with self.async_http.stream(
+            "POST", "/chat/completions", json=self._body(prompt, options), timeout=timeout
+        ) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                event = self._event(line)
+                if event is not None:
+                    yield event
+
+
+class ResilientLLM:
+    def __init__(self, backends, deadline=LLM_DEADLINE_SECONDS, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE_SECONDS, backoff_max=LLM_BACKOFF_MAX_SECONDS,
+                 on_rate_limit=None):
+        self.backends = backends
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Called with the server's Retry-After (or None) on every 429.
+        self.on_rate_limit = on_rate_limit
+
+    def _timeout(self, deadline):
+        remaining = max(deadline - time.monotonic(), 0.001)
+        return httpx.Timeout(
+            min(LLM_READ_TIMEOUT_SECONDS, remaining),
+            connect=min(LLM_CONNECT_TIMEOUT_SECONDS, remaining),
+        )
+
+    @staticmethod
+    def _check_deadline(deadline):
+        if time.monotonic() > deadline:
+            raise LLMTimeout("The language model took too long to answer.")
+
+    def _retry_delay(self, backend, error, kind, attempt, is_last_backend, deadline):
+        """Seconds to wait before retrying `backend`, or None to move on to the next backend."""
+        if attempt >= self.max_retries or backend.breaker.state() != "closed":
+            return None
+        if kind == "rate_limited" and not is_last_backend:
+            return None  # the fallback model has its own rate limit; use it now
+        delay = retry_after(error)
+        if delay is None:
+            # Full jitter: spreads the retries of many concurrent requests.
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def _attempt_failed(self, backend, error, attempt, streamed):
+        kind = llm_error_kind(error)
+        metrics.inc("universe_pk_llm_attempts_total", backend=backend.name, outcome=kind or "error")
+        if kind is None:
+            backend.breaker.success()  # the backend answered; the request was at fault
+        else:
+            backend.breaker.failure()
+        if kind == "rate_limited" and self.on_rate_limit is not None:
+            self.on_rate_limit(retry_after(error))
+        logger.warning("LLM %s attempt %d failed (%s): %r", backend.name, attempt + 1, kind, error)
+        # Text already shown to the student cannot be taken back, and a
+        # bad request will fail the same way on every model.
+        return kind is not None and not streamed, kind
+
+    def _attempt_succeeded(self, backend):
+        backend.breaker.success()
+        metrics.inc("universe_pk_llm_attempts_total", backend=backend.name, outcome="ok")
+
+    def _candidates(self, deadline):
+        for index, backend in enumerate(self.backends):
+            if time.monotonic() >= deadline:
+                return
+            if not backend.breaker.allow():
+                continue
+            if index:
+                metrics.inc("universe_pk_llm_failovers_total", backend=backend.name)
+            yield backend, index == len(self.backends) - 1
+
+    def _failed(self, errors):
+        if errors:
+            raise errors[-1]
+        raise LLMUnavailable("The assistant is temporarily overloaded. Please try again in a minute.")
+
+    def stream(self, prompt, **options):
+        """Yield StreamEvents; `options` override completion_kwargs (e.g. max_tokens)."""
+        deadline = time.monotonic() + self.deadline
+        errors = []
+        for backend, is_last in self._candidates(deadline):
+            for attempt in range(self.max_retries + 1):
+                streamed = False
+                try:
+                    for event in backend.stream(prompt, self._timeout(deadline), options):
+                        self._check_deadline(deadline)
+                        streamed = streamed or bool(event.text)
+                        yield event
+                    self._attempt_succeeded(backend)
+                    return
+                except Exception as e:
+                    retryable, kind = self._attempt_failed(backend, e, attempt, streamed)
+                    if not retryable:
+                        raise
+                    errors.append(e)
+                    delay = self._retry_delay(backend, e, kind, attempt, is_last, deadline)
+                    if delay is None:
+                        break
+                    time.sleep(delay)
+        self._failed(errors)
+
+    async def astream(self, prompt, **options):
+        deadline = time.monotonic() + self.deadline
+        errors = []
+        for backend, is_last in self._candidates(deadline):
+            for attempt in range(self.max_retries + 1):
+                streamed = False
+                try:
+                    async for event in backend.astream(prompt, self._timeout(deadline), options):
+                        self._check_deadline(deadline)
+                        streamed = streamed or bool(event.text)
+                        yield event
+                    self._attempt_succeeded(backend)
+                    return
+                except Exception as e:
+                    retryable, kind = self._attempt_failed(backend, e, attempt, streamed)
+                    if not retryable:
+                        raise
+                    errors.append(e)
+                    delay = self._retry_delay(backend, e, kind, attempt, is_last, deadline)
+                    if delay is None:
+                        break
+                    await asyncio.sleep(delay)
+        self._failed(errors)
+
+
+def make_backend(model):
+    if LLM_BACKEND == "groq":
+        return GroqBackend(model, client, async_client)
+    if LLM_BACKEND == "openai":
+        return OpenAICompatibleBackend(LLM_BASE_URL, model, LLM_API_KEY)
+    raise ValueError(f"Unknown LLM_BACKEND {LLM_BACKEND!r}; expected 'groq' or 'openai'.")
+
+
+def build_llm():
+    models = [LLM_MODEL] + ([LLM_FALLBACK_MODEL] if LLM_FALLBACK_MODEL and LLM_FALLBACK_MODEL != LLM_MODEL else [])
+    return ResilientLLM([make_backend(model) for model in models])
+
+
+llm = build_llm()
+
+
+# ==============================
+# REQUEST COALESCING
+# Identical questions asked at the same moment (a result has just been
+# announced) share one upstream completion. Requests are keyed on the
+# normalized retrieval query plus a hash of the prompt context (retrieved
+# chunks and conversation memory); the first one
+# starts the completion in the background and every request with the same
+# key, including the first, replays its stream from the start and then
+# follows it live. The completion is stopped early only if every waiting
+# student has left.
+# ==============================
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1") == "1"
+
+
+def normalize_query(text):
+    return " ".join(TOKEN_PATTERN.findall(text.lower()))
+
+
+def coalesce_key(user_message, context):
+    context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{normalize_query(user_message)}\n{context_hash}".encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """One upstream completion and the StreamEvents it has produced so far."""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self._traceback = None
+        self.waiters = 0
+        self.abandoned = False
+        self.task = None
+        self._cond = threading.Condition()
+        self._wakers = []  # (event loop, asyncio.Event) of async followers
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, wake in list(self._wakers):
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass  # that follower's event loop has closed
+
+    def publish(self, event):
+        with self._cond:
+            self.events.append(event)
+            self._notify()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            # Every follower re-raises the same exception; restart each
+            # raise from the upstream traceback instead of stacking them.
+            self._traceback = error.__traceback__ if error is not None else None
+            self._notify()
+
+    def pump(self, events):
+        try:
+            for event in events:
+                if self.abandoned:
+                    break
+                self.publish(event)
+        except Exception as e:
+            self.finish(e)
+        else:
+            self.finish()
+        finally:
+            events.close()
+
+    async def apump(self, events):
+        try:
+            async for event in events:
+                self.publish(event)
+        except Exception as e:
+            self.finish(e)
+        else:
+            self.finish()
+        finally:
+            await events.aclose()
+
+    def follow(self):
+        seen = 0
+        while True:
+            with self._cond:
+                while seen >= len(self.events) and not self.done:
+                    self._cond.wait()
+                batch, done, error = self.events[seen:], self.done, self.error
+            seen += len(batch)
+            yield from batch
+            if done:
+                if error is not None:
+                    raise error.with_traceback(self._traceback)
+                return
+
+    async def afollow(self):
+        wake = asyncio.Event()
+        waker = (asyncio.get_running_loop(), wake)
+        with self._cond:
+            self._wakers.append(waker)
+        try:
+            seen = 0
+            while True:
+                with self._cond:
+                    batch, done, error = self.events[seen:], self.done, self.error
+                    if not batch and not done:
+                        wake.clear()
+                seen += len(batch)
+                for event in batch:
+                    yield event
+                if done:
+                    if error is not None:
+                        raise error.with_traceback(self._traceback)
+                    return
+                if not batch:
+                    await wake.wait()
+        finally:
+            with self._cond:
+                self._wakers.remove(waker)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key, start, trace, prompt):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            flight.waiters += 1
+        if leader:
+            start(flight)
+        else:
+            metrics.inc("universe_pk_coalesce_saved_tokens_total", prompt.tokens, kind="prompt")
+        metrics.inc("universe_pk_coalesce_requests_total", role="leader" if leader else "follower")
+        if trace is not None:
+            trace.fields["coalesced"] = not leader
+        return flight, leader
+
+    def _leave(self, key, flight, leader, completed):
+        with self._lock:
+            flight.waiters -= 1
+            if self._flights.get(key) is flight and (flight.done or flight.waiters == 0):
+                del self._flights[key]
+            if flight.waiters == 0 and not flight.done:
+                flight.abandoned = True
+                metrics.inc("universe_pk_coalesce_abandoned_total")
+                if flight.task is not None:
+                    flight.task.get_loop().call_soon_threadsafe(flight.task.cancel)
+        if completed and not leader:
+            text = "".join(e.text or "" for e in flight.events)
+            metrics.inc("universe_pk_coalesce_saved_tokens_total", count_tokens(text), kind="completion")
+
+    def stream(self, key, prompt, trace=None):
+        def start(flight):
+            threading.Thread(
+                target=flight.pump, args=(llm.stream(prompt),), name="llm-flight", daemon=True
+            ).start()
+
+        flight, leader = self._join(key, start, trace, prompt)
+        completed = False
+        try:
+            yield from flight.follow()
+            completed = True
+        finally:
+            self._leave(key, flight, leader, completed)
+
+    async def astream(self, key, prompt, trace=None):
+        def start(flight):
+            flight.task = asyncio.get_running_loop().create_task(flight.apump(llm.astream(prompt)))
+
+        flight, leader = self._join(key, start, trace, prompt)
+        completed = False
+        try:
+            async for event in flight.afollow():
+                yield event
+            completed = True
+        finally:
+            self._leave(key, flight, leader, completed)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+coalescer = SingleFlight() if COALESCE_ENABLED else None
+
+
+def llm_stream(user_message, context, prompt, trace):
+    if coalescer is None:
+        return llm.stream(prompt)
+    return coalescer.stream(coalesce_key(user_message, context), prompt, trace)
+
+
+def llm_astream(user_message, context, prompt, trace):
+    if coalescer is None:
+        return llm.astream(prompt)
+    return coalescer.astream(coalesce_key(user_message, context), prompt, trace)
+
+
+# ==============================
+# CONVERSATION STATE
+# Follow-ups ("what about its fees?", "and for PhD?", "what about NUST?")
+# are resolved against earlier turns into a standalone query that drives
+# retrieval, the fact table, the cache and coalescing: cheap heuristics
+# first, optionally a small model (QUERY_REWRITE_MODEL). The LLM also gets
+# the conversation itself, capped at MEMORY_TOKEN_BUDGET: recent turns
+# verbatim, older ones compacted into a one-line summary. Everything is
+# derived from the `history` Gradio sends, so nothing is kept per session.
+# ==============================
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "400"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "100"))
+MEMORY_TURN_TOKENS = int(os.getenv("MEMORY_TURN_TOKENS", "120"))  # longer turns are clipped
+MEMORY_MAX_MESSAGES = int(os.getenv("MEMORY_MAX_MESSAGES", "40"))  # older messages are not read at all
+QUERY_REWRITE_MODEL = os.getenv("QUERY_REWRITE_MODEL", "")  # e.g. llama-3.1-8b-instant; empty = heuristics only
+QUERY_REWRITE_TIMEOUT_SECONDS = float(os.getenv("QUERY_REWRITE_TIMEOUT_SECONDS", "3"))
+FOLLOWUP_MAX_WORDS = 8
+POSSESSIVE_PATTERN = re.compile(r"\b(?:its|their)\b", re.IGNORECASE)
+# "there" in "is there ..." / "there are ..." points at nothing.
+REFERENCE_PATTERN = re.compile(
+    r"\b(?:that|this|the same) (?:university|uni|one|place)\b|\b(?:it|they|them)\b"
+    r"|(?<!\bis )(?<!\bare )\bthere\b(?! (?:is|are)\b)",
+    re.IGNORECASE,
+)
+FOLLOWUP_CUE_PATTERN = re.compile(r"^\s*(?:and|also|what about|how about|same for|and for)\b", re.IGNORECASE)
+GENERAL_PATTERN = re.compile(r"\b(?:universit(?:y|ies)|pakistan)\b", re.IGNORECASE)
+TOPIC_LABELS = {
+    "fees": "fees",
+    "phd admissions": "PhD admissions",
+    "graduate ms admissions": "MS admissions",
+    "undergraduate admissions": "BS admissions",
+    "scholarships": "scholarships",
+    "general": "overview",
+}
+
+
+def message_text(content):
+    if isinstance(content, str):
+        return content.strip()
+    if isinstance(content, dict):
+        return str(content.get("text") or "").strip()
+    if isinstance(content, (list, tuple)):
+        return " ".join(filter(None, (message_text(part) for part in content)))
+    return ""
+
+
+def history_messages(history):
+    """(role, text) pairs from Gradio chat history, oldest first."""
+    messages = []
+    for item in (history or [])[-MEMORY_MAX_MESSAGES:]:
+        if isinstance(item, dict):
+            role, text = item.get("role"), message_text(item.get("content"))
+            if role in ("user", "assistant") and text:
+                messages.append((role, text))
+        elif isinstance(item, (list, tuple)) and len(item) == 2:  # legacy [user, bot] pairs
+            messages.extend((role, message_text(text)) for role, text in zip(("user", "assistant"), item) if text)
+    return messages
+
+
+def join_names(names):
+    return " and ".join(names)
+
+
+def heuristic_rewrite(user_message, messages):
+    """Return (standalone query or None, looks_like_followup)."""
+    previous = [text for role, text in messages if role == "user"]
+    if not previous:
+        return None, False
+    analysis = analyze_query(user_message)
+    earlier = [analyze_query(text) for text in reversed(previous)]
+    prior_universities = next((a.universities for a in earlier if a.universities), ())
+    prior_topics = next((a.topics for a in earlier if a.topics), ())
+
+    referring = bool(POSSESSIVE_PATTERN.search(user_message) or REFERENCE_PATTERN.search(user_message))
+    short = len(user_message.split()) <= FOLLOWUP_MAX_WORDS
+    cue = bool(FOLLOWUP_CUE_PATTERN.search(user_message))
+
+    if not analysis.universities:
+        if not (referring or cue or (short and not GENERAL_PATTERN.search(user_message))):
+            return None, False
+        if not prior_universities:
+            return None, True
+        names = join_names(prior_universities)
+        query = POSSESSIVE_PATTERN.sub(f"{names}'s", user_message)
+        query = REFERENCE_PATTERN.sub(names, query)
+        hints = [] if query != user_message else [names]
+        if cue:
+            # "and for PhD?" after a fee question still asks about fees.
+            subjects = [t for t in prior_topics if t not in TOPIC_LEVELS]
+            if not any(t not in TOPIC_LEVELS for t in analysis.topics) and subjects:
+                hints.append(TOPIC_LABELS[subjects[0]])
+            elif not analysis.topics and prior_topics:
+                hints.append(TOPIC_LABELS[prior_topics[0]])
+        return (f"{query.strip()} ({', '.join(hints)})" if hints else query.strip()), True
+
+    # "what about NUST?": a university but nothing asked about it; repeat the
+    # previous question for the new university.
+    if not analysis.topics and (cue or short) and prior_topics:
+        last = previous[-1]
+        for name in prior_universities:
+            pattern = UNIVERSITY_PATTERNS.get(name)  # None if a reload just removed it
+            if pattern is not None and pattern.search(last):
+                return pattern.sub(join_names(analysis.universities), last, count=1), True
+        return f"{user_message.strip()} ({TOPIC_LABELS.get(prior_topics[0], prior_topics[0])})", True
+    return None, False
+
+
+def rewrite_prompt(user_message, messages):
+    conversation = "\n".join(
+        f"{'Student' if role == 'user' else 'Assistant'}: {clip_tokens(text, 60)}" for role, text in messages[-6:]
+    )
+    return (
+        "Rewrite the student's last message as one standalone question about Pakistani university "
+        "admissions, naming the university and topic it refers to. Reply with the question only.\n\n"
+        f"{conversation}\nStudent: {user_message}\n\nStandalone question:"
+    )
+
+
+REWRITE_OPTIONS = dict(temperature=0.0, max_tokens=64)
+
+
+def accept_rewrite(text):
+    text = text.strip().strip('"').strip()
+    return text if text and len(text.split()) <= 40 else None
+
+
+rewrite_llm = None
+if QUERY_REWRITE_MODEL:
+    rewrite_llm = ResilientLLM(
+        [make_backend(QUERY_REWRITE_MODEL)], deadline=QUERY_REWRITE_TIMEOUT_SECONDS, max_retries=0
+    )
+
+
+def rewrite_query(user_message, messages):
+    """Return (retrieval query, how it was rewritten: None, "heuristic" or "model")."""
+    query, followup = heuristic_rewrite(user_message, messages)
+    if followup and rewrite_llm is not None:
+        try:
+            text = accept_rewrite("".join(e.text or "" for e in rewrite_llm.stream(
+                rewrite_prompt(user_message, messages), **REWRITE_OPTIONS)))
+            if text:
+                return text, "model"
+        except Exception as e:
+            logger.warning("query rewrite failed, using heuristics: %r", e)
+    return (query, "heuristic") if query else (user_message, None)
+
+
+async def arewrite_query(user_message, messages):
+    query, followup = heuristic_rewrite(user_message, messages)
+    if followup and rewrite_llm is not None:
+        try:
+            parts = [e.text or "" async for e in rewrite_llm.astream(
+                rewrite_prompt(user_message, messages), **REWRITE_OPTIONS)]
+            text = accept_rewrite("".join(parts))
+            if text:
+                return text, "model"
+        except Exception as e:
+            logger.warning("query rewrite failed, using heuristics: %r", e)
+    return (query, "heuristic") if query else (user_message, None)
+
+
+def clip_tokens(text, tokens):
+    limit = tokens * 4  # see count_tokens
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + " …"
+
+
+def compact_turns(messages, budget):
+    """One-line summary of older turns: their questions (newest kept first) and universities."""
+    universities = []
+    for role, text in messages:
+        for name in analyze_query(text).universities:
+            if name not in universities:
+                universities.append(name)
+    questions = [clip_tokens(text, 20) for role, text in messages if role == "user"]
+    tail = f" Universities discussed: {', '.join(universities)}." if universities else ""
+    kept = []
+    for question in reversed(questions):
+        candidate = "Student asked: " + "; ".join([question] + kept) + "." + tail
+        if count_tokens(candidate) > budget:
+            break
+        kept.insert(0, question)
+    summary = ("Student asked: " + "; ".join(kept) + "." if kept else "") + tail
+    return summary.strip() if count_tokens(summary) <= budget else ""
+
+
+def conversation_memory(messages, budget=None):
+    budget = MEMORY_TOKEN_BUDGET if budget is None else budget
+    if budget <= 0 or not messages:
+        return ""
+    lines = [
+        f"{'Student' if role == 'user' else 'Assistant'}: {clip_tokens(text, MEMORY_TURN_TOKENS)}"
+        for role, text in messages
+    ]
+    if count_tokens("\n".join(lines)) <= budget:
+        return "\n".join(lines)
+
+    # Newest turns verbatim in what is left after the summary's share.
+    recent, used = [], 0
+    for line in reversed(lines):
+        tokens = count_tokens(line) + 1
+        if used + tokens > budget - MEMORY_SUMMARY_TOKENS:
+            break
+        recent.insert(0, line)
+        used += tokens
+    summary = compact_turns(messages[:len(messages) - len(recent)], budget - used - count_tokens("Earlier: "))
+    return "\n".join(([f"Earlier: {summary}"] if summary else []) + recent)
+
+
+# ==============================
+# CHAT FUNCTION
+# gr.ChatInterface passes history as a list of dicts automatically.
+# chat() is a generator: every yield replaces the bot message in the UI,
+# so the answer appears token by token instead of after the full completion.
+# ==============================
+def chat(user_message, history):
+    trace = RequestTrace("sync", user_message)
+    answer = ""
+    status = "ok"
+    try:
+        with trace.timed("route"):
+            routed = route_intent(user_message, trace)
+        if routed is not None:
+            status = "routed"
+            trace.first_token()
+            yield routed
+            return
+
+        messages = history_messages(history)
+        with trace.timed("rewrite"):
+            query, rewrite = rewrite_query(user_message, messages)
+        with trace.timed("analyze"):
+            analysis = analyze_query(query)
+            fact_answer = answer_from_facts(query, analysis)
+        if fact_answer is not None:
+            status = "fact_table"
+            trace.first_token()
+            yield fact_answer
+            return
+
+        if not wait_until_ready(WARMUP_WAIT_SECONDS):
+            status = "warming_up"
+            yield not_ready_reply()
+            return
+
+        with trace.timed("embed"):
+            query_vector = embed_query(query)
+        with trace.timed("route_centroid"):
+            # Follow-ups are judged by what they were rewritten to.
+            routed = route_intent(query, trace, query_vector)
+        if routed is not None:
+            status = "routed"
+            trace.first_token()
+            yield routed
+            return
+        with trace.timed("cache"):
+            cached = answer_cache.lookup(query_vector, analysis.universities) if answer_cache else None
+        if cached is not None:
+            status = "cache_hit"
+            trace.first_token()
+            yield cached
+            return
+
+        # rerank records its own stage, so it is not counted in "search".
+        with trace.timed("search"):
+            groups = retrieve(query_vector, analysis, query)
+        docs = rerank(query, groups, trace)
+        with trace.timed("context"):
+            prompt, stats = compile_prompt(user_message, docs, conversation_memory(messages), query)
+        trace.fields.update(
+            context_tokens=stats["context_tokens"], memory_tokens=stats["memory_tokens"],
+            prompt_tokens=stats["prompt_tokens"], rewrite=rewrite,
+        )
+        if stats["clipped"]:
+            trace.fields["prompt_clipped"] = stats["clipped"]
+
+        with trace.timed("llm"):
+            for event in llm_stream(query, prompt.memory + prompt.context, prompt, trace):
+                trace.llm_event(event)
+                if not event.text:
+                    continue
+                trace.first_token()
+                answer += event.text
+                yield answer.lstrip()
+
+        if not answer.strip():
+            status = "empty"
+            yield EMPTY_REPLY
+        elif answer_cache and not trace.fields.get("coalesced") and not prompt.memory:
+            # An answer shaped by this session's conversation is not stored
+            # for other sessions.
+            answer_cache.store(query_vector, query, answer.strip(), analysis.universities)
+
+    except GeneratorExit:
+        # The student pressed stop or closed the tab; Gradio closes the generator.
+        status = "cancelled"
+        raise
+
+    except Exception as e:
+        status = "error"
+        trace.error = e
+        logger.exception("chat failed in %s after %d streamed characters", trace.stage, len(answer))
+        yield interrupted_reply(answer, e)
+
+    finally:
+        trace.finish(status, answer)
+
+
+# ==============================
+# ASYNC CHAT FUNCTION
+# Same pipeline as chat(), but waiting on the LLM does not hold a Gradio
+# worker thread: retrieval runs in retrieval_executor and the completion is
+# streamed through llm.astream (pooled async clients) on the event loop.
+# ==============================
+async def achat(user_message, history):
+    trace = RequestTrace("async", user_message)
+    answer = ""
+    status = "ok"
+    try:
+        with trace.timed("route"):
+            routed = route_intent(user_message, trace)
+        if routed is not None:
+            status = "routed"
+            trace.first_token()
+            yield routed
+            return
+
+        loop = asyncio.get_running_loop()
+        messages = history_messages(history)
+        with trace.timed("rewrite"):
+            query, rewrite = await arewrite_query(user_message, messages)
+        with trace.timed("analyze"):
+            analysis = analyze_query(query)
+            fact_answer = answer_from_facts(query, analysis)
+        if fact_answer is not None:
+            status = "fact_table"
+            trace.first_token()
+            yield fact_answer
+            return
+
+        if not await wait_until_ready_async(WARMUP_WAIT_SECONDS):
+            status = "warming_up"
+            yield not_ready_reply()
+            return
+
+        with trace.timed("embed"):
+            query_vector = await loop.run_in_executor(retrieval_executor, embed_query, query)
+        with trace.timed("route_centroid"):
+            # Follow-ups are judged by what they were rewritten to.
+            routed = route_intent(query, trace, query_vector)
+        if routed is not None:
+            status = "routed"
+            trace.first_token()
+            yield routed
+            return
+        with trace.timed("cache"):
+            cached = answer_cache.lookup(query_vector, analysis.universities) if answer_cache else None
+        if cached is not None:
+            status = "cache_hit"
+            trace.first_token()
+            yield cached
+            return
+
+        # rerank records its own stage, so it is not counted in "search".
+        with trace.timed("search"):
+            groups = await loop.run_in_executor(retrieval_executor, retrieve, query_vector, analysis, query)
+        docs = await loop.run_in_executor(retrieval_executor, rerank, query, groups, trace)
+        with trace.timed("context"):
+            prompt, stats = compile_prompt(user_message, docs, conversation_memory(messages), query)
+        trace.fields.update(
+            context_tokens=stats["context_tokens"], memory_tokens=stats["memory_tokens"],
+            prompt_tokens=stats["prompt_tokens"], rewrite=rewrite,
+        )
+        if stats["clipped"]:
+            trace.fields["prompt_clipped"] = stats["clipped"]
+
+        with trace.timed("llm"):
+            async for event in llm_astream(query, prompt.memory + prompt.context, prompt, trace):
+                trace.llm_event(event)
+                if not event.text:
+                    continue
+                trace.first_token()
+                answer += event.text
+                yield answer.lstrip()
+
+        if not answer.strip():
+            status = "empty"
+            yield EMPTY_REPLY
+        elif answer_cache and not trace.fields.get("coalesced") and not prompt.memory:
+            # An answer shaped by this session's conversation is not stored
+            # for other sessions.
+            answer_cache.store(query_vector, query, answer.strip(), analysis.universities)
+
+    except (GeneratorExit, asyncio.CancelledError):
+        status = "cancelled"
+        raise
+
+    except Exception as e:
+        status = "error"
+        trace.error = e
+        logger.exception("achat failed in %s after %d streamed characters", trace.stage, len(answer))
+        yield interrupted_reply(answer, e)
+
+    finally:
+        trace.finish(status, answer)
+
+
+# ==============================
+# BULK QUESTIONS
+# Answers a CSV/JSONL file of questions (bulk_qa.py and the "Bulk
+# questions" tab) with the chat pipeline minus conversation memory. Each
+# batch of BULK_BATCH_SIZE questions is embedded in one pass and searched
+# with one FAISS call per partition (retrieve_batch); completions then run
+# BULK_CONCURRENCY at a time, paced by RateLimiter. Every finished answer
+# is appended to the output file straight away, and that file is also the
+# checkpoint: a rerun with the same output skips ids already answered.
+# ==============================
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "64"))
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "4"))
+BULK_REQUESTS_PER_MINUTE = float(os.getenv("BULK_REQUESTS_PER_MINUTE", "0"))  # 0 = no client-side limit
+BULK_TOKENS_PER_MINUTE = float(os.getenv("BULK_TOKENS_PER_MINUTE", "0"))      # 0 = no client-side limit
+BULK_RATE_LIMIT_PAUSE_SECONDS = float(os.getenv("BULK_RATE_LIMIT_PAUSE_SECONDS", "10"))  # after a 429 without Retry-After
+BULK_MAX_TOKENS = int(os.getenv("BULK_MAX_TOKENS", "1024"))
+BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "4"))
+BULK_DEADLINE_SECONDS = float(os.getenv("BULK_DEADLINE_SECONDS", "180"))
+BULK_UI_MAX_QUESTIONS = int(os.getenv("BULK_UI_MAX_QUESTIONS", "500"))
+BULK_FIELDS = ("id", "question", "answer", "status", "sources", "error", "ms")
+# Anything else (error, empty) is asked again when a run is resumed.
+BULK_DONE_STATUSES = {"ok", "fact_table", "cache_hit", "routed"}
+QUESTION_COLUMNS = ("question", "questions", "query")
+
+
+def read_questions(path):
+    """[(id, question)] from a CSV (with a header row) or JSONL file.
+
+    CSV questions come from a "question" column, or the first column if
+    there is none; JSONL lines are {"question": ..., "id": ...} objects or
+    plain strings. Ids default to the row/line number.
+    """
+    items, seen = [], set()
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            fields = {name.strip().lower(): name for name in reader.fieldnames or ()}
+            column = next((fields[name] for name in QUESTION_COLUMNS if name in fields), None)
+            column = column or (reader.fieldnames or [None])[0]
+            if column is None:
+                raise ValueError(f"{path} is empty")
+            id_column = fields.get("id")
+            rows = [(reader.line_num, row.get(id_column) if id_column else None, row.get(column)) for row in reader]
+    else:
+        rows = []
+        with open(path, encoding="utf-8") as f:
+            for line_num, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"{path}:{line_num}: {e}") from None
+                if isinstance(record, str):
+                    record = {"question": record}
+                if not isinstance(record, dict):
+                    raise ValueError(f"{path}:{line_num}: expected an object or a string")
+                rows.append((line_num, record.get("id"), record.get("question")))
+
+    for line_num, item_id, question in rows:
+        question = str(question or "").strip()
+        if not question:
+            continue
+        item_id = str(item_id).strip() if item_id not in (None, "") else str(line_num)
+        if item_id in seen:
+            raise ValueError(f"{path}:{line_num}: duplicate id {item_id!r}")
+        seen.add(item_id)
+        items.append((item_id, question))
+    return items
+
+
+def read_results(path):
+    # id -> record of an earlier (possibly interrupted) run; later lines win
+    # and a half-written last line is ignored.
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = []
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue
+    for row in rows:
+        if isinstance(row, dict) and row.get("id") is not None and row.get("status"):
+            records[str(row["id"])] = row
+    return records
+
+
+def write_results(path, records):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            writer = csv.DictWriter(f, BULK_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+class BulkOutput:
+    """Results file of a bulk run, appended to (and flushed) one record at a time."""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = read_results(path)
+        # Rewrite what an earlier run left, so appends start on a clean line.
+        write_results(path, self.records.values())
+        self._file = open(path, "a", newline="", encoding="utf-8")
+        self._csv = csv.DictWriter(self._file, BULK_FIELDS, extrasaction="ignore") if path.lower().endswith(".csv") else None
+
+    def done(self, item_id):
+        return self.records.get(item_id, {}).get("status") in BULK_DONE_STATUSES
+
+    def write(self, record):
+        self.records[record["id"]] = record
+        if self._csv is not None:
+            self._csv.writerow(record)
+        else:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self, order=()):
+        # Leave the file in input order with one line per id.
+        self._file.close()
+        rank = {item_id: i for i, item_id in enumerate(order)}
+        records = sorted(self.records.values(), key=lambda r: rank.get(str(r["id"]), len(rank)))
+        write_results(self.path, records)
+
+
+class RateLimiter:
+    """Client-side pacing of one bulk run's LLM calls.
+
+    Keeps under requests_per_minute and tokens_per_minute (each 0 = no
+    limit) and, once the API answers 429, holds every new call back for
+    the server's Retry-After. Tokens are reserved for prompt plus maximum
+    completion and the unused part is given back afterwards.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.interval = 60 / requests_per_minute if requests_per_minute else 0.0
+        self.tokens_per_minute = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.refilled = time.monotonic()
+        self.next_request = 0.0
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self.tokens_per_minute:
+            self.tokens = min(
+                self.tokens_per_minute, self.tokens + (now - self.refilled) * self.tokens_per_minute / 60
+            )
+        self.refilled = now
+
+    async def acquire(self, tokens):
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        # Waiters queue on the lock, so calls go out in order.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = max(self.paused_until, self.next_request) - now
+                if self.tokens_per_minute and self.tokens < tokens:
+                    wait = max(wait, (tokens - self.tokens) * 60 / self.tokens_per_minute)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.next_request = now + self.interval
+            if self.tokens_per_minute:
+                self.tokens -= tokens
+
+    def release(self, tokens):
+        if self.tokens_per_minute and tokens > 0:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens_per_minute, self.tokens + tokens)
+
+    def pause(self, seconds=None):
+        seconds = BULK_RATE_LIMIT_PAUSE_SECONDS if seconds is None else seconds
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        metrics.inc("universe_pk_bulk_rate_limit_pauses_total")
+        logger.warning("bulk: rate limited, pausing new LLM calls for %.1fs", seconds)
+
+
+class BulkJob:
+    # One distinct question of a bulk run and the ids that asked it.
+    def __init__(self, question, ids):
+        self.question = question
+        self.ids = ids
+        self.trace = None  # started when its batch is prepared
+        self.status = None  # set once answered without the LLM
+        self.answer = ""
+        self.prompt = None
+        self.sources = ""
+        self.vector = None
+        self.analysis = None
+        self.universities = []
+
+
+def doc_sources(docs):
+    titles = (f"{doc.metadata.get('university', '')} / {doc.metadata.get('topic', '')}" for doc in docs)
+    return "; ".join(dict.fromkeys(titles))
+
+
+def prepare_bulk_batch(jobs):
+    """Fact table, answer cache, retrieval and prompts for a batch of jobs.
+
+    Blocking; runs in retrieval_executor. Batch-wide stages are recorded
+    on each trace as their share of the batch time.
+    """
+    for job in jobs:
+        job.trace = BulkTrace(job.question)
+    for job in jobs:
+        with job.trace.timed("route"):
+            answer = route_intent(job.question, job.trace)
+        if answer is not None:
+            job.status, job.answer = "routed", answer
+            job.trace.first_token()
+            continue
+        with job.trace.timed("analyze"):
+            analysis = analyze_query(job.question)
+            answer = answer_from_facts(job.question, analysis)
+        job.universities = analysis.universities
+        job.analysis = analysis
+        if answer is not None:
+            job.status, job.answer = "fact_table", answer
+            job.trace.first_token()
+
+    def shared(stage, batch, started):
+        for job in batch:
+            job.trace.stages_ms[stage] = round((time.perf_counter() - started) * 1000 / len(batch), 2)
+
+    batch = [job for job in jobs if job.status is None]
+    if not batch:
+        return jobs
+    started = time.perf_counter()
+    vectors = embeddings.embed_documents([job.question for job in batch])
+    shared("embed", batch, started)
+    for job, vector in zip(batch, vectors):
+        job.vector = vector
+        with job.trace.timed("route_centroid"):
+            answer = route_intent(job.question, job.trace, vector)
+        if answer is not None:
+            job.status, job.answer = "routed", answer
+            job.trace.first_token()
+            continue
+        with job.trace.timed("cache"):
+            cached = answer_cache.lookup(vector, job.universities) if answer_cache else None
+        if cached is not None:
+            job.status, job.answer = "cache_hit", cached
+            job.trace.first_token()
+
+    batch = [job for job in batch if job.status is None]
+    if not batch:
+        return jobs
+    started = time.perf_counter()
+    results = retrieve_batch(
+        [job.vector for job in batch], [job.analysis for job in batch], [job.question for job in batch]
+    )
+    shared("search", batch, started)
+    for job, groups in zip(batch, results):
+        docs = rerank(job.question, groups, job.trace)
+        with job.trace.timed("context"):
+            job.prompt, stats = compile_prompt(job.question, docs)
+        job.sources = doc_sources(docs)
+        job.trace.fields.update(context_tokens=stats["context_tokens"], prompt_tokens=stats["prompt_tokens"])
+    return jobs
+
+
+async def complete_bulk_job(job, bulk_llm, limiter, semaphore):
+    trace = job.trace
+    reserved = job.prompt.tokens + BULK_MAX_TOKENS
+    queued = time.perf_counter()
+    try:
+        async with semaphore:
+            await limiter.acquire(reserved)
+            trace.waited("queue", queued)
+            with trace.timed("llm"):
+                async for event in bulk_llm.astream(job.prompt, max_tokens=BULK_MAX_TOKENS):
+                    trace.llm_event(event)
+                    if event.text:
+                        trace.first_token()
+                        job.answer += event.text
+            used = trace.fields.get("prompt_tokens", 0) + trace.fields.get("completion_tokens", count_tokens(job.answer))
+            limiter.release(reserved - used)
+        job.answer = job.answer.strip()
+        job.status = "ok" if job.answer else "empty"
+        if job.answer and answer_cache:
+            answer_cache.store(job.vector, job.question, job.answer, job.universities)
+    except Exception as e:
+        trace.error = e
+        job.status = "error"
+        logger.warning("bulk: %r failed in %s: %r", job.question[:80], trace.stage, e)
+    return job
+
+
+def bulk_records(job):
+    total_ms = round((time.perf_counter() - job.trace.started) * 1000, 1)
+    error = job.trace.error
+    return [
+        {
+            "id": item_id,
+            "question": question,
+            "answer": job.answer if job.status != "error" else "",
+            "status": job.status,
+            "sources": job.sources,
+            "error": f"{type(error).__name__}: {error}" if error is not None else "",
+            "ms": total_ms,
+        }
+        for item_id, question in job.ids
+    ]
+
+
+async def answer_questions(items, output_path, concurrency=None, requests_per_minute=None, tokens_per_minute=None):
+    """Answer [(id, question)] into output_path, yielding each record as it is written.
+
+    Ids that output_path already holds an answer for are skipped; the same
+    question asked under several ids is answered once. Needs the knowledge
+    base loaded (warm_start).
+    """
+    concurrency = concurrency or BULK_CONCURRENCY
+    limiter = RateLimiter(
+        BULK_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute,
+        BULK_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute,
+    )
+    bulk_llm = ResilientLLM(
+        llm.backends, deadline=BULK_DEADLINE_SECONDS, max_retries=BULK_MAX_RETRIES, on_rate_limit=limiter.pause
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    output = BulkOutput(output_path)
+    groups = {}
+    for item_id, question in items:
+        if not output.done(item_id):
+            groups.setdefault(normalize_query(question), []).append((item_id, question))
+    jobs = [BulkJob(ids[0][1], ids) for ids in groups.values()]
+
+    pending = set()
+    finished = set()
+    try:
+        for start in range(0, len(jobs), BULK_BATCH_SIZE):
+            batch = jobs[start:start + BULK_BATCH_SIZE]
+            await loop.run_in_executor(retrieval_executor, prepare_bulk_batch, batch)
+            for job in batch:
+                if job.status is None:
+                    pending.add(asyncio.create_task(complete_bulk_job(job, bulk_llm, limiter, semaphore)))
+                    continue
+                finished.add(job)
+                job.trace.finish(job.status, job.answer)
+                for record in bulk_records(job):
+                    output.write(record)
+                    yield record
+            # Prepare the next batch while this one's completions are still
+            # running, but do not run ahead by more than a batch.
+            while pending and (len(pending) > concurrency or start + BULK_BATCH_SIZE >= len(jobs)):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    job = task.result()
+                    finished.add(job)
+                    job.trace.finish(job.status, job.answer)
+                    for record in bulk_records(job):
+                        output.write(record)
+                        yield record
+    finally:
+        for task in pending:
+            task.cancel()
+        for job in jobs:
+            if job.trace is not None and job not in finished:
+                job.trace.finish("cancelled", job.answer)
+        output.close([item_id for item_id, _ in items])
+
+
+async def bulk_questions_ui(upload):
+    # Gradio handler of the "Bulk questions" tab: yields (status, file).
+    if upload is None:
+        yield "Upload a CSV or JSONL file of questions.", None
+        return
+    if not startup_ready.is_set() or startup_error is not None:
+        yield not_ready_reply(), None
+        return
+    try:
+        items = read_questions(upload)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        yield f"⚠️ Could not read the file: {e}", None
+        return
+    if not items:
+        yield "⚠️ No questions found in the file.", None
+        return
+    if len(items) > BULK_UI_MAX_QUESTIONS:
+        yield f"⚠️ {len(items)} questions; the limit here is {BULK_UI_MAX_QUESTIONS}. Use bulk_qa.py for more.", None
+        return
+
+    stem, ext = os.path.splitext(os.path.basename(upload))
+    output_path = os.path.join(tempfile.mkdtemp(prefix="bulk-"), f"{stem}-answers{ext.lower()}")
+    counts = {}
+    async with aclosing(answer_questions(items, output_path)) as records:
+        async for record in records:
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+            yield f"⏳ Answered {sum(counts.values())} of {len(items)} questions…", None
+    summary = ", ".join(f"{status}: {count}" for status, count in sorted(counts.items()))
+    yield f"✅ Answered {len(items)} questions ({summary}).", output_path
+
+
+# ==============================
+# STARTUP
+# The UI binds immediately; the embedding model and the partition indexes
+# load concurrently in the background. The index thread gets a
+# DeferredEmbeddings handle, so reading the FAISS files overlaps with loading
+# MiniLM and only re-embedding (when documents changed) waits for the model.
+# ==============================
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_QUERY = os.getenv("WARMUP_QUERY", "What is the fee structure for BS Computer Science at NUST?")
+WARMUP_WAIT_SECONDS = float(os.getenv("WARMUP_WAIT_SECONDS", "20"))
+# Offline tools (benchmark.py) import app.py with APP_AUTOSTART=0 and load
+# only what they measure.
+APP_AUTOSTART = os.getenv("APP_AUTOSTART", "1") == "1"
+WARMING_UP_REPLY = (
+    "⏳ The assistant is still warming up (loading the knowledge base). "
+    "Please try again in a few seconds."
+)
+
+STARTUP_TIMINGS = {}
+startup_ready = threading.Event()
+startup_error = None
+
+
+class DeferredEmbeddings(Embeddings):
+    def __init__(self, future):
+        self._future = future
+
+    def embed_documents(self, texts):
+        return self._future.result().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self._future.result().embed_query(text)
+
+
+def timed(stage, fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    STARTUP_TIMINGS[stage] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def warm_start():
+    global embeddings, reranker, startup_error
+    started = time.perf_counter()
+    try:
+        print("Loading knowledge base...")
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="startup") as pool:
+            model_future = pool.submit(
+                timed, "embedding_model_ms", connect_embeddings if EMBEDDING_SERVER else load_embeddings
+            )
+            reranker_future = pool.submit(timed, "reranker_model_ms", load_reranker) if RERANK_ENABLED else None
+            fingerprint, errors = kb_fingerprint(), []
+            documents = timed("kb_files_ms", load_corpus, None, errors)
+            index_future = pool.submit(
+                timed, "index_ms", build_partitions, DeferredEmbeddings(model_future), documents
+            )
+            loaded_embeddings = model_future.result()
+            snapshot = index_future.result()
+            if reranker_future is not None:
+                try:
+                    reranker = reranker_future.result()
+                except Exception:
+                    # Reranking only trims the prompt; answer without it.
+                    logger.exception("Reranker failed to load; serving without it")
+        embeddings = loaded_embeddings
+        install_index(snapshot)
+        adopt_corpus(documents, errors, fingerprint)
+        if intent_router is not None:
+            timed("intent_router_ms", intent_router.fit, embeddings)
+
+        if WARMUP_ENABLED:
+            # The first encode pays for lazy kernel/tokenizer setup; do it here
+            # rather than in a student's request.
+            timed("warmup_ms", lambda: search(embed_query(WARMUP_QUERY), analyze_query(WARMUP_QUERY), WARMUP_QUERY))
+        print("Knowledge base ready.")
+    except Exception as e:
+        startup_error = e
+        logger.exception("Knowledge base failed to load")
+    finally:
+        STARTUP_TIMINGS["startup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        STARTUP_TIMINGS["cold_start_ms"] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
+        logger.info("startup timings %s", json.dumps(STARTUP_TIMINGS, sort_keys=True))
+        startup_ready.set()
+
+
+def start_background_loading():
+    threading.Thread(target=warm_start, name="warm-start", daemon=True).start()
+    if KB_WATCH_SECONDS > 0:
+        threading.Thread(target=watch_knowledge_base, args=(KB_WATCH_SECONDS,), name="kb-watcher", daemon=True).start()
+
+
+def not_ready_reply():
+    if startup_error is not None:
+        return f"Sorry, the knowledge base failed to load: {str(startup_error)}"
+    return WARMING_UP_REPLY
+
+
+async def wait_until_ready_async(timeout):
+    deadline = time.perf_counter() + timeout
+    while not startup_ready.is_set() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.25)
+    return startup_ready.is_set() and startup_error is None
+
+
+def wait_until_ready(timeout):
+    return startup_ready.wait(timeout) and startup_error is None
+
+
+def startup_status():
+    if startup_error is not None:
+        return "⚠️ The knowledge base failed to load; answers are limited to fee and eligibility lookups."
+    if startup_ready.is_set():
+        return ""
+    return "⏳ Warming up — loading the knowledge base. Fee and eligibility lookups already work."
+
+
+def refresh_startup_status():
+    # Stop polling once startup has finished either way.
+    return startup_status(), gr.Timer(active=not startup_ready.is_set())
+
+
+def chat_description():
+    # Rendered again on every page load, so it follows knowledge base reloads.
+    return (
+        "# 🎓 Pakistan University Assistant\n"
+        "### Your guide to admissions, fees, programs & scholarships\n"
+        f"**Covered Universities:** {' · '.join(covered_universities)}\n\n"
+        "*Always verify details on official university websites before applying.*"
+    )
+
+
+# ==============================
+# KNOWLEDGE BASE RELOAD
+# Re-reads KB_DIR while the app keeps serving. Only new or edited documents
+# are embedded (see build_vectorstore), partitions whose documents did not
+# change are reused as they are, and the result is swapped in with
+# install_index: requests already past that point finish on the old index,
+# so none are dropped. Triggered by the KB_WATCH_SECONDS file watcher or a
+# POST to KB_RELOAD_PATH.
+# ==============================
+KB_WATCH_SECONDS = float(os.getenv("KB_WATCH_SECONDS", "0"))  # 0 = no file watcher
+KB_RELOAD_PATH = os.getenv("KB_RELOAD_PATH", "/admin/reload-kb")
+KB_ADMIN_TOKEN = os.getenv("KB_ADMIN_TOKEN")  # unset = no reload endpoint
+kb_reload_lock = threading.Lock()
+kb_state = {"fingerprint": (), "documents": 0, "invalid": [], "version": 0}
+# Called with the summary of every reload that changed the index (serve.py
+# uses this to have its workers load the rebuilt partitions).
+kb_reload_hooks = []
+
+
+def adopt_corpus(documents, errors, fingerprint):
+    # Everything derived from the documents besides the index itself.
+    global fact_table, intent_router, system_prompt, covered_universities
+    register_universities(documents)
+    system_prompt = compile_system_prompt(documents)
+    covered_universities = served_universities(documents)
+    if FACT_FAST_PATH:
+        fact_table = build_fact_table(documents)
+    if intent_router is not None:
+        router = IntentRouter(served_universities(documents))
+        router.intents, router.centroids = intent_router.intents, intent_router.centroids
+        intent_router = router
+    kb_state.update(
+        fingerprint=fingerprint,
+        documents=len(documents),
+        invalid=list(errors),
+        version=kb_state["version"] + 1,
+    )
+    metrics.set("universe_pk_kb_documents", len(documents))
+    metrics.set("universe_pk_kb_invalid_documents", len(errors))
+
+
+def reload_knowledge_base(trigger="manual"):
+    """Reload KB_DIR into the served index; returns a summary dict.
+
+    Raises RuntimeError before startup has finished. On any other failure
+    the previous index stays in service and the exception propagates.
+    """
+    if not startup_ready.is_set() or startup_error is not None:
+        raise RuntimeError("the knowledge base has not finished loading")
+    with kb_reload_lock:
+        started = time.perf_counter()
+        try:
+            fingerprint, errors = kb_fingerprint(), []
+            documents = load_corpus(errors=errors)
+            previous = live_index
+            snapshot = build_partitions(embeddings, documents, previous)
+            changed = sorted(
+                name for name in set(previous.hashes) | set(snapshot.hashes)
+                if previous.hashes.get(name) != snapshot.hashes.get(name)
+            )
+            install_index(snapshot)
+            adopt_corpus(documents, errors, fingerprint)
+            if changed and answer_cache is not None:
+                answer_cache.invalidate(changed)
+        except Exception:
+            metrics.inc("universe_pk_kb_reloads_total", trigger=trigger, result="error")
+            logger.exception("Knowledge base reload failed; still serving the previous index")
+            raise
+        result = "ok" if changed else "unchanged"
+        metrics.inc("universe_pk_kb_reloads_total", trigger=trigger, result=result)
+        metrics.set("universe_pk_kb_last_reload_timestamp_seconds", time.time())
+        summary = {
+            "result": result,
+            "version": kb_state["version"],
+            "documents": len(documents),
+            "invalid": errors,
+            "partitions": len(snapshot.partitions),
+            "changed_partitions": changed,
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        logger.info("knowledge base reload (%s) %s", trigger, json.dumps(summary))
+        if changed:
+            for hook in kb_reload_hooks:
+                hook(summary)
+        return summary
+
+
+def watch_knowledge_base(interval):
+    # Polls file sizes and mtimes (no extra dependency, works on any mount),
+    # and waits for a change to hold still for one interval so a file that
+    # is still being copied in is not loaded half-written.
+    startup_ready.wait()
+    pending = None
+    while startup_error is None:
+        time.sleep(interval)
+        current = kb_fingerprint()
+        if current == kb_state["fingerprint"]:
+            pending = None
+            continue
+        if current != pending:
+            pending = current
+            continue
+        try:
+            reload_knowledge_base("watcher")
+        except Exception:
+            # Already logged; do not retry the same broken files every tick.
+            kb_state["fingerprint"] = current
+        pending = None
+
+
+def kb_reload_endpoint(request):
+    # Plain (sync) endpoint: Starlette runs it in a worker thread, so a slow
+    # re-embed does not block the event loop serving chats.
+    supplied = request.headers.get("authorization", "").encode("utf-8")
+    if not hmac.compare_digest(supplied, f"Bearer {KB_ADMIN_TOKEN}".encode("utf-8")):
+        return JSONResponse({"error": "unauthorized"}, status_code=401)
+    if request.method == "GET":
+        return JSONResponse({key: value for key, value in kb_state.items() if key != "fingerprint"})
+    try:
+        return JSONResponse(reload_knowledge_base("admin"))
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse({"error": f"{type(e).__name__}: {e}"}, status_code=500)
+
+
+def reload_on_signal(signum, frame):
+    # SIGHUP: serve.py rebuilt the index; load it (off the signal handler).
+    def reload():
+        try:
+            reload_knowledge_base("signal")
+        except Exception as e:
+            logger.warning("Reload on SIGHUP failed, still serving the previous index: %r", e)
+    threading.Thread(target=reload, name="kb-signal-reload", daemon=True).start()
+
+
+if APP_AUTOSTART:
+    start_background_loading()
+
+
+EXAMPLE_QUESTIONS = [
+    "What is the eligibility criteria for PhD Mathematics at QAU?",
+    "Compare fees of NUST and UET Lahore for BS Computer Science",
+    "What entry test is required for COMSATS undergraduate admissions?",
+    "What scholarships are available for MS students in Pakistan?",
+    "What programs does QAU offer in Social Sciences?",
+    "What is the fee structure for BS Electrical Engineering at UET Lahore?",
+    "When does NUST take admissions for BS programs?",
+    "What is the minimum CGPA required for PhD at COMSATS?",
+]
+
+
+# ==============================
+# GRADIO UI — ChatInterface inside Blocks so a startup banner can sit
+# under the chat while the knowledge base loads in the background.
+# ==============================
+with gr.Blocks(title="Pakistan University Assistant") as demo:
+    with gr.Tab("Chat"):
+        chat_header = gr.Markdown(chat_description())
+        gr.ChatInterface(
+            fn=achat if USE_ASYNC_CHAT else chat,
+            examples=EXAMPLE_QUESTIONS,
+        )
+    with gr.Tab("Bulk questions"):
+        gr.Markdown(
+            "Upload a CSV (with a `question` column) or a JSONL file of questions "
+            "and download the answers as a file of the same type."
+        )
+        bulk_file = gr.File(label="Questions", file_types=[".csv", ".jsonl"], type="filepath")
+        bulk_button = gr.Button("Answer all", variant="primary")
+        bulk_status = gr.Markdown()
+        bulk_output = gr.File(label="Answers")
+        # One bulk run at a time, so a large file cannot crowd out chat.
+        bulk_button.click(
+            bulk_questions_ui, inputs=bulk_file, outputs=[bulk_status, bulk_output], concurrency_limit=1
+        )
+    startup_banner = gr.Markdown(startup_status())
+    startup_timer = gr.Timer(2.0)
+    startup_timer.tick(refresh_startup_status, outputs=[startup_banner, startup_timer])
+    # KB_DIR universities appear once warm_start or a reload has adopted them.
+    startup_timer.tick(chat_description, outputs=chat_header)
+    demo.load(chat_description, outputs=chat_header)
+
+# default_concurrency_limit caps how many conversations run at once; with the
+# async path most of them are just awaiting Groq, so this can be much higher
+# than the thread pool size. max_size bounds the waiting queue.
+demo.queue(
+    default_concurrency_limit=GRADIO_CONCURRENCY,
+    max_size=GRADIO_MAX_QUEUE,
+)
+
+STARTUP_TIMINGS["import_ms"] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
+logger.info("app.py imported in %.1f ms", STARTUP_TIMINGS["import_ms"])
+
+def launch(**kwargs):
+    # Extra routes are registered before Gradio's own, on the same server and port.
+    routes = [Route(METRICS_PATH, metrics_endpoint)] if METRICS_ENABLED else []
+    if KB_ADMIN_TOKEN:
+        routes.append(Route(KB_RELOAD_PATH, kb_reload_endpoint, methods=["GET", "POST"]))
+    if INDEX_READ_ONLY and hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, reload_on_signal)
+    demo.launch(max_threads=GRADIO_MAX_THREADS, app_kwargs={"routes": routes}, **kwargs)
+
 
-demo.launch()
\ No newline at end of file
+if __name__ == "__main__":
+    launch()
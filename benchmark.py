@@ -0,0 +1,1197 @@
+"""Offline benchmarks for the UniVerse-PK RAG pipeline.
+
+Results are printed as JSON so runs can be saved and compared.
+
+    python benchmark.py embeddings --backends torch onnx onnx-int8
+    python benchmark.py pipeline --repeat 5 --llm-ttft-ms 300 --llm-tokens-per-s 250
+    python benchmark.py pipeline --rerank --llm-prefill-tokens-per-s 2000
+    python benchmark.py index --size 50000 --types flat ivf-flat ivf-pq hnsw
+    python benchmark.py store --size 100000 --threads 8
+    python benchmark.py load --users 50 --turns 4 --llm-ttft-ms 300 --llm-tokens-per-s 50
+    python benchmark.py load --users 200 --workers 4 --max-error-rate 0.01 --max-p99-ms 15000
+"""
+import os
+
+# Load only what is being measured, not the whole app.
+os.environ.setdefault("APP_AUTOSTART", "0")
+# The pipeline benchmark serves completions from LocalGroq, so no request
+# ever reaches Groq and a real key is not needed.
+os.environ.setdefault("GROQ_API_KEY", "local-benchmark")
+
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
+from langchain_core.documents import Document
+
+import app
+
+
+def knowledge_chunks():
+    return app.make_splitter().split_documents(app.load_corpus())
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+def summarize(values):
+    return {
+        "n": len(values),
+        "mean": round(float(np.mean(values)), 3) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": round(float(max(values)), 3) if values else None,
+    }
+
+
+def exact_top_k(doc_vectors, query_vectors, k):
+    import faiss
+
+    index = faiss.IndexFlatL2(doc_vectors.shape[1])
+    index.add(doc_vectors)
+    _, ids = index.search(query_vectors, k)
+    return ids
+
+
+def topk_overlap(ids, baseline_ids):
+    k = ids.shape[1]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, baseline_ids)]))
+
+
+# ==============================
+# EMBEDDING BACKENDS
+# Ingest throughput, per-query latency and top-k agreement with the first
+# backend (the PyTorch baseline by default).
+# ==============================
+def bench_embeddings(args):
+    texts = [chunk.page_content for chunk in knowledge_chunks()]
+    queries = app.EXAMPLE_QUESTIONS
+    results = {}
+    baseline_ids = None
+
+    for backend in args.backends:
+        started = time.perf_counter()
+        model = app.load_embeddings(backend)
+        load_ms = (time.perf_counter() - started) * 1000
+        model.embed_query(queries[0])  # first call pays one-off setup
+
+        started = time.perf_counter()
+        doc_vectors = np.asarray(model.embed_documents(texts), dtype="float32")
+        ingest_ms = (time.perf_counter() - started) * 1000
+
+        query_ms, query_vectors = [], []
+        for _ in range(args.repeat):
+            for query in queries:
+                started = time.perf_counter()
+                vector = model.embed_query(query)
+                query_ms.append((time.perf_counter() - started) * 1000)
+                query_vectors.append(vector)
+        query_vectors = np.asarray(query_vectors[:len(queries)], dtype="float32")
+
+        ids = exact_top_k(doc_vectors, query_vectors, args.k)
+        if baseline_ids is None:
+            baseline_ids = ids
+        results[backend] = {
+            "load_ms": round(load_ms, 1),
+            "ingest_ms": round(ingest_ms, 1),
+            "ingest_chunks_per_s": round(len(texts) / (ingest_ms / 1000), 1),
+            "query_p50_ms": percentile(query_ms, 50),
+            "query_p95_ms": percentile(query_ms, 95),
+            "topk_overlap": round(topk_overlap(ids, baseline_ids), 3),
+        }
+
+    failed = [b for b, r in results.items() if r["topk_overlap"] < args.tolerance]
+    report = {
+        "benchmark": "embeddings",
+        "baseline": args.backends[0],
+        "k": args.k,
+        "tolerance": args.tolerance,
+        "chunks": len(texts),
+        "queries": len(queries),
+        "results": results,
+        "failed": failed,
+    }
+    return report, 1 if failed else 0
+
+
+# ==============================
+# LOCAL GROQ STAND-IN
+# Replays a deterministic answer with a configurable time-to-first-token,
+# prompt processing rate and token rate, so end-to-end numbers measure this
+# app rather than Groq.
+# ==============================
+class LocalStream:
+    def __init__(self, tokens, ttft_s, token_s):
+        self.tokens, self.ttft_s, self.token_s = tokens, ttft_s, token_s
+
+    def _chunk(self, token):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        time.sleep(self.ttft_s)
+        for i, token in enumerate(self.tokens):
+            if i:
+                time.sleep(self.token_s)
+            yield self._chunk(token)
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.ttft_s)
+        for i, token in enumerate(self.tokens):
+            if i:
+                await asyncio.sleep(self.token_s)
+            yield self._chunk(token)
+
+
+class LocalGroq:
+    """Drop-in for `Groq` / `AsyncGroq` covering `chat.completions.create(stream=True)`.
+
+    The answer is built from words of the prompt, seeded by its hash, so the
+    same prompt always streams the same tokens.
+    """
+
+    def __init__(self, ttft_ms=0.0, tokens_per_s=0.0, completion_tokens=120, prefill_tokens_per_s=0.0, is_async=False):
+        self.ttft_s = ttft_ms / 1000
+        self.prefill_s = 1 / prefill_tokens_per_s if prefill_tokens_per_s > 0 else 0.0  # per prompt token
+        self.token_s = 1 / tokens_per_s if tokens_per_s > 0 else 0.0
+        self.completion_tokens = completion_tokens
+        self.prompt_tokens = []
+        create = self._acreate if is_async else self._create
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+
+    def answer_tokens(self, prompt):
+        words = re.findall(r"\S+", prompt) or ["ok"]
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        return [" " + rng.choice(words) for _ in range(self.completion_tokens)]
+
+    def _create(self, messages, stream=False, **kwargs):
+        prompt = "\n".join(m["content"] for m in messages)
+        prompt_tokens = app.count_tokens(prompt)
+        self.prompt_tokens.append(prompt_tokens)
+        tokens = self.answer_tokens(prompt)
+        if not stream:
+            message = SimpleNamespace(content="".join(tokens))
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        return LocalStream(tokens, self.ttft_s + prompt_tokens * self.prefill_s, self.token_s)
+
+    async def _acreate(self, messages, stream=False, **kwargs):
+        return self._create(messages, stream=stream, **kwargs)
+
+
+# ==============================
+# PIPELINE
+# Index build/load time, per-query embed and search latency, prompt sizes,
+# Recall@k against labeled source documents and end-to-end latency through
+# chat()/achat() with LocalGroq in place of Groq.
+# ==============================
+
+# Source documents, as (university, topic) metadata, that should be retrieved
+# for each question. Every ChatInterface example must be labeled here.
+GOLDEN_SOURCES = {
+    "What is the eligibility criteria for PhD Mathematics at QAU?": [("QAU", "phd admissions")],
+    "Compare fees of NUST and UET Lahore for BS Computer Science": [("NUST", "fees"), ("UET Lahore", "fees")],
+    "What entry test is required for COMSATS undergraduate admissions?": [("COMSATS", "undergraduate admissions")],
+    "What scholarships are available for MS students in Pakistan?": [("All", "scholarships")],
+    "What programs does QAU offer in Social Sciences?": [("QAU", "undergraduate admissions")],
+    "What is the fee structure for BS Electrical Engineering at UET Lahore?": [("UET Lahore", "fees")],
+    "When does NUST take admissions for BS programs?": [("NUST", "undergraduate admissions")],
+    "What is the minimum CGPA required for PhD at COMSATS?": [("COMSATS", "phd admissions")],
+    # Paraphrases and questions the examples do not cover.
+    "Is GAT or NET needed for MS admission at NUST?": [("NUST", "graduate ms admissions")],
+    "Which campuses does COMSATS have?": [("COMSATS", "general")],
+    "How much does a PhD cost at QAU per semester?": [("QAU", "fees")],
+    "Which university is best for a PhD in Pakistan?": [("All", "phd comparison")],
+    "Which is cheaper for engineering, NUST or UET Lahore?": [("All", "comparison")],
+}
+
+
+def golden_set():
+    missing = [q for q in app.EXAMPLE_QUESTIONS if q not in GOLDEN_SOURCES]
+    if missing:
+        raise SystemExit(f"Label the source documents of these examples in GOLDEN_SOURCES: {missing}")
+    return list(GOLDEN_SOURCES.items())
+
+
+def source_key(doc):
+    return doc.metadata.get("university"), doc.metadata.get("topic")
+
+
+def install_local_groq(args):
+    options = dict(
+        ttft_ms=args.llm_ttft_ms,
+        tokens_per_s=args.llm_tokens_per_s,
+        completion_tokens=args.llm_completion_tokens,
+        prefill_tokens_per_s=args.llm_prefill_tokens_per_s,
+    )
+    sync_client, async_client = LocalGroq(**options), LocalGroq(is_async=True, **options)
+    app.llm = app.ResilientLLM([app.GroqBackend(app.LLM_MODEL, sync_client, async_client)])
+    return async_client if args.path == "async" else sync_client
+
+
+def run_chat(path, question):
+    if path == "async":
+        async def consume():
+            async for _ in app.achat(question, []):
+                pass
+        asyncio.run(consume())
+    else:
+        for _ in app.chat(question, []):
+            pass
+    return app.LATENCY_LOG[-1]
+
+
+def bench_pipeline(args):
+    golden = golden_set()
+    index_dir = tempfile.mkdtemp(prefix="universe-pk-bench-")
+    app.INDEX_PATH = index_dir
+
+    started = time.perf_counter()
+    app.embeddings = app.load_embeddings(args.backend)
+    model_ms = (time.perf_counter() - started) * 1000
+    app.reranker = app.load_reranker() if args.rerank else None
+
+    # Cold build embeds every chunk; the second call only reads the saved
+    # partitions back (manifest unchanged), as on a normal restart.
+    started = time.perf_counter()
+    app.build_partitions(app.embeddings)
+    build_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    app.install_index(app.build_partitions(app.embeddings))
+    load_ms = (time.perf_counter() - started) * 1000
+    app.startup_ready.set()
+    chunks = sum(store.index.ntotal for store in app.live_index.partitions.values())
+
+    app.embed_query(golden[0][0])  # first call pays one-off setup
+    embed_ms, search_ms, search_rerank_ms, context_ms, rerank_ms = [], [], [], [], []
+    questions = []
+    for question, sources in golden:
+        for _ in range(args.repeat):
+            trace = SimpleNamespace(stages_ms={}, fields={})
+            started = time.perf_counter()
+            vector = app.embed_query(question)
+            embedded = time.perf_counter()
+            groups = app.retrieve(vector, app.analyze_query(question), question)
+            searched = time.perf_counter()
+            docs = app.rerank(question, groups, trace)
+            reranked = time.perf_counter()
+            prompt, stats = app.compile_prompt(question, docs)
+            packed = time.perf_counter()
+            embed_ms.append((embedded - started) * 1000)
+            search_ms.append((searched - embedded) * 1000)
+            search_rerank_ms.append((reranked - embedded) * 1000)
+            context_ms.append((packed - reranked) * 1000)
+            if "rerank" in trace.stages_ms:
+                rerank_ms.append(trace.stages_ms["rerank"])
+
+        retrieved = {source_key(doc) for doc in docs}
+        expected = set(sources)
+        questions.append({
+            "question": question,
+            "k": len(docs),
+            "recall": round(len(expected & retrieved) / len(expected), 3),
+            "missing": sorted(" / ".join(s) for s in expected - retrieved),
+            "context_tokens": stats["context_tokens"],
+            "raw_tokens": stats["raw_tokens"],
+            "prompt_tokens": prompt.tokens,
+            "rerank_saved_tokens": trace.fields.get("rerank_saved_tokens"),
+        })
+
+    # End to end. The answer cache is off so every repeat runs the full
+    # pipeline; the fact-table fast path stays as configured.
+    app.answer_cache = None
+    if args.no_fact_path:
+        app.fact_table = None
+    llm = install_local_groq(args)
+    ttft_ms, total_ms, by_status = [], [], {}
+    for _ in range(args.repeat):
+        for question, _ in golden:
+            entry = run_chat(args.path, question)
+            by_status.setdefault(entry["status"], []).append(entry["total_ms"])
+            total_ms.append(entry["total_ms"])
+            if entry["ttft_ms"] is not None:
+                ttft_ms.append(entry["ttft_ms"])
+
+    recall = [q["recall"] for q in questions]
+    report = {
+        "benchmark": "pipeline",
+        "settings": {
+            **app.index_settings(),
+            "retrieval_k": app.RETRIEVAL_K,
+            "retrieval_k_per_university": app.RETRIEVAL_K_PER_UNIVERSITY,
+            "hybrid_search": app.HYBRID_SEARCH,
+            "rerank": {
+                "model": app.RERANK_MODEL,
+                "candidate_factor": app.RERANK_CANDIDATE_FACTOR,
+                "top_k": app.RERANK_TOP_K,
+            } if app.reranker is not None else None,
+            "context_token_budget": app.CONTEXT_TOKEN_BUDGET,
+            "chat_path": args.path,
+            "fact_fast_path": app.fact_table is not None,
+            "repeat": args.repeat,
+            "llm": {
+                "ttft_ms": args.llm_ttft_ms,
+                "tokens_per_s": args.llm_tokens_per_s,
+                "completion_tokens": args.llm_completion_tokens,
+                "prefill_tokens_per_s": args.llm_prefill_tokens_per_s,
+            },
+        },
+        "index": {
+            "embedding_model_ms": round(model_ms, 1),
+            "build_ms": round(build_ms, 1),
+            "load_ms": round(load_ms, 1),
+            "partitions": len(app.live_index.partitions),
+            "chunks": chunks,
+        },
+        "retrieval": {
+            "embed_ms": summarize(embed_ms),
+            "search_ms": summarize(search_ms),
+            # What search_ms measured before rerank was timed on its own;
+            # compare this one with older baselines.
+            "search_rerank_ms": summarize(search_rerank_ms),
+            "rerank_ms": summarize(rerank_ms) if rerank_ms else None,
+            "context_ms": summarize(context_ms),
+            "recall_at_k": round(float(np.mean(recall)), 3),
+            "hit_rate": round(float(np.mean([r > 0 for r in recall])), 3),
+        },
+        "prompt": {
+            "context_tokens": summarize([q["context_tokens"] for q in questions]),
+            "raw_tokens": summarize([q["raw_tokens"] for q in questions]),
+            "prompt_tokens": summarize([q["prompt_tokens"] for q in questions]),
+            "llm_prompt_tokens": summarize(llm.prompt_tokens),
+            "rerank_saved_tokens": summarize([q["rerank_saved_tokens"] for q in questions])
+            if app.reranker is not None else None,
+        },
+        "end_to_end": {
+            "requests": len(total_ms),
+            "ttft_ms": summarize(ttft_ms),
+            "total_ms": summarize(total_ms),
+            "total_ms_by_status": {status: summarize(ms) for status, ms in sorted(by_status.items())},
+        },
+        "questions": questions,
+    }
+    shutil.rmtree(index_dir, ignore_errors=True)
+    failed = report["retrieval"]["recall_at_k"] < args.min_recall
+    return report, 1 if failed else 0
+
+
+# ==============================
+# INDEX TYPES
+# Recall@k against the exact flat index, per-query search latency, build
+# time and memory for each INDEX_TYPE. The knowledge base is far too small
+# for approximate indexes to matter, so this runs on clustered synthetic
+# unit vectors (or real ones saved with numpy, --vectors-file).
+# ==============================
+def synthetic_vectors(n, dimension, clusters, spread, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension))
+    vectors = centers[rng.integers(clusters, size=n)] + spread * rng.normal(size=(n, dimension))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype("float32")
+
+
+# Run in a fresh interpreter so the numbers are the index's own, not heap
+# left over from building it. Anonymous memory is private to the process;
+# file-backed pages (a memory-mapped index) are shared with other processes
+# and the page cache.
+MEMORY_PROBE = """
+import sys, faiss, numpy as np
+def rss():
+    usage = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "RssFile:")):
+                key, value = line.split(":")
+                usage[key] = int(value.split()[0]) / 1024
+    return usage
+path, flags, queries = sys.argv[1], int(sys.argv[2]), np.load(sys.argv[3])
+before = rss()
+index = faiss.read_index(path, flags)
+index.search(queries, 5)
+after = rss()
+print(round(after["RssAnon"] - before["RssAnon"], 1), round(after["RssFile"] - before["RssFile"], 1))
+"""
+
+
+def index_memory_mb(path, flags, queries_path):
+    if not os.path.exists("/proc/self/status"):
+        return None  # not Linux
+    output = subprocess.run(
+        [sys.executable, "-c", MEMORY_PROBE, path, str(flags), queries_path],
+        capture_output=True, text=True, check=True,
+    ).stdout.split()
+    return {"rss_anon_mb": float(output[-2]), "rss_file_mb": float(output[-1])}
+
+
+def time_queries(index, queries, k):
+    latency_ms, ids = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, hits = index.search(query[None, :], k)
+        latency_ms.append((time.perf_counter() - started) * 1000)
+        ids.append(hits[0])
+    return latency_ms, np.asarray(ids)
+
+
+def bench_index(args):
+    import faiss
+
+    if args.vectors_file:
+        vectors = np.load(args.vectors_file).astype("float32")
+    else:
+        vectors = synthetic_vectors(args.size + args.queries, args.dimension, args.clusters, args.spread, args.seed)
+    # Held-out vectors as queries, so none is its own nearest neighbour.
+    docs, queries = vectors[:-args.queries], vectors[-args.queries:]
+    truth = exact_top_k(docs, queries, args.k)
+    work_dir = tempfile.mkdtemp(prefix="universe-pk-index-")
+    queries_path = os.path.join(work_dir, "queries.npy")
+    np.save(queries_path, queries)
+    sweeps = {"ivf-flat": ("nprobe", args.nprobe), "ivf-pq": ("nprobe", args.nprobe), "hnsw": ("ef_search", args.ef_search)}
+
+    results = {}
+    for index_type in args.types:
+        started = time.perf_counter()
+        index = app.make_ann_index(docs, index_type)
+        build_ms = (time.perf_counter() - started) * 1000
+        path = os.path.join(work_dir, f"{index_type}.faiss")
+        faiss.write_index(index, path)
+        del index
+        result = {"build_ms": round(build_ms, 1), "file_mb": round(os.path.getsize(path) / 2**20, 1)}
+
+        for mode, flags in (("in_memory", 0), ("mmap", getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP))):
+            index = app.tune_index(faiss.read_index(path, flags))
+            latency_ms, _ = time_queries(index, queries, args.k)
+            result[mode] = {
+                "memory": index_memory_mb(path, flags, queries_path),
+                "latency_ms": summarize(latency_ms),
+            }
+            if mode == "in_memory":
+                knob, values = sweeps.get(index_type, (None, [None]))
+                result["search"] = []
+                for value in values:
+                    if knob == "nprobe":
+                        faiss.extract_index_ivf(index).nprobe = value
+                    elif knob == "ef_search":
+                        index.hnsw.efSearch = value
+                    latency_ms, ids = time_queries(index, queries, args.k)
+                    entry = {knob: value} if knob else {}
+                    entry["recall_at_k"] = round(topk_overlap(ids, truth), 3)
+                    entry["latency_ms"] = summarize(latency_ms)
+                    result["search"].append(entry)
+            del index
+        results[index_type] = result
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    failed = [
+        t for t, r in results.items()
+        if max(entry["recall_at_k"] for entry in r["search"]) < args.min_recall
+    ]
+    report = {
+        "benchmark": "index",
+        "vectors": len(docs),
+        "queries": len(queries),
+        "dimension": int(docs.shape[1]),
+        "source": args.vectors_file or f"synthetic ({args.clusters} clusters, spread {args.spread}, seed {args.seed})",
+        "k": args.k,
+        "settings": {
+            "nlist": app.INDEX_NLIST or max(1, int(np.sqrt(len(docs)))),
+            "pq_m": app.INDEX_PQ_M,
+            "hnsw_m": app.INDEX_HNSW_M,
+            "hnsw_ef_construction": app.INDEX_HNSW_EF_CONSTRUCTION,
+        },
+        "results": results,
+        "failed": failed,
+    }
+    return report, 1 if failed else 0
+
+
+# ==============================
+# CHUNK STORE
+# Load time, memory and per-search read latency of a partition's chunks
+# in chunks.sqlite against the pickled docstore and JSON postings it
+# replaced, on a synthetic partition. Searches run on one thread, then on
+# --threads at once, the way concurrent requests share a partition.
+# ==============================
+def synthetic_chunks(n, vocabulary, words, topics, seed):
+    rng = random.Random(seed)
+    terms = [f"w{i}" for i in range(vocabulary)]
+    return [
+        Document(
+            page_content=" ".join(rng.choices(terms, k=words)),
+            metadata={"university": "Synthetic", "topic": f"topic-{rng.randrange(topics)}"},
+        )
+        for _ in range(n)
+    ], terms
+
+
+def write_pickled_store(path, ids, docs):
+    import pickle
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+
+    with open(os.path.join(path, app.LEGACY_DOCSTORE_FILE), "wb") as f:
+        pickle.dump((InMemoryDocstore(dict(zip(ids, docs))), dict(enumerate(ids))), f)
+    postings = app.LexicalIndex.build([doc.page_content for doc in docs]).postings
+    with open(os.path.join(path, app.LEGACY_LEXICAL_FILE), "w") as f:
+        json.dump(postings, f)
+
+
+def load_store(path, kind):
+    """(docstore, positions, lexical index) of a store written by bench_store."""
+    if kind == "sqlite":
+        store = app.ChunkStore(os.path.join(path, app.CHUNKS_FILE))
+        return store, store.positions, app.LexicalIndex(store.postings)
+    import pickle
+
+    with open(os.path.join(path, app.LEGACY_DOCSTORE_FILE), "rb") as f:
+        docstore, positions = pickle.load(f)
+    with open(os.path.join(path, app.LEGACY_LEXICAL_FILE)) as f:
+        postings = {term: tuple(entry) for term, entry in json.load(f).items()}
+    return docstore, positions, app.LexicalIndex(postings)
+
+
+STORE_MEMORY_PROBE = """
+import sys, benchmark
+before = benchmark.rss_anon_mb()
+store = benchmark.load_store(sys.argv[1], sys.argv[2])
+print(round(benchmark.rss_anon_mb() - before, 1))
+"""
+
+
+def rss_anon_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+
+
+def store_memory_mb(path, kind):
+    if not os.path.exists("/proc/self/status"):
+        return None  # not Linux
+    output = subprocess.run(
+        [sys.executable, "-c", STORE_MEMORY_PROBE, path, kind],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout.split()
+    return float(output[-1])
+
+
+class RowReads:
+    # A ChunkStore read one hit at a time, for comparison with ChunkStore.at.
+    def __init__(self, store):
+        self.search = store.search
+
+
+def time_searches(snapshot, queries, hits, k, threads):
+    # The FAISS search itself is done up front (as retrieve_batch does), so
+    # only the chunk and postings reads are timed.
+    def one(i):
+        vector, text, topic = queries[i]
+        started = time.perf_counter()
+        app.search_partition(snapshot, "Synthetic", vector, text, k, [topic], (hits[0][i], hits[1][i]))
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    if threads <= 1:
+        latency_ms = [one(i) for i in range(len(queries))]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(threads) as pool:
+            latency_ms = list(pool.map(one, range(len(queries))))
+    elapsed = time.perf_counter() - started
+    return {"latency_ms": summarize(latency_ms), "searches_per_s": round(len(queries) / elapsed, 1)}
+
+
+def bench_store(args):
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    docs, terms = synthetic_chunks(args.size, args.vocabulary, args.words, args.topics, args.seed)
+    ids = [f"chunk-{i}" for i in range(len(docs))]
+    vectors = synthetic_vectors(args.size + args.queries, args.dimension, args.clusters, 1.0, args.seed)
+    rng = random.Random(args.seed)
+    queries = [
+        (vector, " ".join(rng.choices(terms, k=args.query_words)), f"topic-{rng.randrange(args.topics)}")
+        for vector in vectors[args.size:]
+    ]
+    index = faiss.IndexFlatL2(args.dimension)
+    index.add(vectors[:args.size])
+    hits = index.search(vectors[args.size:], 4 * args.k)
+
+    work_dir = tempfile.mkdtemp(prefix="universe-pk-store-")
+    started = time.perf_counter()
+    app.write_chunk_store(os.path.join(work_dir, app.CHUNKS_FILE), ids, docs)
+    write_ms = {"sqlite": (time.perf_counter() - started) * 1000}
+    started = time.perf_counter()
+    write_pickled_store(work_dir, ids, docs)
+    write_ms["pickle"] = (time.perf_counter() - started) * 1000
+
+    results = {}
+    for kind in ("pickle", "sqlite", "sqlite_per_row"):
+        started = time.perf_counter()
+        docstore, positions, lexical_index = load_store(work_dir, kind.split("_")[0])
+        load_ms = (time.perf_counter() - started) * 1000
+        if kind == "sqlite_per_row":
+            docstore = RowReads(docstore)
+        store = FAISS(None, index, docstore, positions)
+        snapshot = app.IndexSnapshot({"Synthetic": store}, {"Synthetic": lexical_index}, {})
+        time_searches(snapshot, queries[:10], hits, args.k, 1)  # warm up
+        result = {
+            "search": time_searches(snapshot, queries, hits, args.k, 1),
+            f"search_{args.threads}_threads": time_searches(snapshot, queries, hits, args.k, args.threads),
+        }
+        if kind in write_ms:
+            result.update(
+                write_ms=round(write_ms[kind], 1),
+                load_ms=round(load_ms, 1),
+                memory_mb=store_memory_mb(work_dir, kind),
+            )
+        results[kind] = result
+    shutil.rmtree(work_dir, ignore_errors=True)
+    report = {
+        "benchmark": "store",
+        "chunks": args.size,
+        "queries": len(queries),
+        "k": args.k,
+        "hybrid_search": app.HYBRID_SEARCH,
+        "results": results,
+    }
+    return report, 0
+
+
+# ==============================
+# LOAD TEST
+# N simulated students hold multi-turn conversations with a running app
+# through the Gradio queue, the way the browser does (queue/join, then the
+# queue/data event stream), so queueing, session state and streaming are
+# all exercised. The app under test is started here (app.py, or serve.py
+# with --workers) with its LLM pointed at LocalLLMServer, an
+# OpenAI-compatible stand-in running in its own process. Throughput,
+# latency and the app processes' RSS and CPU are sampled over time.
+# ==============================
+FOLLOW_UPS = [
+    "what about its fees?",
+    "and for PhD?",
+    "what about NUST?",
+    "Which scholarships are available there?",
+    "What is the eligibility criteria for MS?",
+    "what about COMSATS?",
+    "thanks!",
+]
+# Replies that mean the app failed the turn, though the queue event succeeded.
+FAILED_REPLY_PREFIXES = {
+    "app_error": ("Sorry, an error occurred", "Sorry, the knowledge base failed"),
+    "not_ready": (app.WARMING_UP_REPLY,),
+}
+INTERRUPTED_MARKER = "⚠️ The response was interrupted"
+
+
+def local_llm_app(options, error_rate, seed):
+    """Starlette app serving /v1/chat/completions (streamed) from LocalGroq's answers."""
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    local = LocalGroq(**options)
+    rng = random.Random(seed)
+    stats = {"requests": 0, "failed": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def event(payload):
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def completions(request):
+        body = await request.json()
+        stats["requests"] += 1
+        if rng.random() < error_rate:
+            stats["failed"] += 1
+            return JSONResponse({"error": {"message": "stand-in failure"}}, status_code=503)
+        prompt = "\n".join(m["content"] for m in body["messages"])
+        prompt_tokens = app.count_tokens(prompt)
+        tokens = local.answer_tokens(prompt)[:body.get("max_tokens") or None]
+
+        async def stream():
+            stats["in_flight"] += 1
+            stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+            try:
+                await asyncio.sleep(local.ttft_s + prompt_tokens * local.prefill_s)
+                for i, token in enumerate(tokens):
+                    if i:
+                        await asyncio.sleep(local.token_s)
+                    yield event({"choices": [{"delta": {"content": token}}]})
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens)}
+                yield event({"choices": [], "usage": usage})
+                yield "data: [DONE]\n\n"
+            finally:
+                stats["in_flight"] -= 1
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    async def report(request):
+        return JSONResponse(stats)
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", completions, methods=["POST"]),
+        Route("/stats", report),
+    ])
+
+
+def run_local_llm(port, options, error_rate, seed):
+    import uvicorn
+
+    uvicorn.run(local_llm_app(options, error_rate, seed), host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(check, timeout, what):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"{what} did not come up within {timeout:g}s")
+
+
+def process_tree(pid):
+    # pid and all of its descendants (serve.py's workers and embedding server).
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        pending.extend(children.get(current, []))
+    return pids
+
+
+def process_usage(pid):
+    """RSS (summed over the tree, so shared pages count once per process) and CPU seconds."""
+    usage = {"processes": 0, "rss_mb": 0.0, "rss_anon_mb": 0.0, "cpu_s": 0.0}
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{current}/status") as f:
+                status = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue  # exited meanwhile
+        usage["processes"] += 1
+        usage["cpu_s"] += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+        usage["rss_mb"] += int(status.get("VmRSS", "0 kB").split()[0]) / 1024
+        usage["rss_anon_mb"] += int(status.get("RssAnon", "0 kB").split()[0]) / 1024
+    return usage
+
+
+def chat_endpoint(config):
+    # The ChatInterface API endpoint: fn_index and the hidden button that triggers it.
+    for dependency in config["dependencies"]:
+        if dependency.get("api_name") in ("achat", "chat"):
+            return dependency["id"], dependency["targets"][0][0]
+    raise SystemExit("the app's Gradio config has no chat endpoint (api_name achat or chat)")
+
+
+def reply_outcome(text):
+    for outcome, prefixes in FAILED_REPLY_PREFIXES.items():
+        if text.startswith(prefixes):
+            return outcome
+    return "interrupted" if INTERRUPTED_MARKER in text else "ok"
+
+
+class LoadStats:
+    """Per-turn results, plus the interval counters the sampler reads and resets."""
+
+    def __init__(self):
+        self.turns = []
+        self.active_users = 0
+        self.in_flight = 0
+        self.interval = []
+
+    def add(self, turn):
+        self.turns.append(turn)
+        self.interval.append(turn)
+
+
+async def chat_turn(client, endpoint, session_hash, message, timeout):
+    """Send one message on a session; returns the turn's timings and outcome."""
+    fn_index, trigger_id = endpoint
+    started = time.perf_counter()
+    turn = {"queue_wait_ms": None, "ttft_ms": None, "latency_ms": None, "outcome": "ok", "chars": 0}
+    ms = lambda: round((time.perf_counter() - started) * 1000, 1)
+
+    async def exchange():
+        response = await client.post("/gradio_api/queue/join", json={
+            "data": [message, None], "event_data": None,
+            "fn_index": fn_index, "trigger_id": trigger_id, "session_hash": session_hash,
+        })
+        response.raise_for_status()
+        event_id = response.json()["event_id"]
+        async with client.stream("GET", "/gradio_api/queue/data", params={"session_hash": session_hash}) as stream:
+            stream.raise_for_status()
+            async for line in stream.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = json.loads(line[len("data:"):])
+                if payload.get("event_id") not in (event_id, None):
+                    continue
+                kind = payload.get("msg")
+                if kind == "process_starts":
+                    turn["queue_wait_ms"] = ms()
+                elif kind == "process_generating" and turn["ttft_ms"] is None:
+                    turn["ttft_ms"] = ms()
+                elif kind == "process_completed":
+                    turn["latency_ms"] = ms()
+                    if not payload.get("success"):
+                        turn["outcome"] = "queue_error"
+                    else:
+                        text = str(((payload.get("output") or {}).get("data") or [""])[0] or "")
+                        turn["outcome"], turn["chars"] = reply_outcome(text), len(text)
+                    return
+                elif kind == "close_stream":
+                    break
+        turn["outcome"] = "queue_error"  # the stream ended without our event
+
+    try:
+        await asyncio.wait_for(exchange(), timeout)
+    except asyncio.TimeoutError:
+        turn["outcome"] = "timeout"
+    except httpx.HTTPError as e:
+        turn["outcome"] = f"http_error:{type(e).__name__}"
+    return turn
+
+
+async def simulate_user(user, args, client, endpoint, stats, started):
+    rng = random.Random(args.seed * 100003 + user)
+    await asyncio.sleep(args.ramp_seconds * user / max(args.users, 1))
+    stats.active_users += 1
+    try:
+        for conversation in range(args.conversations):
+            session_hash = f"load{user}x{conversation}x{rng.getrandbits(32):08x}"
+            messages = [rng.choice(app.EXAMPLE_QUESTIONS)] + rng.sample(FOLLOW_UPS, min(args.turns - 1, len(FOLLOW_UPS)))
+            for turn_number, message in enumerate(messages):
+                stats.in_flight += 1
+                try:
+                    turn = await chat_turn(client, endpoint, session_hash, message, args.timeout_seconds)
+                finally:
+                    stats.in_flight -= 1
+                turn.update(user=user, turn=turn_number, at_s=round(time.perf_counter() - started, 2))
+                stats.add(turn)
+                if args.think_seconds > 0:
+                    await asyncio.sleep(rng.expovariate(1 / args.think_seconds))
+    finally:
+        stats.active_users -= 1
+
+
+async def sample_load(args, stats, pid, started, timeline, done):
+    previous = process_usage(pid) if pid else None
+    previous_at = time.perf_counter()
+    while not done.is_set():
+        try:
+            await asyncio.wait_for(done.wait(), args.sample_seconds)
+        except asyncio.TimeoutError:
+            pass
+        now = time.perf_counter()
+        interval, stats.interval = stats.interval, []
+        latencies = [t["latency_ms"] for t in interval if t["latency_ms"] is not None]
+        sample = {
+            "t_s": round(now - started, 1),
+            "active_users": stats.active_users,
+            "in_flight": stats.in_flight,
+            "completed": len(interval),
+            "errors": sum(t["outcome"] != "ok" for t in interval),
+            "turns_per_s": round(len(interval) / (now - previous_at), 2),
+            "latency_p50_ms": percentile(latencies, 50),
+            "latency_p99_ms": percentile(latencies, 99),
+        }
+        if pid:
+            usage = process_usage(pid)
+            sample.update(
+                processes=usage["processes"],
+                rss_mb=round(usage["rss_mb"], 1),
+                rss_anon_mb=round(usage["rss_anon_mb"], 1),
+                cpu_percent=round((usage["cpu_s"] - previous["cpu_s"]) / (now - previous_at) * 100, 1),
+            )
+            previous = usage
+        previous_at = now
+        timeline.append(sample)
+        print(json.dumps(sample), file=sys.stderr)
+
+
+async def drive_load(args, url, pid):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=url, timeout=httpx.Timeout(None, connect=10.0), limits=limits) as client:
+        response = await client.get("/config")
+        response.raise_for_status()
+        endpoint = chat_endpoint(response.json())
+        stats, timeline, done = LoadStats(), [], asyncio.Event()
+        started = time.perf_counter()
+        sampler = asyncio.create_task(sample_load(args, stats, pid, started, timeline, done))
+        await asyncio.gather(*(simulate_user(user, args, client, endpoint, stats, started) for user in range(args.users)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await sampler
+    return stats.turns, timeline, elapsed
+
+
+def start_app(args, port, llm_port, log_file):
+    env = dict(
+        os.environ,
+        APP_AUTOSTART="1",
+        LLM_BACKEND="openai",
+        LLM_BASE_URL=f"http://127.0.0.1:{llm_port}/v1",
+        LLM_API_KEY="local-benchmark",
+        LLM_FALLBACK_MODEL="",
+        GRADIO_SERVER_NAME="127.0.0.1",
+        GRADIO_SERVER_PORT=str(port),
+        GRADIO_ANALYTICS_ENABLED="False",
+        USE_ASYNC_CHAT="1" if args.path == "async" else "0",
+        SEMANTIC_CACHE_ENABLED="1" if args.cache else "0",
+        QUERY_LOG_PATH="",
+    )
+    if args.no_fact_path:
+        env["FACT_FAST_PATH"] = "0"
+    for setting in args.app_env:
+        key, _, value = setting.partition("=")
+        env[key] = value
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, os.path.join(here, "app.py")]
+    if args.workers:
+        command = [sys.executable, os.path.join(here, "serve.py"), "--workers", str(args.workers), "--port", str(port)]
+    return subprocess.Popen(command, env=env, cwd=here, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def app_ready(url):
+    response = httpx.get(f"{url}{app.METRICS_PATH}", timeout=5)
+    return response.status_code == 200 and "universe_pk_knowledge_base_ready 1" in response.text
+
+
+def bench_load(args):
+    import logging
+    import multiprocessing
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # one line per request otherwise
+    llm_port = args.llm_port or free_port()
+    options = dict(
+        ttft_ms=args.llm_ttft_ms,
+        tokens_per_s=args.llm_tokens_per_s,
+        completion_tokens=args.llm_completion_tokens,
+        prefill_tokens_per_s=args.llm_prefill_tokens_per_s,
+    )
+    llm_server = multiprocessing.get_context("spawn").Process(
+        target=run_local_llm, args=(llm_port, options, args.llm_error_rate, args.seed), daemon=True
+    )
+    llm_server.start()
+    app_process = log_file = None
+    try:
+        wait_for(lambda: httpx.get(f"http://127.0.0.1:{llm_port}/stats").status_code == 200, 60, "The LLM stand-in")
+        url, pid = args.url, args.pid
+        if url is None:
+            port = args.port or free_port()
+            url = f"http://127.0.0.1:{port}"
+            log_path = args.app_log or os.path.join(tempfile.mkdtemp(prefix="load-"), "app.log")
+            log_file = open(log_path, "w")
+            app_process = start_app(args, port, llm_port, log_file)
+            pid = app_process.pid
+            print(f"Started the app (pid {pid}, log {log_path}); waiting for the knowledge base...", file=sys.stderr)
+            wait_for(lambda: app_process.poll() is None and app_ready(url), args.startup_timeout, "The app")
+        else:
+            print(f"Point the app's LLM at http://127.0.0.1:{llm_port}/v1 (LLM_BACKEND=openai).", file=sys.stderr)
+
+        turns, timeline, elapsed = asyncio.run(drive_load(args, url, pid))
+        llm_stats = httpx.get(f"http://127.0.0.1:{llm_port}/stats").json()
+    finally:
+        if app_process is not None:
+            app_process.terminate()
+            try:
+                app_process.wait(30)
+            except subprocess.TimeoutExpired:
+                app_process.kill()
+        if log_file is not None:
+            log_file.close()
+        llm_server.terminate()
+
+    outcomes = {}
+    for turn in turns:
+        outcomes[turn["outcome"]] = outcomes.get(turn["outcome"], 0) + 1
+    ok = [turn for turn in turns if turn["outcome"] == "ok"]
+    error_rate = round(1 - len(ok) / len(turns), 4) if turns else None
+    series = lambda field: [t[field] for t in ok if t[field] is not None]
+    report = {
+        "benchmark": "load",
+        "url": url,
+        "settings": {
+            "users": args.users, "turns": args.turns, "conversations": args.conversations,
+            "think_seconds": args.think_seconds, "ramp_seconds": args.ramp_seconds,
+            "workers": args.workers, "path": args.path, "cache": args.cache,
+            "llm": {**options, "error_rate": args.llm_error_rate},
+        },
+        "seconds": round(elapsed, 1),
+        "turns": len(turns),
+        "throughput_turns_per_s": round(len(turns) / elapsed, 2) if elapsed else None,
+        "error_rate": error_rate,
+        "outcomes": outcomes,
+        "queue_wait_ms": summarize(series("queue_wait_ms")),
+        "ttft_ms": summarize(series("ttft_ms")),
+        "latency_ms": summarize(series("latency_ms")),
+        "llm_stand_in": llm_stats,
+        "process": {
+            "peak_rss_mb": max((s["rss_mb"] for s in timeline if "rss_mb" in s), default=None),
+            "peak_rss_anon_mb": max((s["rss_anon_mb"] for s in timeline if "rss_anon_mb" in s), default=None),
+            "mean_cpu_percent": round(float(np.mean([s["cpu_percent"] for s in timeline if "cpu_percent" in s])), 1)
+            if any("cpu_percent" in s for s in timeline) else None,
+        },
+        "timeline": timeline,
+    }
+    failed = error_rate is None or error_rate > args.max_error_rate
+    p99 = report["latency_ms"]["p99"]
+    if args.max_p99_ms and (p99 is None or p99 > args.max_p99_ms):
+        failed = True
+    return report, 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    embeddings = commands.add_parser("embeddings", help="compare embedding backends")
+    embeddings.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    embeddings.add_argument("--k", type=int, default=app.RETRIEVAL_K)
+    embeddings.add_argument("--repeat", type=int, default=5, help="passes over the query set")
+    embeddings.add_argument(
+        "--tolerance", type=float, default=0.8,
+        help="minimum mean top-k overlap with the baseline (first backend)",
+    )
+    embeddings.set_defaults(run=bench_embeddings)
+
+    pipeline = commands.add_parser("pipeline", help="index, retrieval, prompt and end-to-end latency")
+    pipeline.add_argument("--backend", default=app.EMBEDDING_BACKEND, help="embedding backend")
+    pipeline.add_argument("--repeat", type=int, default=5, help="passes over the golden question set")
+    pipeline.add_argument("--path", choices=["async", "sync"], default="async" if app.USE_ASYNC_CHAT else "sync")
+    pipeline.add_argument("--no-fact-path", action="store_true", help="send fact-table questions to the LLM too")
+    pipeline.add_argument("--llm-ttft-ms", type=float, default=300.0, help="stand-in time to first token")
+    pipeline.add_argument("--llm-tokens-per-s", type=float, default=250.0, help="stand-in streaming rate (0 = instant)")
+    pipeline.add_argument("--llm-completion-tokens", type=int, default=150, help="stand-in answer length")
+    pipeline.add_argument(
+        "--llm-prefill-tokens-per-s", type=float, default=0.0,
+        help="stand-in prompt processing rate, added to the TTFT per prompt token (0 = prompt size is free)",
+    )
+    pipeline.add_argument("--rerank", action="store_true", help="load RERANK_MODEL and rerank the candidates")
+    pipeline.add_argument(
+        "--min-recall", type=float, default=0.8,
+        help="exit non-zero if mean Recall@k over the golden set is lower",
+    )
+    pipeline.set_defaults(run=bench_pipeline)
+
+    index = commands.add_parser("index", help="recall, latency and memory of the FAISS index types")
+    index.add_argument("--types", nargs="+", choices=app.INDEX_TYPES, default=list(app.INDEX_TYPES))
+    index.add_argument("--size", type=int, default=50000, help="synthetic vectors to index")
+    index.add_argument("--queries", type=int, default=200)
+    index.add_argument("--dimension", type=int, default=384, help="synthetic vector size (all-MiniLM-L6-v2: 384)")
+    index.add_argument("--clusters", type=int, default=200, help="synthetic topic clusters")
+    index.add_argument("--spread", type=float, default=1.0, help="synthetic within-cluster noise")
+    index.add_argument("--seed", type=int, default=0)
+    index.add_argument("--vectors-file", help="index these vectors (.npy, one row each) instead")
+    index.add_argument("--k", type=int, default=app.RETRIEVAL_K)
+    index.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64], help="IVF values to sweep")
+    index.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128], help="HNSW values to sweep")
+    index.add_argument(
+        "--min-recall", type=float, default=0.0,
+        help="exit non-zero if a type's best Recall@k against flat is lower",
+    )
+    index.set_defaults(run=bench_index)
+
+    store = commands.add_parser("store", help="load time, memory and read latency of the chunk store")
+    store.add_argument("--size", type=int, default=100000, help="synthetic chunks in the partition")
+    store.add_argument("--queries", type=int, default=500)
+    store.add_argument("--threads", type=int, default=8, help="concurrent searches in the second pass")
+    store.add_argument("--vocabulary", type=int, default=20000, help="distinct synthetic words")
+    store.add_argument("--words", type=int, default=120, help="words per chunk")
+    store.add_argument("--query-words", type=int, default=6)
+    store.add_argument("--topics", type=int, default=8, help="topics the chunks are spread over")
+    store.add_argument("--dimension", type=int, default=384)
+    store.add_argument("--clusters", type=int, default=200, help="synthetic vector clusters")
+    store.add_argument("--seed", type=int, default=0)
+    store.add_argument("--k", type=int, default=app.RETRIEVAL_K)
+    store.set_defaults(run=bench_store)
+
+    load = commands.add_parser("load", help="concurrent multi-turn users through the Gradio queue")
+    load.add_argument("--users", type=int, default=20, help="simulated students")
+    load.add_argument("--turns", type=int, default=4, help="messages per conversation")
+    load.add_argument("--conversations", type=int, default=1, help="conversations per user")
+    load.add_argument("--think-seconds", type=float, default=2.0, help="mean pause between a reply and the next message")
+    load.add_argument("--ramp-seconds", type=float, default=10.0, help="users start evenly over this time")
+    load.add_argument("--timeout-seconds", type=float, default=120.0, help="per message")
+    load.add_argument("--sample-seconds", type=float, default=2.0, help="timeline interval")
+    load.add_argument("--seed", type=int, default=0)
+    load.add_argument("--workers", type=int, default=0, help="run serve.py with this many workers instead of app.py")
+    load.add_argument("--path", choices=["async", "sync"], default="async" if app.USE_ASYNC_CHAT else "sync")
+    load.add_argument("--cache", action="store_true", help="keep the semantic answer cache on")
+    load.add_argument("--no-fact-path", action="store_true", help="send fact-table questions to the LLM too")
+    load.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                      help="extra environment for the app, e.g. GRADIO_CONCURRENCY=50 (repeatable)")
+    load.add_argument("--port", type=int, help="app port (default: a free one)")
+    load.add_argument("--app-log", help="app output goes here (default: a temporary file)")
+    load.add_argument("--startup-timeout", type=float, default=600.0, help="seconds to wait for the knowledge base")
+    load.add_argument("--url", help="load an app that is already running instead of starting one")
+    load.add_argument("--pid", type=int, help="with --url: sample this process (and its children)")
+    load.add_argument("--llm-port", type=int, help="LLM stand-in port (default: a free one)")
+    load.add_argument("--llm-ttft-ms", type=float, default=300.0, help="stand-in time to first token")
+    load.add_argument("--llm-tokens-per-s", type=float, default=50.0, help="stand-in streaming rate per request (0 = instant)")
+    load.add_argument("--llm-completion-tokens", type=int, default=150, help="stand-in answer length")
+    load.add_argument("--llm-prefill-tokens-per-s", type=float, default=0.0,
+                      help="stand-in prompt processing rate, added to the time to first token (0 = free)")
+    load.add_argument("--llm-error-rate", type=float, default=0.0, help="fraction of stand-in calls answered 503")
+    load.add_argument("--max-error-rate", type=float, default=1.0, help="exit non-zero above this error rate")
+    load.add_argument("--max-p99-ms", type=float, default=0.0, help="exit non-zero above this p99 latency (0 = off)")
+    load.set_defaults(run=bench_load)
+
+    args = parser.parse_args(argv)
+    report, exit_code = args.run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Answer a spreadsheet of questions in one go.
+
+Reads a CSV (with a header row; questions in a "question" column, or the
+first column, optional "id" column) or a JSONL file of {"question", "id"}
+objects, and writes id, question, answer, status, sources, error and ms
+for each one to an output file of the same type.
+
+    python bulk_qa.py questions.csv                       # -> questions-answers.csv
+    python bulk_qa.py questions.jsonl -o answers.jsonl --concurrency 8
+    python bulk_qa.py questions.csv --requests-per-minute 30 --tokens-per-minute 6000
+
+Answers are appended to the output as they finish. If a run is stopped,
+run the same command again: ids that already have an answer are skipped
+and failed ones are retried. See BULK_* in the README for the defaults.
+"""
+import os
+
+# Load the knowledge base here, without serving the UI.
+os.environ.setdefault("APP_AUTOSTART", "0")
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+from contextlib import aclosing
+
+import app
+
+
+def default_output(input_path):
+    stem, ext = os.path.splitext(input_path)
+    return f"{stem}-answers{ext.lower()}"
+
+
+async def run(items, output_path, args):
+    counts = {}
+    started = time.perf_counter()
+    records = app.answer_questions(
+        items, output_path, concurrency=args.concurrency,
+        requests_per_minute=args.requests_per_minute, tokens_per_minute=args.tokens_per_minute,
+    )
+    async with aclosing(records) as records:
+        async for record in records:
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+            print(f"[{sum(counts.values())}] {record['id']} {record['status']} {record['ms']}ms", file=sys.stderr)
+    return counts, round(time.perf_counter() - started, 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV or JSONL file of questions")
+    parser.add_argument("-o", "--output", help="results file (default: <input>-answers.<ext>)")
+    parser.add_argument("--concurrency", type=int, default=app.BULK_CONCURRENCY, help="LLM calls in flight")
+    parser.add_argument("--requests-per-minute", type=float, default=app.BULK_REQUESTS_PER_MINUTE)
+    parser.add_argument("--tokens-per-minute", type=float, default=app.BULK_TOKENS_PER_MINUTE)
+    args = parser.parse_args(argv)
+
+    output_path = args.output or default_output(args.input)
+    if os.path.splitext(output_path)[1].lower() not in (".csv", ".jsonl"):
+        parser.error("the output file must end in .csv or .jsonl")
+    try:
+        items = app.read_questions(args.input)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    app.warm_start()
+    if app.startup_error is not None:
+        print(f"Knowledge base failed to load: {app.startup_error}", file=sys.stderr)
+        return 1
+    counts, seconds = asyncio.run(run(items, output_path, args))
+    skipped = len(items) - sum(counts.values())
+    print(json.dumps({
+        "input": args.input,
+        "output": output_path,
+        "questions": len(items),
+        "skipped_already_answered": skipped,
+        "statuses": counts,
+        "seconds": seconds,
+    }, indent=2))
+    return 1 if counts.get("error") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
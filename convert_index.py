@@ -0,0 +1,63 @@
+"""Convert an existing faiss_index/ to the pickle-free chunk store.
+
+Indexes written before chunks.sqlite kept each partition's docstore in a
+pickle (index.pkl) that had to be unpickled whole on every start. This
+rewrites every such partition once, in place; the FAISS index files and
+the manifest are left as they are, so nothing is re-embedded.
+
+    python convert_index.py                 # faiss_index/
+    python convert_index.py --index-path /data/faiss_index
+
+The app also converts a partition the first time it loads it; running this
+ahead of time keeps that work out of a deployment's start.
+"""
+import os
+
+# Load only what is needed, not the whole app.
+os.environ.setdefault("APP_AUTOSTART", "0")
+# Nothing here calls the LLM.
+os.environ.setdefault("GROQ_API_KEY", "local-convert")
+
+import sys
+import json
+import time
+import argparse
+
+import app
+
+
+def directory_mb(path):
+    total = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return round(total / 2**20, 2)
+
+
+def convert(index_path):
+    results = {}
+    for entry in sorted(os.scandir(index_path), key=lambda e: e.name):
+        if not entry.is_dir() or not os.path.exists(os.path.join(entry.path, app.LEGACY_DOCSTORE_FILE)):
+            continue
+        before_mb = directory_mb(entry.path)
+        started = time.perf_counter()
+        chunks = app.convert_pickled_docstore(entry.path)
+        results[entry.name] = {
+            "chunks": chunks,
+            "convert_ms": round((time.perf_counter() - started) * 1000, 1),
+            "size_mb_before": before_mb,
+            "size_mb_after": directory_mb(entry.path),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-path", default=app.INDEX_PATH)
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.index_path):
+        parser.error(f"{args.index_path} does not exist")
+    results = convert(args.index_path)
+    print(json.dumps({"index_path": args.index_path, "converted": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
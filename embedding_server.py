@@ -0,0 +1,177 @@
+"""Embedding server and client for serving from several processes.
+
+With several serving processes (serve.py), one process holds the
+embedding model (and the rerank cross-encoder) and the others send it
+their texts. Requests from all of them that arrive within
+EMBEDDING_SERVER_BATCH_MS are encoded as one batch. The transport is
+multiprocessing.connection over a Unix socket (or host:port), so only
+processes holding EMBEDDING_SERVER_AUTHKEY can connect.
+
+serve.py runs the server in a process of its own (serve_embeddings); app.py
+connects to it when EMBEDDING_SERVER is set (connect_embeddings).
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_SERVER = os.getenv("EMBEDDING_SERVER")  # socket path or host:port; unset = load the model in-process
+EMBEDDING_SERVER_AUTHKEY = os.getenv("EMBEDDING_SERVER_AUTHKEY", "universe-pk").encode("utf-8")
+EMBEDDING_SERVER_BATCH_MS = float(os.getenv("EMBEDDING_SERVER_BATCH_MS", "2"))
+EMBEDDING_SERVER_MAX_BATCH = int(os.getenv("EMBEDDING_SERVER_MAX_BATCH", "64"))  # requests per batch
+EMBEDDING_SERVER_CONNECT_SECONDS = float(os.getenv("EMBEDDING_SERVER_CONNECT_SECONDS", "120"))
+
+logger = logging.getLogger("universe_pk")
+
+
+def server_address(address):
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit() and "/" not in address:
+        return host, int(port)
+    return address  # Unix socket path
+
+
+def send(connection, reply):
+    try:
+        connection.send(reply)
+    except OSError:
+        pass  # the client went away
+
+
+def serve_embeddings(embed, rerank=None, address=None):
+    """Run the embedding server until the process is stopped.
+
+    embed(texts) returns their vectors; rerank(pairs), if given, the
+    cross-encoder scores of (question, chunk) pairs.
+    """
+    address = address or EMBEDDING_SERVER
+
+    def no_reranker(pairs):
+        raise RuntimeError("RERANK_ENABLED is not set on the embedding server")
+
+    handlers = {
+        "ping": lambda items: [None] * len(items),
+        "embed": embed,
+        "rerank": rerank or no_reranker,
+    }
+    pending = queue.Queue()
+
+    def read(connection):
+        # Each client thread has one request in flight on its connection.
+        while True:
+            try:
+                op, items = connection.recv()
+                if not isinstance(items, (list, tuple)):
+                    raise TypeError(f"items must be a list, not {type(items).__name__}")
+            except (EOFError, OSError):
+                break
+            except Exception as e:
+                # A malformed request gets an error reply instead of leaving
+                # the client waiting; the batching loop never sees it.
+                logger.warning("embedding server: malformed request: %r", e)
+                send(connection, ("error", f"malformed request: {type(e).__name__}: {e}"))
+                continue
+            pending.put((connection, op, items))
+        connection.close()
+
+    def accept(listener):
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, AuthenticationError) as e:
+                logger.warning("embedding server: rejected a connection: %r", e)
+                continue
+            threading.Thread(target=read, args=(connection,), name="embed-client", daemon=True).start()
+
+    if isinstance(server_address(address), str) and os.path.exists(address):
+        os.remove(address)  # left behind by a previous run
+    listener = Listener(server_address(address), authkey=EMBEDDING_SERVER_AUTHKEY)
+    threading.Thread(target=accept, args=(listener,), name="embed-accept", daemon=True).start()
+    logger.info("embedding server listening on %s", address)
+
+    while True:
+        batch = [pending.get()]
+        deadline = time.monotonic() + EMBEDDING_SERVER_BATCH_MS / 1000
+        while len(batch) < EMBEDDING_SERVER_MAX_BATCH:
+            try:
+                batch.append(pending.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        for op, handler in handlers.items():
+            requests = [(connection, items) for connection, request_op, items in batch if request_op == op]
+            if not requests:
+                continue
+            try:
+                results = handler([item for _, items in requests for item in items])
+                error = None
+            except Exception as e:
+                logger.exception("embedding server: %s batch failed", op)
+                error = f"{type(e).__name__}: {e}"
+            offset = 0
+            for connection, items in requests:
+                send(connection, ("error", error) if error else ("ok", results[offset:offset + len(items)]))
+                offset += len(items)
+        for connection, request_op, _ in batch:
+            if request_op not in handlers:
+                send(connection, ("error", f"unknown operation {request_op!r}"))
+
+
+class EmbeddingClient(Embeddings):
+    """Embeddings computed by the embedding server; one connection per thread."""
+
+    def __init__(self, address):
+        self.address = address
+        self._local = threading.local()
+
+    def call(self, op, items):
+        for attempt in range(2):
+            connection = getattr(self._local, "connection", None)
+            try:
+                if connection is None:
+                    connection = Client(server_address(self.address), authkey=EMBEDDING_SERVER_AUTHKEY)
+                    self._local.connection = connection
+                connection.send((op, items))
+                status, result = connection.recv()
+                break
+            except (EOFError, OSError):
+                # The server restarted: reconnect once.
+                self._local.connection = None
+                if attempt:
+                    raise
+        if status != "ok":
+            raise RuntimeError(f"embedding server: {result}")
+        return result
+
+    def embed_documents(self, texts):
+        return self.call("embed", list(texts))
+
+    def embed_query(self, text):
+        return self.call("embed", [text])[0]
+
+
+class RemoteCrossEncoder:
+    # CrossEncoder.predict() stand-in for Reranker, scored by the embedding server.
+    def __init__(self, address):
+        self.client = EmbeddingClient(address)
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=False):
+        return self.client.call("rerank", [tuple(pair) for pair in pairs])
+
+
+def connect_embeddings(address=None, timeout=None):
+    # Waits for a server that is still loading its model.
+    client = EmbeddingClient(address or EMBEDDING_SERVER)
+    deadline = time.monotonic() + (EMBEDDING_SERVER_CONNECT_SECONDS if timeout is None else timeout)
+    while True:
+        try:
+            client.call("ping", [None])
+            return client
+        except (OSError, EOFError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
@@ -0,0 +1,270 @@
+"""Serve the app from several processes behind one port.
+
+    python serve.py --workers 4                 # http://localhost:7860
+    python serve.py --workers 4 --port 7860 --worker-port 7861
+
+This process builds or updates faiss_index/ once and then starts:
+
+- an embedding server, the only process holding the embedding model (and
+  the rerank model), which encodes the queries of all workers in batches;
+- --workers copies of app.py on --worker-port, --worker-port + 1, ...,
+  which only read the index: the FAISS files are memory-mapped and
+  chunks.sqlite is read through the page cache, so every worker shares the
+  same pages and adds little memory of its own;
+- a proxy on --port that keeps each browser session on one worker, since
+  Gradio holds a session's queue and state in the worker's memory.
+
+KB_WATCH_SECONDS and the reload endpoint (KB_ADMIN_TOKEN) run here as well:
+a reload rebuilds the index once and then has every worker load it
+(SIGHUP). Workers that exit are restarted. Each worker serves its own
+/metrics on its worker port.
+"""
+import os
+import re
+import sys
+import json
+import zlib
+import signal
+import socket
+import secrets
+import argparse
+import tempfile
+import threading
+import time
+import multiprocessing
+
+# Request and response headers that describe one connection, not the message.
+HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "trailers", "transfer-encoding", "upgrade",
+}
+SESSION_IN_PATH = re.compile(r"/heartbeat/([^/?]+)")
+WORKER_START_SECONDS = 180
+
+
+# ==============================
+# CHILD PROCESSES
+# Started with the "spawn" method, so each one imports app.py fresh with
+# the environment it is given instead of inheriting this process's state.
+# ==============================
+def run_embedding_server(env):
+    os.environ.update(env)
+    import app
+    from embedding_server import serve_embeddings
+
+    model = app.load_embeddings()
+    model.embed_documents([app.WARMUP_QUERY])
+    rerank = None
+    if app.RERANK_ENABLED:
+        from sentence_transformers import CrossEncoder
+
+        cross_encoder = CrossEncoder(app.RERANK_MODEL, device="cpu")
+        rerank = lambda pairs: cross_encoder.predict(pairs, batch_size=len(pairs), show_progress_bar=False).tolist()
+    serve_embeddings(model.embed_documents, rerank)
+
+
+def run_worker(env, port):
+    os.environ.update(env)
+    import app
+
+    app.launch(server_name="127.0.0.1", server_port=port)
+
+
+class Supervisor:
+    """Starts the child processes and restarts any that exit."""
+
+    def __init__(self, env, worker_ports):
+        self.context = multiprocessing.get_context("spawn")
+        self.env = env
+        self.worker_ports = worker_ports
+        self.worker_env = dict(
+            env,
+            APP_AUTOSTART="1",
+            INDEX_READ_ONLY="1",
+            KB_WATCH_SECONDS="0",  # reloads are driven from here
+            KB_ADMIN_TOKEN="",
+        )
+        self.embedding_server = None
+        self.workers = {}
+        self._stopping = False
+
+    def _start(self, target, *args):
+        process = self.context.Process(target=target, args=args, daemon=True)
+        process.start()
+        return process
+
+    def start_embedding_server(self):
+        self.embedding_server = self._start(run_embedding_server, self.env)
+
+    def start_workers(self):
+        for port in self.worker_ports:
+            self.workers[port] = self._start(run_worker, self.worker_env, port)
+
+    def watch(self, interval=1.0):
+        while not self._stopping:
+            time.sleep(interval)
+            if self._stopping:
+                return
+            if not self.embedding_server.is_alive():
+                print(f"Embedding server exited ({self.embedding_server.exitcode}); restarting it.", file=sys.stderr)
+                self.start_embedding_server()
+            for port, process in list(self.workers.items()):
+                if not process.is_alive():
+                    print(f"Worker on port {port} exited ({process.exitcode}); restarting it.", file=sys.stderr)
+                    self.workers[port] = self._start(run_worker, self.worker_env, port)
+
+    def signal_workers(self, summary=None):
+        for process in self.workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+
+    def stop(self):
+        self._stopping = True
+        processes = [p for p in [self.embedding_server, *self.workers.values()] if p is not None]
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+
+
+def wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+
+# ==============================
+# PROXY
+# Streams every request through to a worker chosen by the Gradio session
+# (from the heartbeat path, a session_hash query parameter or JSON body),
+# falling back to the client address for requests without one.
+# ==============================
+def session_key(request, body):
+    match = SESSION_IN_PATH.search(request.url.path)
+    if match:
+        return match.group(1)
+    if "session_hash" in request.query_params:
+        return request.query_params["session_hash"]
+    if body[:1] == b"{":
+        try:
+            value = json.loads(body).get("session_hash")
+        except (ValueError, AttributeError):
+            value = None
+        if value:
+            return str(value)
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else ""
+
+
+def make_proxy(worker_ports, extra_routes=()):
+    import httpx
+    from starlette.applications import Starlette
+    from starlette.background import BackgroundTask
+    from starlette.responses import PlainTextResponse, StreamingResponse
+    from starlette.routing import Route
+
+    client = httpx.AsyncClient(
+        timeout=httpx.Timeout(None, connect=5.0),  # event streams stay open
+        limits=httpx.Limits(max_connections=None, max_keepalive_connections=200),
+    )
+
+    async def forward(request):
+        body = await request.body()
+        port = worker_ports[zlib.crc32(session_key(request, body).encode("utf-8")) % len(worker_ports)]
+        target = f"http://127.0.0.1:{port}{request.scope['raw_path'].decode('latin-1')}"
+        if request.scope["query_string"]:
+            target += "?" + request.scope["query_string"].decode("latin-1")
+
+        headers = [(k, v) for k, v in request.headers.items() if k not in HOP_HEADERS and k != "x-forwarded-for"]
+        client_host = request.client.host if request.client else ""
+        forwarded = request.headers.get("x-forwarded-for")
+        headers.append(("x-forwarded-for", f"{forwarded}, {client_host}" if forwarded else client_host))
+        if "x-forwarded-proto" not in request.headers:
+            headers.append(("x-forwarded-proto", request.url.scheme))
+
+        upstream = client.build_request(request.method, target, headers=headers, content=body)
+        try:
+            response = await client.send(upstream, stream=True)
+        except httpx.TransportError as e:
+            return PlainTextResponse(f"Worker on port {port} is unavailable: {e!r}", status_code=502)
+        reply = StreamingResponse(
+            response.aiter_raw(), status_code=response.status_code, background=BackgroundTask(response.aclose)
+        )
+        reply.raw_headers = [
+            (k.encode("latin-1"), v.encode("latin-1"))
+            for k, v in response.headers.multi_items() if k.lower() not in HOP_HEADERS
+        ]
+        return reply
+
+    methods = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+    return Starlette(routes=[*extra_routes, Route("/{path:path}", forward, methods=methods)])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default=os.getenv("GRADIO_SERVER_NAME", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("GRADIO_SERVER_PORT", "7860")))
+    parser.add_argument("--worker-port", type=int, help="first worker port (default: --port + 1)")
+    args = parser.parse_args(argv)
+    first_port = args.worker_port or args.port + 1
+    worker_ports = list(range(first_port, first_port + args.workers))
+
+    env = {
+        "EMBEDDING_SERVER": os.getenv("EMBEDDING_SERVER")
+        or os.path.join(tempfile.mkdtemp(prefix="universe-pk-"), "embeddings.sock"),
+        "EMBEDDING_SERVER_AUTHKEY": os.getenv("EMBEDDING_SERVER_AUTHKEY") or secrets.token_hex(16),
+        "GRADIO_SERVER_NAME": "127.0.0.1",
+    }
+    # This process only builds the index and runs the proxy.
+    os.environ.update(env, APP_AUTOSTART="0", WARMUP_ENABLED="0")
+    import uvicorn
+    from starlette.routing import Route
+
+    supervisor = Supervisor(env, worker_ports)
+    # uvicorn re-raises the signal it stopped on once it has shut down; exit
+    # through the finally below so the children are stopped too.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    try:
+        supervisor.start_embedding_server()
+        import app
+
+        print(f"Building the index with the embedding server at {env['EMBEDDING_SERVER']}...")
+        app.warm_start()
+        if app.startup_error is not None:
+            print(f"Knowledge base failed to load: {app.startup_error}", file=sys.stderr)
+            return 1
+        app.kb_reload_hooks.append(supervisor.signal_workers)
+        if app.KB_WATCH_SECONDS > 0:
+            threading.Thread(
+                target=app.watch_knowledge_base, args=(app.KB_WATCH_SECONDS,), name="kb-watcher", daemon=True
+            ).start()
+
+        supervisor.start_workers()
+        for port in worker_ports:
+            if not wait_for_port(port, WORKER_START_SECONDS):
+                print(f"Worker on port {port} did not start.", file=sys.stderr)
+                return 1
+        threading.Thread(target=supervisor.watch, name="supervisor", daemon=True).start()
+
+        routes = []
+        if app.KB_ADMIN_TOKEN:
+            routes.append(Route(app.KB_RELOAD_PATH, app.kb_reload_endpoint, methods=["GET", "POST"]))
+        print(f"Serving {args.workers} workers (ports {worker_ports[0]}-{worker_ports[-1]}) on http://{args.host}:{args.port}")
+        uvicorn.run(make_proxy(worker_ports, routes), host=args.host, port=args.port, log_level="warning")
+        return 0
+    finally:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
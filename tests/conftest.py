@@ -0,0 +1,65 @@
+import os
+import re
+import sys
+import hashlib
+
+# app.py reads its settings at import time: load it without serving the UI,
+# without KB_DIR files and without writing caches or logs.
+os.environ["APP_AUTOSTART"] = "0"
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ["KB_DIR"] = ""
+os.environ.pop("SEMANTIC_CACHE_PATH", None)
+os.environ.pop("QUERY_LOG_PATH", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import app
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic bag-of-words vectors, so tests need no model download."""
+
+    def __init__(self, size=384):
+        self.size = size
+        self.embedded = []  # every text passed to embed_documents
+
+    def vector(self, text):
+        v = np.zeros(self.size, dtype="float32")
+        for word in re.findall(r"\w+", text.lower()):
+            v[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.size] += 1
+        norm = np.linalg.norm(v)
+        return (v / norm if norm else v).tolist()
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [self.vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self.vector(text)
+
+
+@pytest.fixture
+def embeddings():
+    return HashEmbeddings()
+
+
+@pytest.fixture
+def index_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "INDEX_PATH", str(tmp_path / "faiss_index"))
+    os.makedirs(app.INDEX_PATH)
+    return app.INDEX_PATH
+
+
+@pytest.fixture
+def make_doc():
+    def make(university, topic, text):
+        return Document(
+            page_content=f"University: {university}\nTopic: {topic}\n\n{text}",
+            metadata={"university": university, "topic": topic},
+        )
+
+    return make
@@ -0,0 +1,105 @@
+import threading
+
+import numpy as np
+import pytest
+
+import app
+
+
+def cache(**options):
+    return app.SemanticCache(**{"threshold": 0.95, "max_entries": 10, "ttl_seconds": 3600, **options})
+
+
+def vector(*values):
+    return np.asarray(values + (0.0,) * (4 - len(values)), dtype="float32")
+
+
+def test_close_questions_hit_and_distant_ones_miss():
+    answers = cache()
+    answers.store(vector(1, 0), "NUST fee", "PKR 171,000", ["NUST"])
+
+    assert answers.lookup(vector(1, 0.1), ["NUST"]) == "PKR 171,000"
+    assert answers.lookup(vector(0, 1), ["NUST"]) is None
+    assert (answers.hits, answers.misses) == (1, 1)
+
+
+def test_answers_are_not_shared_across_scopes():
+    answers = cache()
+    answers.store(vector(1, 0), "NUST fee", "PKR 171,000", ["NUST"])
+
+    assert answers.lookup(vector(1, 0), ["UET Lahore"]) is None
+    assert answers.lookup(vector(1, 0), []) is None
+    assert answers.lookup(vector(1, 0), ["NUST"]) == "PKR 171,000"
+
+
+def test_closest_answer_in_scope_wins():
+    answers = cache(threshold=0.8)
+    answers.store(vector(1, 0), "NUST fee", "NUST answer", ["NUST"])
+    answers.store(vector(1, 0.2), "UET fee", "UET answer", ["UET Lahore"])
+
+    assert answers.lookup(vector(1, 0.2), ["NUST"]) == "NUST answer"
+
+
+def test_expired_and_least_recently_used_answers_are_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, "time", lambda: now[0])
+    answers = cache(max_entries=2, ttl_seconds=60)
+    answers.store(vector(1), "a", "A")
+    answers.store(vector(0, 1), "b", "B")
+    answers.lookup(vector(1))            # "a" is now the most recently used
+    answers.store(vector(0, 0, 1), "c", "C")
+
+    assert answers.lookup(vector(0, 1)) is None
+    assert answers.lookup(vector(1)) == "A"
+    now[0] += 61
+    assert answers.lookup(vector(1)) is None
+
+
+def test_invalidate_drops_answers_of_changed_universities():
+    answers = cache()
+    answers.store(vector(1), "NUST fee", "N", ["NUST"])
+    answers.store(vector(0, 1), "UET fee", "U", ["UET Lahore"])
+    answers.store(vector(0, 0, 1), "fees", "all", [])
+
+    assert answers.invalidate(["NUST"]) == 2
+    assert answers.lookup(vector(0, 1), ["UET Lahore"]) == "U"
+
+
+class OneTokenLLM:
+    def stream(self, prompt):
+        yield app.StreamEvent("An answer.", None, "fake")
+
+
+@pytest.fixture
+def serving(embeddings, index_path, make_doc, monkeypatch):
+    documents = [make_doc("NUST", "hostels", "Hostels are available for men and women.")]
+    monkeypatch.setattr(app, "live_index", app.build_partitions(embeddings, documents))
+    monkeypatch.setattr(app, "embeddings", embeddings)
+    monkeypatch.setattr(app, "llm", OneTokenLLM())
+    for name in ("intent_router", "coalescer", "reranker"):
+        monkeypatch.setattr(app, name, None)
+    ready = threading.Event()
+    ready.set()
+    monkeypatch.setattr(app, "startup_ready", ready)
+    answers = cache()
+    monkeypatch.setattr(app, "answer_cache", answers)
+    return answers
+
+
+def test_answers_without_conversation_are_cached(serving):
+    assert list(app.chat("Tell me about hostels at NUST", []))[-1] == "An answer."
+
+    assert serving.stats()["entries"] == 1
+    assert list(app.chat("Tell me about hostels at NUST", [])) == ["An answer."]
+    assert serving.hits == 1
+
+
+def test_answers_shaped_by_a_conversation_are_not_cached(serving):
+    history = [
+        {"role": "user", "content": "I am a girl from Lahore with 70% marks."},
+        {"role": "assistant", "content": "Noted."},
+    ]
+
+    assert list(app.chat("Tell me about hostels at NUST", history))[-1] == "An answer."
+
+    assert serving.stats()["entries"] == 0
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+
+def record(item_id, status, answer="an answer"):
+    return {"id": item_id, "question": f"question {item_id}", "answer": answer, "status": status,
+            "sources": "", "error": "", "ms": 1.0}
+
+
+@pytest.mark.parametrize("name", ["answers.jsonl", "answers.csv"])
+def test_resumed_output_skips_only_finished_ids(tmp_path, name):
+    path = str(tmp_path / name)
+    output = app.BulkOutput(path)
+    output.write(record("1", "ok"))
+    output.write(record("2", "error", answer=""))
+    output.write(record("3", "fact_table"))
+    output._file.close()  # interrupted: close() never ran
+
+    output = app.BulkOutput(path)
+
+    assert [output.done(item_id) for item_id in ("1", "2", "3", "4")] == [True, False, True, False]
+
+
+def test_interrupted_last_line_is_ignored(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    path.write_text(json.dumps(record("1", "ok")) + "\n" + '{"id": "2", "stat')
+
+    output = app.BulkOutput(str(path))
+    output.write(record("2", "ok"))
+    output._file.close()
+
+    assert [json.loads(line)["id"] for line in path.read_text().splitlines()] == ["1", "2"]
+
+
+def test_close_keeps_the_last_record_per_id_in_input_order(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    output = app.BulkOutput(str(path))
+    output.write(record("b", "error", answer=""))
+    output.write(record("a", "ok"))
+    output.write(record("b", "ok", answer="second try"))
+
+    output.close(["a", "b"])
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(r["id"], r["answer"]) for r in records] == [("a", "an answer"), ("b", "second try")]
+
+
+class SlowBackend:
+    def __init__(self, delay):
+        self.name = "fake"
+        self.delay = delay
+        self.breaker = app.CircuitBreaker(threshold=3, cooldown=60)
+
+    async def astream(self, prompt, timeout, options):
+        await asyncio.sleep(self.delay)
+        yield app.StreamEvent("An answer.", None, self.name)
+
+
+@pytest.fixture
+def bulk(embeddings, monkeypatch):
+    fresh = app.Metrics()
+    fresh._meta = dict(app.metrics._meta)
+    monkeypatch.setattr(app, "metrics", fresh)
+    monkeypatch.setattr(app, "embeddings", embeddings)
+    monkeypatch.setattr(app, "answer_cache", None)
+    monkeypatch.setattr(app, "intent_router", None)
+    monkeypatch.setattr(app, "retrieve_batch", lambda vectors, *args: [[([], app.RETRIEVAL_K)] for _ in vectors])
+    monkeypatch.setattr(app, "llm", SimpleNamespace(backends=[SlowBackend(0.05)]))
+
+    def run(items, path, **options):
+        async def collect():
+            return [r async for r in app.answer_questions(items, str(path), **options)]
+
+        return asyncio.run(collect())
+
+    return run
+
+
+def gauge(name):
+    return app.metrics._values.get((name, ()), 0.0)
+
+
+def test_bulk_jobs_stay_out_of_chat_latency(bulk, tmp_path):
+    app.LATENCY_LOG.clear()
+    items = [(str(i), f"What is question {i} about?") for i in range(3)]
+
+    records = bulk(items, tmp_path / "answers.jsonl", concurrency=1)
+
+    assert [r["status"] for r in records] == ["ok"] * 3
+    assert list(app.LATENCY_LOG) == []
+    assert gauge("universe_pk_requests_in_flight") == 0
+    assert gauge("universe_pk_bulk_jobs_in_flight") == 0
+    assert ("universe_pk_requests_total", (("path", "bulk"), ("status", "ok"))) in app.metrics._values
+
+
+def test_waiting_for_an_llm_slot_is_not_request_time(bulk, tmp_path):
+    items = [(str(i), f"What is question {i} about?") for i in range(4)]
+
+    records = bulk(items, tmp_path / "answers.jsonl", concurrency=1)
+
+    # One at a time, the last answer waits for three others, but its own
+    # time is still about one LLM call.
+    assert max(r["ms"] for r in records) < 150
+
+
+def test_bulk_trace_leaves_out_waits():
+    trace = app.BulkTrace("question")
+    started = trace.started
+
+    trace.waited("queue", time.perf_counter() - 1.0)
+
+    assert trace.stages_ms["queue"] >= 1000
+    assert trace.started - started >= 1.0
+    trace.finish("ok")
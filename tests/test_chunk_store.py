@@ -0,0 +1,93 @@
+import os
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+import app
+
+
+def write(path, texts):
+    docs = [Document(page_content=text, metadata={"topic": f"t{i}"}) for i, text in enumerate(texts)]
+    app.write_chunk_store(str(path), [f"id-{i}" for i in range(len(docs))], docs)
+    return app.ChunkStore(str(path))
+
+
+def test_at_reads_positions_in_order(tmp_path):
+    store = write(tmp_path / "chunks.sqlite", ["zero", "one", "two"])
+
+    docs = store.at([2, -1, 0, 2])
+
+    assert [doc and doc.page_content for doc in docs] == ["two", None, "zero", "two"]
+    assert docs[0].id == "id-2"
+    assert docs[0].metadata == {"topic": "t2"}
+
+
+def test_at_reads_more_positions_than_one_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "SQL_BATCH", 2)
+    store = write(tmp_path / "chunks.sqlite", [f"chunk {i}" for i in range(5)])
+
+    assert [doc.page_content for doc in store.at([4, 3, 2, 1, 0])] == [f"chunk {i}" for i in range(4, -1, -1)]
+
+
+def test_postings_read_all_terms_at_once(tmp_path):
+    store = write(tmp_path / "chunks.sqlite", ["NET fees", "GAT fees"])
+
+    postings = store.postings.get_many(["fees", "net", "hostel"])
+
+    assert set(postings) == {"fees", "net"}
+    assert list(postings["fees"][0]) == [0, 1]
+    assert store.postings.get("hostel") is None
+
+
+def test_threads_read_through_their_own_connections(tmp_path):
+    store = write(tmp_path / "chunks.sqlite", [f"chunk {i}" for i in range(50)])
+    results, connections = {}, []
+
+    def read(n):
+        results[n] = [doc.page_content for doc in store.at(range(n, 50, 7))]
+        connections.append(store._thread_connection())
+
+    threads = [threading.Thread(target=read, args=(n,)) for n in range(7)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {n: [f"chunk {i}" for i in range(n, 50, 7)] for n in range(7)}
+    assert len({id(connection) for connection in connections}) == 7
+
+
+def test_store_keeps_reading_its_file_after_it_is_replaced(tmp_path):
+    path = tmp_path / "chunks.sqlite"
+    store = write(path, ["old"])
+
+    write(path, ["new"])
+    docs = []
+    thread = threading.Thread(target=lambda: docs.extend(store.at([0])))
+    thread.start()
+    thread.join()
+
+    assert docs[0].page_content == "old"
+    assert app.ChunkStore(str(path)).at([0])[0].page_content == "new"
+
+
+def test_search_matches_the_in_memory_store(embeddings, index_path, make_doc):
+    documents = [
+        make_doc("NUST", "fees", "BS fees: PKR 100,000 per semester. Hostel fees are extra."),
+        make_doc("NUST", "undergraduate admissions", "Admission is through the NET entry test."),
+        make_doc("NUST", "phd admissions", "PhD applicants need a 3.0 CGPA and GAT Subject."),
+    ]
+    path = os.path.join(index_path, "nust")
+    built = app.build_vectorstore(embeddings, documents, path)
+    loaded = app.load_vectorstore(path, embeddings)
+    assert isinstance(loaded.docstore, app.ChunkStore)
+
+    def results(store, question, topics):
+        snapshot = app.IndexSnapshot({"NUST": store}, {"NUST": app.build_lexical_index(store)}, {})
+        vector = np.asarray(embeddings.embed_query(question), dtype="float32")
+        dense, lexical = app.search_partition(snapshot, "NUST", vector, question, 2, topics)
+        return [doc.id for doc, _ in dense], [doc.id for doc, _ in lexical]
+
+    for question, topics in [("What is the NET?", []), ("hostel fees", ["fees"]), ("GAT for PhD", ["phd admissions"])]:
+        assert results(loaded, question, topics) == results(built, question, topics)
@@ -0,0 +1,93 @@
+import pytest
+from langchain_core.documents import Document
+
+import app
+
+FEES = """University: NUST
+Topic: Fees
+
+BS Program Fees (per semester):
+- Engineering: PKR 171,000
+- Computing: PKR 171,000
+- Business: PKR 150,000
+
+MS Program Fees (per semester):
+- Engineering: PKR 110,000
+- Business: PKR 125,000
+
+Hostel charges are paid separately each semester, and mess charges are billed monthly by the hostel office."""
+
+
+def document(text=FEES, **metadata):
+    return Document(page_content=text, metadata=metadata or {"university": "NUST", "topic": "fees"})
+
+
+def test_sections_start_at_blank_lines_and_labels():
+    text = "Intro line.\nEligibility for BS Programs:\n- 60% in FSc\n- NET\n\nClosing paragraph."
+
+    assert app.StructuredSplitter.sections(text) == [
+        "Intro line.", "Eligibility for BS Programs:\n- 60% in FSc\n- NET", "Closing paragraph.",
+    ]
+
+
+def test_list_items_ending_in_a_colon_are_not_labels():
+    assert app.StructuredSplitter.sections("Programs:\n- BS CS:\n- BE EE:") == ["Programs:\n- BS CS:\n- BE EE:"]
+
+
+def test_every_chunk_starts_with_its_title():
+    chunks = app.StructuredSplitter(chunk_size=200, min_chars=40).split_documents([document()])
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.page_content.startswith("[NUST | Fees]\n")
+        assert "University:" not in chunk.page_content
+        assert chunk.metadata == {"university": "NUST", "topic": "fees"}
+    assert chunks[0].page_content.splitlines()[1] == "BS Program Fees (per semester):"
+
+
+def test_title_falls_back_to_metadata():
+    chunks = app.StructuredSplitter().split_documents([document("Hostels:\n- Separate for women")])
+
+    assert chunks[0].page_content == "[NUST | fees]\nHostels:\n- Separate for women"
+
+
+@pytest.mark.parametrize("chunk_size", [120, 200, 600])
+def test_chunks_fit_chunk_size(chunk_size):
+    chunks = app.StructuredSplitter(chunk_size=chunk_size, min_chars=40).split_documents([document()])
+
+    assert all(len(chunk.page_content) <= chunk_size for chunk in chunks)
+
+
+def test_small_sections_join_the_one_before():
+    splitter = app.StructuredSplitter(chunk_size=600, min_chars=160)
+
+    assert splitter.split_text("Short one.\n\nShort two.\n\nShort three.") == ["Short one.\n\nShort two.\n\nShort three."]
+
+
+def test_oversized_sections_repeat_their_label():
+    section = "BS Program Fees (per semester):\n" + "\n".join(f"- Program {i}: PKR {i},000" for i in range(20))
+
+    pieces = app.StructuredSplitter(chunk_size=150, min_chars=40).split_text(section)
+
+    assert len(pieces) > 1
+    assert pieces[0].startswith("BS Program Fees (per semester):\n")
+    assert all(piece.startswith("BS Program Fees (per semester) (continued):\n") for piece in pieces[1:])
+    assert all(len(piece) <= 150 for piece in pieces)
+
+
+def test_make_splitter_chooses_the_chunker():
+    assert isinstance(app.make_splitter("structured"), app.StructuredSplitter)
+    assert not isinstance(app.make_splitter("recursive"), app.StructuredSplitter)
+    with pytest.raises(ValueError, match="Unknown CHUNKER"):
+        app.make_splitter("sentences")
+
+
+def test_packer_shows_the_title_once():
+    docs = app.StructuredSplitter(chunk_size=200, min_chars=40).split_documents([document()])
+    docs = [Document(id=f"fees-{i}", page_content=d.page_content, metadata=d.metadata) for i, d in enumerate(docs)]
+
+    context, _ = app.assemble_context(docs, budget=1000)
+
+    assert context.startswith("[NUST | Fees]\n")
+    assert context.count("[NUST | Fees]") == 1
+    assert "PKR 125,000" in context
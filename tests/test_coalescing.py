@@ -0,0 +1,125 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+PROMPT = SimpleNamespace(tokens=100)
+
+
+class GatedLLM:
+    """Streams `tokens` once `gate` is set, counting upstream calls."""
+
+    def __init__(self, tokens=("Hello", " there"), error=None):
+        self.tokens = tokens
+        self.error = error
+        self.calls = 0
+        self.closed = False
+        self.gate = threading.Event()
+
+    def _events(self):
+        for token in self.tokens:
+            yield app.StreamEvent(token, None, "fake")
+        if self.error is not None:
+            raise self.error
+
+    def stream(self, prompt):
+        self.calls += 1
+        self.gate.wait(5)
+        try:
+            yield from self._events()
+        finally:
+            self.closed = True
+
+    async def astream(self, prompt):
+        self.calls += 1
+        while not self.gate.is_set():
+            await asyncio.sleep(0.001)
+        for event in self._events():
+            yield event
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    fake = GatedLLM()
+    monkeypatch.setattr(app, "llm", fake)
+    return fake
+
+
+def text(events):
+    return "".join(event.text for event in events)
+
+
+def test_identical_async_requests_share_one_completion(llm):
+    flights = app.SingleFlight()
+
+    async def ask(key):
+        return text([event async for event in flights.astream(key, PROMPT)])
+
+    async def main():
+        tasks = [asyncio.create_task(ask("same")) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        assert flights.in_flight() == 1
+        llm.gate.set()
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(main()) == ["Hello there"] * 5
+    assert llm.calls == 1
+    assert flights.in_flight() == 0
+
+
+def test_different_keys_do_not_share(llm):
+    flights = app.SingleFlight()
+    llm.gate.set()
+
+    assert text(flights.stream("a", PROMPT)) == text(flights.stream("b", PROMPT)) == "Hello there"
+    assert llm.calls == 2
+
+
+def test_sync_followers_replay_from_the_start(llm):
+    flights = app.SingleFlight()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(text(flights.stream("k", PROMPT)))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    llm.gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ["Hello there"] * 3
+    assert llm.calls == 1
+
+
+def test_upstream_error_reaches_every_follower(monkeypatch):
+    failing = GatedLLM(error=RuntimeError("upstream failed"))
+    monkeypatch.setattr(app, "llm", failing)
+    flights = app.SingleFlight()
+
+    async def ask():
+        return text([event async for event in flights.astream("k", PROMPT)])
+
+    async def main():
+        tasks = [asyncio.create_task(ask()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        failing.gate.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) and str(r) == "upstream failed" for r in results)
+    assert failing.calls == 1
+    assert flights.in_flight() == 0
+
+
+def test_flight_is_abandoned_when_everyone_leaves(llm):
+    flights = app.SingleFlight()
+    stream = flights.stream("k", PROMPT)
+    llm.gate.set()
+    assert next(stream).text == "Hello"
+    stream.close()
+
+    assert flights.in_flight() == 0
+    # A later identical question starts a fresh completion.
+    assert text(flights.stream("k", PROMPT)) == "Hello there"
+    assert llm.calls == 2
@@ -0,0 +1,75 @@
+from langchain_core.documents import Document
+
+import app
+
+
+def chunk(source, number, text, **metadata):
+    return Document(id=f"{source}-{number}", page_content=text, metadata=metadata)
+
+
+def test_strip_overlap_removes_repeated_text():
+    previous = "Eligibility:\n- Minimum 60% marks in FSc\n- NET is mandatory"
+    following = "- NET is mandatory\n- Admissions once a year"
+
+    assert app.strip_overlap(previous, following) == "\n- Admissions once a year"
+
+
+def test_strip_overlap_without_shared_text_keeps_a_paragraph_break():
+    assert app.strip_overlap("First paragraph.", "Second paragraph.") == "\n\nSecond paragraph."
+
+
+def test_adjacent_chunks_are_merged_under_one_header():
+    docs = [
+        chunk("abc", 1, "University: NUST\nTopic: Fees\n- NET is mandatory\n- Admissions once a year"),
+        chunk("abc", 0, "University: NUST\nTopic: Fees\nEligibility:\n- Minimum 60% marks\n- NET is mandatory"),
+    ]
+
+    context, stats = app.assemble_context(docs, budget=1000)
+
+    assert context == (
+        "[NUST | Fees]\nEligibility:\n- Minimum 60% marks\n- NET is mandatory\n- Admissions once a year"
+    )
+    assert (stats["chunks"], stats["sections"]) == (2, 1)
+
+
+def test_gaps_between_chunks_are_marked():
+    docs = [chunk("abc", 0, "University: NUST\nTopic: Fees\nfirst part"), chunk("abc", 2, "third part")]
+
+    context, _ = app.assemble_context(docs, budget=1000)
+
+    assert context == "[NUST | Fees]\nfirst part\n…\nthird part"
+
+
+def test_sections_follow_retrieval_rank():
+    docs = [
+        chunk("qau", 0, "fee text", university="QAU", topic="fees"),
+        chunk("nust", 0, "fee text too", university="NUST", topic="fees"),
+        chunk("qau", 1, "more QAU"),
+    ]
+
+    context, _ = app.assemble_context(docs, budget=1000)
+
+    assert context.index("[QAU | fees]") < context.index("[NUST | fees]")
+    assert "more QAU" in context.split("[NUST | fees]")[0]
+
+
+def test_all_partition_is_not_a_title():
+    docs = [chunk("cmp", 0, "Topic: Fee comparison\nNUST is the most expensive.", university="All")]
+
+    context, _ = app.assemble_context(docs, budget=1000)
+
+    assert context.startswith("[Fee comparison]\n")
+
+
+def test_budget_drops_or_truncates_sections():
+    lines = "\n".join(f"- line {i} " + "x" * 30 for i in range(20))
+    docs = [
+        chunk("a", 0, f"University: NUST\nTopic: Fees\n{lines}"),
+        chunk("b", 0, "University: QAU\nTopic: Fees\nshort"),
+    ]
+
+    context, stats = app.assemble_context(docs, budget=100)
+
+    assert app.count_tokens(context) <= 100
+    assert stats["truncated"] and stats["dropped_sections"] == 1
+    assert context.startswith("[NUST | Fees]\n- line 0")
@@ -0,0 +1,116 @@
+import pytest
+
+import app
+
+FEES_AT_NUST = [
+    ("user", "What are the fees at NUST?"),
+    ("assistant", "BS fees at NUST are PKR 171,000 per semester."),
+]
+
+
+def rewrite(question, messages=FEES_AT_NUST):
+    return app.rewrite_query(question, messages)
+
+
+def test_history_messages_reads_dicts_and_legacy_pairs():
+    history = [
+        {"role": "user", "content": "NUST fees?"},
+        {"role": "assistant", "content": [{"type": "text", "text": "PKR 171,000"}]},
+        {"role": "user", "content": ""},
+        ["UET fees?", "PKR 90,000"],
+    ]
+
+    assert app.history_messages(history) == [
+        ("user", "NUST fees?"), ("assistant", "PKR 171,000"), ("user", "UET fees?"), ("assistant", "PKR 90,000"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "question, query",
+    [
+        ("What are its hostel charges?", "What are NUST's hostel charges?"),
+        ("Does it offer scholarships?", "Does NUST offer scholarships?"),
+        ("Is that university good for CS?", "Is NUST good for CS?"),
+    ],
+)
+def test_pronouns_name_the_previous_university(question, query):
+    assert rewrite(question) == (query, "heuristic")
+
+
+def test_is_there_is_not_a_reference():
+    assert rewrite("Is there a hostel?") == ("Is there a hostel? (NUST)", "heuristic")
+    assert rewrite("Are there scholarships there?") == ("Are there scholarships NUST?", "heuristic")
+
+
+def test_what_about_repeats_the_previous_question():
+    assert rewrite("what about COMSATS?") == ("What are the fees at COMSATS?", "heuristic")
+    assert rewrite("What about UET and QAU?") == ("What are the fees at UET Lahore and QAU?", "heuristic")
+
+
+def test_and_for_keeps_the_previous_topic():
+    assert rewrite("and for PhD?") == ("and for PhD? (NUST, fees)", "heuristic")
+
+
+def test_standalone_questions_are_left_alone():
+    assert rewrite("What is the minimum CGPA for PhD at COMSATS?") == (
+        "What is the minimum CGPA for PhD at COMSATS?", None,
+    )
+    assert rewrite("What are its fees?", []) == ("What are its fees?", None)
+
+
+class FakeRewriter:
+    def __init__(self, text=None):
+        self.text = text
+
+    def stream(self, prompt, **options):
+        if self.text is None:
+            raise TimeoutError("rewrite model is slow")
+        yield app.StreamEvent(self.text, None, "fake")
+
+
+def test_model_rewrites_followups_and_heuristics_cover_its_failures(monkeypatch):
+    monkeypatch.setattr(app, "rewrite_llm", FakeRewriter('"What are the hostel charges at NUST?"'))
+    assert rewrite("What are its hostel charges?") == ("What are the hostel charges at NUST?", "model")
+
+    monkeypatch.setattr(app, "rewrite_llm", FakeRewriter())
+    assert rewrite("What are its hostel charges?") == ("What are NUST's hostel charges?", "heuristic")
+
+
+def long_conversation(turns=30):
+    messages = []
+    for i in range(turns):
+        messages.append(("user", f"What are the fees at NUST and COMSATS for program {i}? " + "detail " * 30))
+        messages.append(("assistant", "answer " * 200))
+    return messages
+
+
+def test_short_conversations_are_kept_verbatim():
+    assert app.conversation_memory(FEES_AT_NUST) == (
+        "Student: What are the fees at NUST?\nAssistant: BS fees at NUST are PKR 171,000 per semester."
+    )
+    assert app.conversation_memory(FEES_AT_NUST, budget=0) == ""
+
+
+@pytest.mark.parametrize("budget", [20, 21, 34, 60, 150, 400, 1000])
+def test_memory_stays_within_its_budget(budget):
+    memory = app.conversation_memory(long_conversation(), budget=budget)
+
+    assert memory
+    assert app.count_tokens(memory) <= budget
+
+
+def test_older_turns_are_summarised():
+    memory = app.conversation_memory(long_conversation(), budget=400)
+
+    assert memory.startswith("Earlier: Student asked: ")
+    assert "Universities discussed: COMSATS, NUST." in memory.splitlines()[0]
+    assert memory.splitlines()[-1].startswith("Assistant: answer")
+    assert "program 29" in memory
+
+
+def test_compact_turns_keeps_the_newest_questions():
+    summary = app.compact_turns(long_conversation(5), budget=60)
+
+    assert "program 4" in summary and "program 0" not in summary
+    assert app.count_tokens(summary) <= 60
+    assert app.compact_turns(long_conversation(5), budget=2) == ""
@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+import embedding_server
+
+
+@pytest.fixture
+def address(tmp_path):
+    address = str(tmp_path / "embeddings.sock")
+    embed = lambda texts: [[float(len(text))] for text in texts]
+    threading.Thread(
+        target=embedding_server.serve_embeddings, args=(embed, None, address), daemon=True
+    ).start()
+    return address
+
+
+def test_client_embeds_through_the_server(address):
+    client = embedding_server.connect_embeddings(address, timeout=10)
+
+    assert client.embed_documents(["a", "abc"]) == [[1.0], [3.0]]
+    assert client.embed_query("ab") == [2.0]
+
+
+def test_errors_are_sent_back_to_the_client(address):
+    client = embedding_server.connect_embeddings(address, timeout=10)
+
+    with pytest.raises(RuntimeError, match="RERANK_ENABLED"):
+        embedding_server.RemoteCrossEncoder(address).predict([("question", "chunk")])
+    with pytest.raises(RuntimeError, match="unknown operation 'translate'"):
+        client.call("translate", ["text"])
+    assert client.embed_query("abcd") == [4.0]
+
+
+def test_server_outlives_a_client_that_goes_away(address):
+    client = embedding_server.connect_embeddings(address, timeout=10)
+    connection = client._local.connection
+    connection.send(("translate", ["text"]))
+    connection.close()  # gone before the reply
+
+    replies = []
+    check = threading.Thread(
+        target=lambda: replies.append(embedding_server.connect_embeddings(address, timeout=10).embed_query("abc")),
+        daemon=True,
+    )
+    check.start()
+    check.join(10)
+    assert replies == [[3.0]]
+
+
+@pytest.mark.parametrize("request_", ["garbage", ("embed", 5), ("embed", ["a"], "extra")])
+def test_malformed_requests_get_an_error(address, request_):
+    client = embedding_server.connect_embeddings(address, timeout=10)
+    connection = client._local.connection
+
+    replies = []
+
+    def ask():
+        connection.send(request_)
+        replies.append(connection.recv())
+        replies.append(client.embed_query("abc"))
+
+    check = threading.Thread(target=ask, daemon=True)
+    check.start()
+    check.join(10)
+    assert replies[0][0] == "error" and "malformed request" in replies[0][1]
+    assert replies[1] == [3.0]
+
+
+def test_server_address():
+    assert embedding_server.server_address("localhost:7000") == ("localhost", 7000)
+    assert embedding_server.server_address("/tmp/embeddings.sock") == "/tmp/embeddings.sock"
@@ -0,0 +1,87 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(scope="module")
+def table():
+    return app.build_fact_table(app.builtin_documents())
+
+
+@pytest.fixture
+def answer(table, monkeypatch):
+    monkeypatch.setattr(app, "fact_table", table)
+    return lambda question: app.answer_from_facts(question, app.analyze_query(question))
+
+
+def test_fee_rows_are_extracted(table):
+    rows = [table.row(i) for i in table.select(kind="fee", university="NUST", level="BS")]
+    cs = next(row for row in rows if row["program_group"] == "Computer Science / IT")
+
+    assert (cs["fee_min"], cs["fee_max"]) == (145000, 175000)
+    assert len(rows) == 4
+
+
+def test_eligibility_rows_are_extracted(table):
+    [phd] = [table.row(i) for i in table.select(kind="eligibility", university="COMSATS", level="PhD")]
+    [bs] = [table.row(i) for i in table.select(kind="eligibility", university="NUST", level="BS")]
+
+    assert phd["min_cgpa"] == 3.0
+    assert bs["min_marks"] == 60
+    assert bs["test"] == "NET"
+
+
+def test_fee_question_for_one_program(answer):
+    reply = answer("What is the fee for BS CS at NUST?")
+
+    assert "Computer Science / IT: PKR 145,000 – PKR 175,000" in reply
+    assert "Engineering" not in reply
+
+
+def test_fee_comparison(answer):
+    reply = answer("Compare fees of NUST and UET for BS CS")
+
+    assert "**NUST**" in reply and "**UET Lahore**" in reply
+    assert "Most affordable: **UET Lahore**" in reply
+
+
+def test_fee_comparison_of_every_university(answer):
+    reply = answer("Which university is cheapest for BS CS?")
+
+    assert all(f"**{name}**" in reply for name in ("NUST", "COMSATS", "UET Lahore", "QAU"))
+
+
+def test_fee_question_for_a_university_we_do_not_serve(answer):
+    assert answer("What is the fee for BS CS at Riphah?") is None
+    assert answer("What is the fee for BS CS?") is None
+
+
+def test_eligibility_question(answer):
+    assert "minimum 3.0 CGPA" in answer("minimum CGPA for PhD at COMSATS")
+    assert "test: NET" in answer("Which entry test is required for BE at NUST?")
+
+
+def test_unknown_program_falls_back_to_rag(answer):
+    assert answer("What is the fee of MBBS at NUST?") is None
+    assert answer("What is the BS Pharmacy fee at NUST?") is None
+    assert answer("fees for BS Karachi campus NUST") is None
+
+
+def test_the_word_be_is_not_a_degree(answer):
+    assert answer("What will be the MS fee at NUST?") == answer("What is the MS fee at NUST?")
+    assert "MS/MPhil" in answer("What will be the MS fee at NUST?")
+    assert answer("what will be the fee at NUST?") == answer("what is the fee at NUST?")
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "What are the scholarships and fees at NUST?",     # blocked topic
+        "What is the fee and minimum CGPA for MS at NUST?",  # mixed question
+        "What is the BS and MS fee at NUST?",              # two levels
+        "minimum CGPA for PhD",                            # no university
+        "Tell me about NUST",                              # neither fees nor eligibility
+    ],
+)
+def test_questions_the_table_cannot_answer(answer, question):
+    assert answer(question) is None
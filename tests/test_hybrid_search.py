@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from langchain_core.documents import Document
+
+import app
+
+
+def docs(*ids):
+    return [Document(id=doc_id, page_content=doc_id) for doc_id in ids]
+
+
+def ids(documents):
+    return [doc.id for doc in documents]
+
+
+def test_fuse_ranks_hits_found_by_both_searches_first():
+    a, b, c, d = docs("a", "b", "c", "d")
+    dense = [(a, 0.1), (b, 0.2), (c, 0.3)]
+    lexical = [(c, 9.0), (d, 5.0)]
+
+    assert ids(app.fuse(dense, lexical, 4)) == ["c", "a", "b", "d"]
+
+
+def test_fuse_uses_ranks_not_scores():
+    a, b = docs("a", "b")
+    # Same ranks, wildly different scales: the result must not change.
+    assert ids(app.fuse([(a, 0.1), (b, 0.2)], [], 2)) == ids(app.fuse([(a, 100.0), (b, 900.0)], [], 2))
+
+
+def test_fuse_keeps_k_and_dedupes():
+    a, b, c = docs("a", "b", "c")
+    fused = app.fuse([(a, 0.1), (b, 0.2), (c, 0.3)], [(a, 3.0), (b, 2.0)], 2)
+
+    assert ids(fused) == ["a", "b"]
+
+
+def test_lexical_index_finds_exact_tokens():
+    index = app.LexicalIndex.build(
+        ["BS fees PKR 100,000", "Entry test: NET for all BE programs", "PhD needs GAT Subject"]
+    )
+
+    assert [position for position, _ in index.ranked("Is the NET required?")] == [1]
+    assert [position for position, _ in index.ranked("PhD fees")] in ([0, 2], [2, 0])
+    assert index.ranked("hostel") == []
+
+
+def test_lexical_ranking_keeps_the_best():
+    index = app.LexicalIndex.build(["fees", "fees fees hostel", "hostel"])
+
+    ranked = index.ranked("hostel fees", limit=2)
+
+    assert [position for position, _ in ranked] == [1, 0]
+    assert ranked[0][1] > ranked[1][1]
+
+
+class SlowCrossEncoder:
+    def predict(self, pairs, **options):
+        time.sleep(0.05)
+        return [float(len(text)) for _, text in pairs]
+
+
+class OneTokenLLM:
+    def stream(self, prompt):
+        yield app.StreamEvent("An answer.", None, "fake")
+
+    async def astream(self, prompt):
+        yield app.StreamEvent("An answer.", None, "fake")
+
+
+@pytest.mark.parametrize("path", ["sync", "async"])
+def test_rerank_time_is_not_search_time(path, embeddings, index_path, make_doc, monkeypatch):
+    documents = [make_doc("NUST", f"topic {i}", f"Campus life note {i}. " * (i + 1)) for i in range(6)]
+    monkeypatch.setattr(app, "live_index", app.build_partitions(embeddings, documents))
+    monkeypatch.setattr(app, "embeddings", embeddings)
+    monkeypatch.setattr(app, "reranker", app.Reranker(SlowCrossEncoder()))
+    monkeypatch.setattr(app, "llm", OneTokenLLM())
+    for name in ("answer_cache", "intent_router", "coalescer"):
+        monkeypatch.setattr(app, name, None)
+    ready = threading.Event()
+    ready.set()
+    monkeypatch.setattr(app, "startup_ready", ready)
+    traces = []
+
+    class Trace(app.RequestTrace):
+        def __init__(self, *args):
+            super().__init__(*args)
+            traces.append(self)
+
+    monkeypatch.setattr(app, "RequestTrace", Trace)
+
+    question = "Tell me about campus life at NUST"
+    if path == "sync":
+        replies = list(app.chat(question, []))
+    else:
+        async def collect():
+            return [reply async for reply in app.achat(question, [])]
+
+        replies = asyncio.run(collect())
+
+    assert replies[-1] == "An answer."
+    stages = traces[0].stages_ms
+    assert stages["rerank"] >= 50
+    assert stages["search"] < 50
+    assert {"route", "route_centroid"} <= stages.keys()
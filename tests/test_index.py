@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import app
+
+
+def build(embeddings, documents, index_path):
+    return app.build_vectorstore(embeddings, documents, os.path.join(index_path, "nust"))
+
+
+def corpus(make_doc, fee_text="BS fees: PKR 100,000 per semester."):
+    return [
+        make_doc("NUST", "fees", fee_text),
+        make_doc("NUST", "phd admissions", "PhD applicants need a 3.0 CGPA and GAT Subject."),
+    ]
+
+
+def test_first_build_writes_a_manifest(embeddings, index_path, make_doc):
+    store = build(embeddings, corpus(make_doc), index_path)
+
+    manifest = app.read_manifest(os.path.join(index_path, "nust"))
+    assert manifest["settings"] == app.index_settings()
+    assert set(manifest["documents"]) == {"NUST::fees", "NUST::phd admissions"}
+    chunk_ids = [i for entry in manifest["documents"].values() for i in entry["chunk_ids"]]
+    assert store.index.ntotal == len(chunk_ids)
+
+
+def test_unchanged_documents_are_not_reembedded(embeddings, index_path, make_doc):
+    build(embeddings, corpus(make_doc), index_path)
+    embeddings.embedded.clear()
+
+    store = build(embeddings, corpus(make_doc), index_path)
+
+    assert embeddings.embedded == []
+    assert store.index.ntotal > 0
+
+
+def test_only_changed_document_is_reembedded(embeddings, index_path, make_doc):
+    build(embeddings, corpus(make_doc), index_path)
+    old = app.read_manifest(os.path.join(index_path, "nust"))["documents"]
+    embeddings.embedded.clear()
+
+    store = build(embeddings, corpus(make_doc, "BS fees: PKR 120,000 per semester."), index_path)
+
+    assert embeddings.embedded and all("120,000" in text for text in embeddings.embedded)
+    new = app.read_manifest(os.path.join(index_path, "nust"))["documents"]
+    assert new["NUST::phd admissions"] == old["NUST::phd admissions"]
+    assert new["NUST::fees"]["chunk_ids"] != old["NUST::fees"]["chunk_ids"]
+    texts = [store.docstore.search(store.index_to_docstore_id[i]).page_content for i in range(store.index.ntotal)]
+    assert not any("100,000" in text for text in texts)
+
+
+def test_removed_document_is_dropped(embeddings, index_path, make_doc):
+    build(embeddings, corpus(make_doc), index_path)
+
+    store = build(embeddings, corpus(make_doc)[:1], index_path)
+
+    manifest = app.read_manifest(os.path.join(index_path, "nust"))
+    assert set(manifest["documents"]) == {"NUST::fees"}
+    assert store.index.ntotal == len(manifest["documents"]["NUST::fees"]["chunk_ids"])
+
+
+def test_changed_settings_rebuild_everything(embeddings, index_path, make_doc, monkeypatch):
+    build(embeddings, corpus(make_doc), index_path)
+    embeddings.embedded.clear()
+    monkeypatch.setattr(app, "CHUNK_SIZE", app.CHUNK_SIZE + 1)
+
+    build(embeddings, corpus(make_doc), index_path)
+
+    assert any("PKR 100,000" in text for text in embeddings.embedded)
+    assert any("PhD" in text for text in embeddings.embedded)
+    assert app.read_manifest(os.path.join(index_path, "nust"))["settings"]["chunk_size"] == app.CHUNK_SIZE
+
+
+def test_partitions_reuse_unchanged_universities(embeddings, index_path, make_doc):
+    documents = corpus(make_doc) + [make_doc("QAU", "fees", "BS fees: PKR 30,000 per semester.")]
+    snapshot = app.build_partitions(embeddings, documents)
+    assert set(snapshot.partitions) == {"NUST", "QAU"}
+
+    documents[-1] = make_doc("QAU", "fees", "BS fees: PKR 35,000 per semester.")
+    updated = app.build_partitions(embeddings, documents, previous=snapshot)
+
+    assert updated.partitions["NUST"] is snapshot.partitions["NUST"]
+    assert updated.partitions["QAU"] is not snapshot.partitions["QAU"]
+
+
+def test_empty_knowledge_base_is_reported(embeddings, index_path):
+    with pytest.raises(app.EmptyKnowledgeBase, match="knowledge base is empty"):
+        app.build_partitions(embeddings, [])
+
+
+def test_partitions_build_into_a_missing_index_directory(embeddings, tmp_path, make_doc, monkeypatch):
+    index_path = str(tmp_path / "fresh" / "index")
+    monkeypatch.setattr(app, "INDEX_PATH", index_path)
+
+    snapshot = app.build_partitions(embeddings, corpus(make_doc))
+
+    assert set(snapshot.partitions) == {"NUST"}
+    assert os.path.isdir(os.path.join(index_path, "nust"))
@@ -0,0 +1,54 @@
+import app
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+
+def test_builtin_documents_are_read_from_files():
+    documents = app.builtin_documents()
+    keys = {(doc.metadata["university"], doc.metadata["topic"]) for doc in documents}
+
+    assert ("NUST", "fees") in keys and ("All", "scholarships") in keys
+    assert {doc.metadata["university"] for doc in documents} == {"COMSATS", "NUST", "UET Lahore", "QAU", "All"}
+    assert all(doc.metadata["source"].startswith(app.BUILTIN_SOURCE_PREFIX) for doc in documents)
+    assert all(app.HEADER_LINE.match(doc.page_content.splitlines()[0]) for doc in documents)
+
+
+def test_corpus_adds_valid_kb_dir_documents(tmp_path):
+    write(tmp_path / "lums" / "fees.md", "---\nuniversity: LUMS\ntopic: fees\n---\nBS fees: PKR 500,000\n")
+    write(tmp_path / "bad.md", "no front matter\n")
+    write(
+        tmp_path / "more.jsonl",
+        '{"id": "giki", "university": "GIKI", "topic": "general", "text": "GIKI is in Topi."}\n'
+        '{"id": "giki", "university": "GIKI", "topic": "general", "text": "duplicate"}\n',
+    )
+    errors = []
+
+    documents = app.load_corpus(str(tmp_path), errors)
+
+    extra = [doc for doc in documents if not doc.metadata["source"].startswith(app.BUILTIN_SOURCE_PREFIX)]
+    assert [doc.metadata["source"] for doc in extra] == ["more.jsonl#giki", "lums/fees.md"]
+    assert extra[1].page_content.startswith("University: LUMS\nTopic: fees\n\n")
+    assert len(errors) == 2
+    assert len(documents) == len(app.builtin_documents()) + 2
+
+
+def test_builtin_documents_can_be_left_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "KB_INCLUDE_BUILTIN", False)
+
+    assert app.load_corpus(str(tmp_path)) == []
+    assert app.kb_fingerprint(str(tmp_path)) == ()
+
+
+def test_description_lists_the_universities_served(tmp_path, monkeypatch):
+    for name in ("UNIVERSITY_PATTERNS", "system_prompt", "covered_universities", "fact_table", "intent_router"):
+        monkeypatch.setattr(app, name, getattr(app, name))
+    monkeypatch.setattr(app, "kb_state", dict(app.kb_state))
+    write(tmp_path / "lums" / "fees.md", "---\nuniversity: LUMS\ntopic: fees\n---\nBS fees: PKR 500,000\n")
+    assert "**Covered Universities:** COMSATS · NUST · QAU · UET Lahore\n" in app.chat_description()
+
+    app.adopt_corpus(app.load_corpus(str(tmp_path)), [], ())
+
+    assert "**Covered Universities:** COMSATS · NUST · QAU · UET Lahore · LUMS\n" in app.chat_description()
@@ -0,0 +1,149 @@
+import httpx
+import pytest
+
+import app
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(app.time, "monotonic", clock)
+    return clock
+
+
+def status_error(status, headers=None):
+    request = httpx.Request("POST", "http://llm/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return httpx.HTTPStatusError(f"{status}", request=request, response=response)
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_cooldown(clock):
+    breaker = app.CircuitBreaker(threshold=2, cooldown=10)
+    breaker.failure()
+    assert breaker.state() == "closed" and breaker.allow()
+
+    breaker.failure()
+    assert breaker.state() == "open" and not breaker.allow()
+
+    clock.now += 10
+    assert breaker.allow()             # one trial call
+    assert breaker.state() == "half_open"
+    assert not breaker.allow()         # and only one
+
+    breaker.failure()                  # the trial failed: open again
+    assert breaker.state() == "open" and not breaker.allow()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state() == "closed" and breaker.allow()
+
+
+def test_unreported_trial_does_not_block_the_next(clock):
+    breaker = app.CircuitBreaker(threshold=1, cooldown=5)
+    breaker.failure()
+    clock.now += 5
+    assert breaker.allow()
+    clock.now += 5
+    assert breaker.allow()
+
+
+@pytest.mark.parametrize(
+    "error, kind",
+    [
+        (status_error(429), "rate_limited"),
+        (status_error(500), "retryable"),
+        (status_error(503), "retryable"),
+        (status_error(408), "retryable"),
+        (status_error(400), None),
+        (status_error(401), None),
+        (httpx.ConnectError("refused"), "retryable"),
+        (httpx.ReadTimeout("slow"), "retryable"),
+        (app.LLMTimeout("deadline"), "retryable"),
+        (ValueError("bug"), None),
+    ],
+)
+def test_error_classification(error, kind):
+    assert app.llm_error_kind(error) == kind
+
+
+def test_retry_after_header():
+    assert app.retry_after(status_error(429, {"retry-after": "7"})) == 7.0
+    assert app.retry_after(status_error(429)) is None
+
+
+class FakeBackend:
+    def __init__(self, name, outcomes):
+        self.name = name
+        self.outcomes = list(outcomes)  # an exception to raise, or text to stream
+        self.calls = 0
+        self.breaker = app.CircuitBreaker(threshold=3, cooldown=60)
+
+    def stream(self, prompt, timeout, options):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        yield app.StreamEvent(outcome, None, self.name)
+
+
+def text(llm):
+    return "".join(event.text for event in llm.stream("prompt"))
+
+
+def llm_with(*backends, max_retries=2):
+    return app.ResilientLLM(list(backends), deadline=30, max_retries=max_retries, backoff_base=0, backoff_max=0)
+
+
+def test_retryable_errors_are_retried():
+    primary = FakeBackend("primary", [status_error(503), httpx.ConnectError("reset"), "answer"])
+
+    assert text(llm_with(primary)) == "answer"
+    assert primary.calls == 3
+
+
+def test_rate_limit_fails_over_to_the_fallback_at_once():
+    primary = FakeBackend("primary", [status_error(429)])
+    fallback = FakeBackend("fallback", ["fallback answer"])
+
+    assert text(llm_with(primary, fallback)) == "fallback answer"
+    assert (primary.calls, fallback.calls) == (1, 1)
+
+
+def test_bad_requests_are_not_retried_or_failed_over():
+    primary = FakeBackend("primary", [status_error(400)])
+    fallback = FakeBackend("fallback", ["never"])
+
+    with pytest.raises(httpx.HTTPStatusError):
+        text(llm_with(primary, fallback))
+    assert (primary.calls, fallback.calls) == (1, 0)
+    assert primary.breaker.state() == "closed"
+
+
+def test_exhausted_retries_raise_the_last_error():
+    primary = FakeBackend("primary", [status_error(502)] * 3)
+
+    with pytest.raises(httpx.HTTPStatusError, match="502"):
+        text(llm_with(primary))
+    assert primary.calls == 3
+    assert primary.breaker.state() == "open"
+
+
+def test_open_breaker_skips_the_backend():
+    primary = FakeBackend("primary", [])
+    for _ in range(3):
+        primary.breaker.failure()
+    fallback = FakeBackend("fallback", ["fallback answer"])
+
+    assert text(llm_with(primary, fallback)) == "fallback answer"
+    assert primary.calls == 0
+
+    with pytest.raises(app.LLMUnavailable):
+        text(llm_with(primary))
@@ -0,0 +1,85 @@
+import pytest
+from langchain_core.documents import Document
+
+import app
+
+
+def chunks(n, words=60):
+    return [
+        Document(id=f"src{i}-0", page_content=f"University: NUST\nTopic: T{i}\n" + "detail " * words, metadata={})
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    fresh = app.Metrics()
+    fresh._meta = dict(app.metrics._meta)
+    monkeypatch.setattr(app, "metrics", fresh)
+    return fresh
+
+
+def clipped(metrics, part):
+    return metrics._values.get(("universe_pk_prompt_clipped_total", (("part", part),)), 0)
+
+
+def ceiling():
+    # Room for the system prompt, the question and a little context.
+    return app.count_tokens(app.system_prompt) + 200
+
+
+def test_prompt_within_the_ceiling_is_not_clipped(metrics):
+    prompt, stats = app.compile_prompt("What are the NUST fees?", chunks(2), max_tokens=10000)
+
+    assert stats["clipped"] == []
+    assert prompt.system == app.system_prompt
+    assert prompt.context in prompt.user and "What are the NUST fees?" in prompt.user
+    assert prompt.tokens == stats["prompt_tokens"] <= 10000
+
+
+def test_system_prompt_is_the_same_for_every_question():
+    first, _ = app.compile_prompt("NUST fees?", chunks(1))
+    second, _ = app.compile_prompt("COMSATS hostels?", chunks(3), memory="Student: hi")
+
+    assert first.system == second.system
+    assert first.messages()[0] == {"role": "system", "content": app.system_prompt}
+
+
+def test_context_gets_what_the_rest_leaves(metrics):
+    prompt, stats = app.compile_prompt("What are the NUST fees?", chunks(10), max_tokens=ceiling())
+
+    assert stats["clipped"] == ["context"]
+    assert prompt.tokens <= ceiling()
+    assert prompt.context
+    assert clipped(metrics, "context") == 1
+
+
+def test_conversation_is_dropped_before_the_question(metrics):
+    memory = "Student: " + "earlier question " * 300
+
+    prompt, stats = app.compile_prompt("What are the NUST fees?", chunks(2), memory=memory, max_tokens=ceiling())
+
+    assert stats["clipped"][0] == "memory"
+    assert prompt.memory == "" and "Conversation so far" not in prompt.user
+    assert "What are the NUST fees?" in prompt.user
+    assert prompt.tokens <= ceiling()
+    assert clipped(metrics, "question") == 0
+
+
+def test_long_question_is_clipped(metrics):
+    question = "Please tell me about fees " * 200
+    query = "NUST fees " * 200
+
+    prompt, stats = app.compile_prompt(question, chunks(2), query=query, max_tokens=ceiling())
+
+    assert "question" in stats["clipped"]
+    assert prompt.tokens <= ceiling()
+    assert "Student Question: Please tell me about fees" in prompt.user
+    assert "(Interpreted as: NUST fees" in prompt.user
+    assert prompt.user.count(" …") == 2
+    assert clipped(metrics, "question") == 1
+
+
+def test_ceiling_below_the_system_prompt_raises():
+    with pytest.raises(app.PromptTooLong):
+        app.compile_prompt("What are the NUST fees?", chunks(1), max_tokens=app.count_tokens(app.system_prompt))
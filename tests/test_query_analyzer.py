@@ -0,0 +1,39 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize(
+    "question, universities, topics",
+    [
+        ("What is the fee for BS CS at NUST?", ("NUST",), ("fees", "undergraduate admissions")),
+        ("Which entry test does NUST use for BE?", ("NUST",), ("undergraduate admissions",)),
+        ("What would be the PhD fee at QAU?", ("QAU",), ("fees", "phd admissions")),
+        ("What will be the MS fee at NUST?", ("NUST",), ("fees", "graduate ms admissions")),
+        ("Can I be admitted to COMSATS with a 2.5 CGPA?", ("COMSATS",), ()),
+        ("Is the NET hard?", ("NUST",), ()),
+        ("Do I need a net worth certificate?", (), ()),
+        ("Quaid-e-Azam University scholarships", ("QAU",), ("scholarships",)),
+    ],
+)
+def test_universities_and_topics(question, universities, topics):
+    analysis = app.analyze_query(question)
+    assert analysis.universities == universities
+    assert analysis.topics == topics
+
+
+@pytest.mark.parametrize(
+    "question, comparison",
+    [
+        ("Compare NUST and UET fees", True),
+        ("NUST vs COMSATS for computer science", True),
+        ("Which university is best for PhD?", True),
+        ("Which one has the best hostels?", True),
+        ("Is NUST or QAU best for physics?", True),
+        ("What is the best university for PhD?", False),
+        ("Best scholarships at QAU", False),
+        ("What is the fee at NUST?", False),
+    ],
+)
+def test_comparison(question, comparison):
+    assert app.analyze_query(question).comparison is comparison